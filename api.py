@@ -0,0 +1,376 @@
+"""
+HTTP extraction service.
+
+A FastAPI app that exposes the vision workflows to other systems (LIS
+integrations, batch jobs) without going through the Streamlit UI:
+
+    POST   /extract           Upload a PDF (multipart field "file")
+           mode=sync          Wait and return the ExtractionResult JSON (default)
+           mode=async         Return 202 with a job ID; poll GET /jobs/{id}
+           stream=true        NDJSON: one line per extracted item, then the result
+    GET    /jobs/{id}         Job status, items streamed so far (?since=N), result
+    DELETE /jobs/{id}         Cancel a queued or running job
+    GET    /health            Liveness probe (no auth)
+
+Uploads over API_MAX_UPLOAD_MB are rejected with 413 before the form is
+parsed: on their Content-Length, or as soon as a streamed body goes over.
+
+Requests use HTTP basic auth with the ADMIN_USER/ADMIN_PASSWORD credentials
+of the Streamlit login (see auth_utils.py).
+
+Run:
+    uvicorn api:app --host 0.0.0.0 --port 8000
+    python api.py
+"""
+
+import asyncio
+import contextlib
+import json
+import os
+import time
+from typing import Any, Dict, Optional
+
+from dotenv import load_dotenv
+from fastapi import Depends, FastAPI, File, Form, HTTPException, UploadFile
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from starlette.concurrency import iterate_in_threadpool
+
+import auth_utils
+from jobs import JobManager
+from telemetry import get_logger
+from workflows import (
+    aclose_clients,
+    app_vision,
+    app_vision_async,
+    app_vision_chunked,
+    app_vision_pipelined,
+    load_prompt,
+)
+
+load_dotenv()
+
+# --- Configuration ---
+API_HOST = os.getenv("API_HOST", "0.0.0.0")
+API_PORT = int(os.getenv("API_PORT", "8000"))
+API_AUTH_ENABLED = os.getenv("API_AUTH_ENABLED", "true").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+API_MAX_UPLOAD_MB = float(os.getenv("API_MAX_UPLOAD_MB", "20"))
+API_MAX_CONCURRENCY = int(os.getenv("API_MAX_CONCURRENCY", "4"))
+API_JOB_WORKERS = int(os.getenv("API_JOB_WORKERS", "2"))
+API_DEFAULT_MODEL = os.getenv("API_DEFAULT_MODEL", "vertex/gemini-3-pro-preview")
+
+MAX_UPLOAD_BYTES = int(API_MAX_UPLOAD_MB * 1024 * 1024)
+# Multipart framing and the other form fields add a little to the file
+MAX_BODY_BYTES = MAX_UPLOAD_BYTES + 64 * 1024
+MODES = ("sync", "async")
+WORKFLOWS = {
+    "single": app_vision,
+    "chunked": app_vision_chunked,
+    "pipelined": app_vision_pipelined,
+}
+
+log = get_logger("api")
+
+
+class _BodyTooLarge(HTTPException):
+    # An HTTPException, so FastAPI's body parsing passes it on as a 413
+    def __init__(self):
+        super().__init__(
+            status_code=413, detail=f"Upload exceeds {API_MAX_UPLOAD_MB:g} MB"
+        )
+
+
+class UploadLimitMiddleware:
+    """
+    ASGI middleware that caps request bodies at `max_body_bytes`: a larger
+    Content-Length is rejected before any of the body is read, and a body
+    without one (chunked) is cut off as soon as it goes over.
+    """
+
+    def __init__(self, app, max_body_bytes: int):
+        self.app = app
+        self.max_body_bytes = max_body_bytes
+
+    async def _reject(self, send):
+        await JSONResponse(
+            status_code=413,
+            content={"detail": f"Upload exceeds {API_MAX_UPLOAD_MB:g} MB"},
+        )({"type": "http"}, None, send)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        content_length = headers.get(b"content-length")
+        if content_length is not None:
+            try:
+                too_large = int(content_length) > self.max_body_bytes
+            except ValueError:
+                too_large = False
+            if too_large:
+                await self._reject(send)
+                return
+
+        received = 0
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_bytes:
+                    raise _BodyTooLarge()
+            return message
+
+        async def tracked_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracked_send)
+        except _BodyTooLarge:
+            if response_started:
+                raise
+            await self._reject(send)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    job_manager.shutdown(wait=False)
+    await aclose_clients()
+
+
+app = FastAPI(title="Clinical PDF Extractor", version="0.6.3", lifespan=lifespan)
+app.add_middleware(UploadLimitMiddleware, max_body_bytes=MAX_BODY_BYTES)
+security = HTTPBasic(auto_error=False)
+
+# Sync and streamed requests in flight; async jobs use the JobManager pool
+_request_slots: Optional[asyncio.Semaphore] = None
+job_manager = JobManager(max_workers=API_JOB_WORKERS)
+
+
+def _slots() -> asyncio.Semaphore:
+    # Created lazily so it binds to the server's event loop
+    global _request_slots
+    if _request_slots is None:
+        _request_slots = asyncio.Semaphore(max(1, API_MAX_CONCURRENCY))
+    return _request_slots
+
+
+def authenticate(
+    credentials: Optional[HTTPBasicCredentials] = Depends(security),
+) -> str:
+    """Returns the authenticated username (or "anonymous" with auth disabled)."""
+    if not API_AUTH_ENABLED:
+        return "anonymous"
+    if credentials is None or not auth_utils.check_credentials(
+        credentials.username, credentials.password
+    ):
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid credentials",
+            headers={"WWW-Authenticate": "Basic"},
+        )
+    return credentials.username
+
+
+async def _read_pdf(file: UploadFile) -> bytes:
+    """
+    Reads the upload, enforcing API_MAX_UPLOAD_MB and a PDF signature. The
+    whole body was already capped by UploadLimitMiddleware; this is the exact
+    check on the file.
+    """
+    pdf_bytes = await file.read(MAX_UPLOAD_BYTES + 1)
+    if len(pdf_bytes) > MAX_UPLOAD_BYTES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Upload exceeds {API_MAX_UPLOAD_MB:g} MB",
+        )
+    if not pdf_bytes.startswith(b"%PDF"):
+        raise HTTPException(status_code=415, detail="The upload is not a PDF")
+    return pdf_bytes
+
+
+def _result_payload(result: Dict[str, Any], elapsed: float) -> Dict[str, Any]:
+    """JSON response for a finished run; `result` is the ExtractionResult."""
+    extracted_data = result.get("extracted_data") or []
+    errors = result.get("errors") or []
+    return {
+        "status": "ok" if extracted_data and not errors else "error",
+        "trace_id": result.get("trace_id"),
+        "pages": len(
+            result.get("images")
+            or result.get("page_timings")
+            or result.get("text_pages")
+            or []
+        ),
+        "cache_hit": bool(result.get("cache_hit")),
+        "collapsed": bool(result.get("collapsed")),
+        "page_filter": result.get("page_filter"),
+        "elapsed_seconds": round(elapsed, 3),
+        # Every workflow merges the document into a single entry
+        "result": extracted_data[0]["content"] if extracted_data else None,
+        "errors": errors,
+    }
+
+
+def _job_payload(job, since: int = 0) -> Dict[str, Any]:
+    payload = {
+        "job_id": job.id,
+        "name": job.name,
+        "status": job.status,
+        "elapsed_seconds": round(job.elapsed, 3),
+        "first_field_seconds": job.first_field_time,
+        "items": job.items[since:],
+        "error": job.error,
+    }
+    if job.result is not None:
+        payload["result"] = _result_payload(job.result, job.result["elapsed_time"])
+    return payload
+
+
+def _ndjson(payload: Dict[str, Any]) -> bytes:
+    return (json.dumps(payload, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+async def _stream_events(workflow: str, initial_state: Dict[str, Any]):
+    """(mode, chunk) events of a run; sync workflows stream from a worker thread."""
+    if workflow == "single":
+        async for event in app_vision_async.astream(
+            initial_state, stream_mode=["custom", "values"]
+        ):
+            yield event
+    else:
+        events = WORKFLOWS[workflow].stream(
+            initial_state, stream_mode=["custom", "values"]
+        )
+        async for event in iterate_in_threadpool(events):
+            yield event
+
+
+async def _stream_extraction(workflow: str, initial_state: Dict[str, Any]):
+    """NDJSON body: {"type": "item", ...} per field, then {"type": "result", ...}."""
+    async with _slots():
+        start = time.perf_counter()
+        result = initial_state
+        try:
+            async for mode, chunk in _stream_events(workflow, initial_state):
+                if mode == "values":
+                    result = chunk
+                elif chunk.get("type") == "item":
+                    yield _ndjson(chunk)
+        except Exception as e:
+            log.exception("Streamed extraction failed")
+            yield _ndjson({"type": "error", "error": f"{type(e).__name__}: {e}"})
+            return
+        yield _ndjson(
+            {"type": "result", **_result_payload(result, time.perf_counter() - start)}
+        )
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok", "jobs": job_manager.stats()}
+
+
+@app.post("/extract")
+async def extract(
+    file: UploadFile = File(...),
+    mode: str = Form("sync"),
+    stream: bool = Form(False),
+    model: str = Form(API_DEFAULT_MODEL),
+    workflow: str = Form("single"),
+    system_prompt: Optional[str] = Form(None),
+    use_cache: bool = Form(True),
+    username: str = Depends(authenticate),
+):
+    if mode not in MODES:
+        raise HTTPException(status_code=422, detail=f"mode must be one of {MODES}")
+    if workflow not in WORKFLOWS:
+        raise HTTPException(
+            status_code=422, detail=f"workflow must be one of {sorted(WORKFLOWS)}"
+        )
+    pdf_bytes = await _read_pdf(file)
+    initial_state = {
+        "pdf_bytes": pdf_bytes,
+        "images": [],
+        "extracted_data": [],
+        "errors": [],
+        "model_name": model,
+        "system_prompt": system_prompt or load_prompt("vision_extraction.md"),
+        "use_cache": use_cache,
+    }
+    log.info(
+        "Extraction request for %s (%d bytes, %s)",
+        file.filename,
+        len(pdf_bytes),
+        mode,
+        extra={
+            "event": "api.extract",
+            "mode": mode,
+            "stream": stream,
+            "workflow": workflow,
+            "bytes": len(pdf_bytes),
+        },
+    )
+
+    if mode == "async":
+        job = job_manager.submit(
+            file.filename or "document.pdf",
+            WORKFLOWS[workflow],
+            initial_state,
+            owner=username,
+        )
+        return JSONResponse(
+            status_code=202,
+            content=_job_payload(job),
+            headers={"Location": f"/jobs/{job.id}"},
+        )
+
+    if stream:
+        return StreamingResponse(
+            _stream_extraction(workflow, initial_state),
+            media_type="application/x-ndjson",
+        )
+
+    async with _slots():
+        start = time.perf_counter()
+        if workflow == "single":
+            result = await app_vision_async.ainvoke(initial_state)
+        else:
+            result = await asyncio.to_thread(WORKFLOWS[workflow].invoke, initial_state)
+    return _result_payload(result, time.perf_counter() - start)
+
+
+def _owned_job(job_id: str, username: str):
+    job = job_manager.get(job_id)
+    if job is None or job.metadata.get("owner") != username:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, since: int = 0, username: str = Depends(authenticate)):
+    """`since` skips items the client has already seen (partial results)."""
+    return _job_payload(_owned_job(job_id, username), since=max(0, since))
+
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str, username: str = Depends(authenticate)):
+    job = _owned_job(job_id, username)
+    return {"job_id": job.id, "cancelled": job_manager.cancel(job.id)}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host=API_HOST, port=API_PORT)
@@ -1,9 +1,20 @@
 import streamlit as st
 import os
+import io
 import base64
-import base64
-from workflows import app_vision
+import threading
+from collections import OrderedDict
+from workflows import (
+    app_vision,
+    app_vision_chunked,
+    app_vision_pipelined,
+    client_stats,
+)
+from singleflight import extraction_flights
+import jobs
+from records import DocumentRecords
 import utils
+from cache import extraction_cache, hash_pdf
 from dotenv import load_dotenv
 
 import auth_utils
@@ -18,6 +29,288 @@ st.set_page_config(
     initial_sidebar_state="collapsed",
 )
 
+# --- Caching ---
+# Everything below is keyed by the PDF hash, so Streamlit reruns (any widget
+# change) reuse the preview, the rasterized pages and the annotated overlays.
+APP_CACHE_MAX_DOCUMENTS = int(os.getenv("APP_CACHE_MAX_DOCUMENTS", "8"))
+APP_CACHE_MAX_RENDERED_PAGES = int(os.getenv("APP_CACHE_MAX_RENDERED_PAGES", "200"))
+APP_PREVIEW_WIDTH = int(os.getenv("APP_PREVIEW_WIDTH", "1200")) or None
+
+# Define color mapping
+COLOR_MAPPING = {
+    "Paciente": "red",
+    "FechaNacimiento": "red",
+    "Sexo": "red",
+    "DocumentoIdentidad": "red",
+    "Telefono": "red",
+    "NombreMedico": "purple",
+    "NumeroColegiado": "purple",
+    "NumeroPeticion": "blue",
+}
+
+
+@st.cache_data(max_entries=APP_CACHE_MAX_DOCUMENTS)
+def build_pdf_preview(file_hash: str, _pdf_bytes: bytes) -> str:
+    """Builds the base64 iframe for the PDF preview once per file."""
+    base64_pdf = base64.b64encode(_pdf_bytes).decode("utf-8")
+    return f'<iframe src="data:application/pdf;base64,{base64_pdf}#view=FitH" width="100%" height="1200" type="application/pdf"></iframe>'
+
+
+@st.cache_resource
+def _page_image_store():
+    """Process-wide LRU of rasterized pages, shared by all sessions."""
+    return {"lock": threading.Lock(), "pages": OrderedDict()}
+
+
+def remember_page_images(file_hash: str, images):
+    store = _page_image_store()
+    with store["lock"]:
+        store["pages"][file_hash] = images
+        store["pages"].move_to_end(file_hash)
+        while len(store["pages"]) > APP_CACHE_MAX_DOCUMENTS:
+            store["pages"].popitem(last=False)
+
+
+def get_page_images(file_hash: str, pdf_bytes: bytes):
+    """
+    Returns the rasterized pages of a document, reusing the workflow's
+    images when available. The images are shared: copy before drawing.
+    """
+    store = _page_image_store()
+    with store["lock"]:
+        images = store["pages"].get(file_hash)
+        if images is not None:
+            store["pages"].move_to_end(file_hash)
+            return images
+    # The text path does not rasterize; render pages for the overlays
+    images = utils.pdf_to_images(pdf_bytes=pdf_bytes, workers=os.cpu_count())
+    remember_page_images(file_hash, images)
+    return images
+
+
+@st.cache_data(max_entries=APP_CACHE_MAX_RENDERED_PAGES)
+def render_annotated_page(
+    file_hash: str,
+    page_num: int,
+    page_elements,
+    page_tests,
+    page_urine,
+    _pdf_bytes: bytes,
+):
+    """Draws the bounding boxes of one page; cached per file, page and boxes."""
+    page_images = get_page_images(file_hash, _pdf_bytes)
+    page_idx = page_num - 1
+    if not 0 <= page_idx < len(page_images):
+        return None
+
+    # Collect every box of the page and draw them in a single pass
+    boxes = [
+        {
+            "bbox": element.get("bounding_box"),
+            "label": element["label"],
+            "color": COLOR_MAPPING.get(element["label"], "green"),
+        }
+        for element in page_elements
+    ]
+    boxes += [
+        {
+            "bbox": test.get("bounding_box"),
+            "label": test["description"],
+            "color": "yellow",
+        }
+        for test in page_tests
+    ]
+    if page_urine:
+        boxes.append(
+            {
+                "bbox": page_urine.get("bounding_box"),
+                "label": "Urine Info",
+                "color": "#FFD700",  # Gold/Yellow
+            }
+        )
+
+    image = utils.draw_bounding_boxes(
+        page_images[page_idx], boxes, preview_width=APP_PREVIEW_WIDTH
+    )
+
+    buffered = io.BytesIO()
+    image.convert("RGB").save(buffered, format="JPEG", quality=90)
+    return buffered.getvalue()
+
+
+# --- Background Jobs ---
+JOBS_POLL_SECONDS = float(os.getenv("JOBS_POLL_SECONDS", "1"))
+JOB_STATUS_ICONS = {
+    jobs.QUEUED: "⏳",
+    jobs.RUNNING: "⚙️",
+    jobs.DONE: "✅",
+    jobs.FAILED: "❌",
+    jobs.CANCELLED: "🚫",
+}
+
+
+@st.cache_resource
+def get_job_manager() -> jobs.JobManager:
+    """One worker pool per server process, shared by all sessions."""
+    return jobs.JobManager()
+
+
+def session_jobs(manager: jobs.JobManager):
+    """Jobs started by this browser session, oldest first."""
+    return [
+        job
+        for job in (
+            manager.get(job_id) for job_id in st.session_state.get("job_ids", [])
+        )
+        if job is not None
+    ]
+
+
+def collect_finished_jobs(manager: jobs.JobManager) -> bool:
+    """
+    Moves the results of finished jobs into the session (and their pages into
+    the page store). Returns True if any new result arrived.
+    """
+    collected = st.session_state.setdefault("collected_jobs", set())
+    results = st.session_state.setdefault("results", {})
+    new_results = False
+    for job in session_jobs(manager):
+        if not job.finished or job.id in collected:
+            continue
+        collected.add(job.id)
+        file_hash = job.metadata["file_hash"]
+        if job.status == jobs.DONE:
+            summary = dict(job.result)
+            images = summary.pop("images")
+            if images:
+                remember_page_images(file_hash, images)
+            # Compact columns instead of the nested result dicts
+            summary["records"] = DocumentRecords.from_result(
+                summary.pop("extracted_data"),
+                doc_id=file_hash,
+                trace_id=summary.get("trace_id"),
+            )
+            results[file_hash] = summary
+            new_results = True
+        elif job.status == jobs.FAILED:
+            results[file_hash] = {
+                "records": DocumentRecords(file_hash),
+                "errors": [f"An error occurred during execution: {job.error}"],
+                "cache_hit": False,
+                "elapsed_time": job.elapsed,
+                "first_field_time": None,
+            }
+            new_results = True
+    return new_results
+
+
+def render_live_item(section: str, item):
+    if section == "elements":
+        st.markdown(
+            f"**{item.get('label')}**: {item.get('value')} "
+            f"(page {item.get('page_number')})"
+        )
+    elif section == "tests":
+        st.markdown(
+            f"🧪 {item.get('description')} "
+            f"({item.get('sample_type') or '-'}, page {item.get('page_number')})"
+        )
+    else:
+        st.markdown(f"💧 Urine collection: {item.get('collection_type')}")
+
+
+def render_jobs_panel():
+    """Job list with live progress; runs as a polling fragment while jobs are active."""
+    manager = get_job_manager()
+    job_list = session_jobs(manager)
+    if not job_list:
+        return
+    st.markdown("### Extraction Jobs")
+    for job in job_list:
+        col_status, col_cancel = st.columns([5, 1])
+        fields = (
+            f", {len(job.items)} fields so far" if job.status == jobs.RUNNING else ""
+        )
+        col_status.markdown(
+            f"{JOB_STATUS_ICONS[job.status]} **{job.name}** — {job.status}"
+            f" ({job.elapsed:.1f}s{fields})"
+        )
+        if not job.finished and col_cancel.button("Cancel", key=f"cancel_{job.id}"):
+            manager.cancel(job.id)
+            st.rerun()
+        if job.status == jobs.RUNNING and job.items:
+            # Fields streamed so far, as soon as each one is parsed
+            with st.expander(f"Live results: {job.name}", expanded=True):
+                for event in list(job.items):
+                    render_live_item(event["section"], event["item"])
+    # Show the results of jobs that finished since the last run
+    if collect_finished_jobs(manager):
+        st.rerun()
+
+
+def render_extraction_results(file_hash: str, pdf_bytes: bytes, result):
+    """Displays the stored extraction result grouped by page."""
+    # Display Results
+    if result.get("errors"):
+        for error in result["errors"]:
+            st.error(error)
+
+    records = result["records"]
+    if not len(records):
+        st.info("No data extracted.")
+        return
+
+    if not records.sections["elements"] and not records.sections["tests"]:
+        st.warning("No data found.")
+        return
+
+    # Rows are materialized per page from the compact records
+    for page_num in records.pages():
+        page_rows = records.page_rows(page_num)
+        page_elements = page_rows["elements"]
+        page_tests = page_rows["tests"]
+        page_urine = (page_rows["urine_details"] or [None])[0]
+
+        with st.expander(f"Page {page_num} - Extracted Data", expanded=True):
+            # 1. Display General Elements
+            if page_elements:
+                st.markdown("### General Information")
+                for element in page_elements:
+                    st.markdown(f"**{element['label']}**: {element['value']}")
+
+            # 2. Display Tests
+            if page_tests:
+                st.markdown("### Clinical Tests")
+                st.table(page_tests)
+
+            # 3. Display Urine Details
+            if page_urine:
+                st.markdown("### Urine Details")
+                st.json(page_urine)
+
+            # 4. Draw Bounding Boxes
+            try:
+                annotated_page = render_annotated_page(
+                    file_hash,
+                    page_num,
+                    page_elements,
+                    page_tests,
+                    page_urine,
+                    pdf_bytes,
+                )
+                if annotated_page:
+                    st.image(
+                        annotated_page,
+                        caption=f"Visualized Page {page_num}",
+                        width="stretch",
+                    )
+                else:
+                    st.warning(f"Page number {page_num} out of range for images.")
+
+            except Exception as img_e:
+                st.warning(f"Could not visualize bounding boxes: {img_e}")
+
+
 # --- Authentication ---
 authenticator = auth_utils.setup_authenticator()
 try:
@@ -74,6 +367,25 @@ if st.session_state["authentication_status"]:
             help="Enter the model ID supported by Requesty (e.g., gpt-4o, claude-3-5-sonnet-20240620)",
         )
 
+        extraction_mode = st.selectbox(
+            "Extraction Mode",
+            ["Single request", "Concurrent page chunks", "Pipelined page chunks"],
+            help="Concurrent mode splits the document into page chunks extracted in parallel. "
+            "Pipelined mode also starts each chunk while later pages are still being rendered.",
+        )
+        chunk_size = None
+        max_concurrency = None
+        if extraction_mode != "Single request":
+            chunk_size = st.number_input(
+                "Pages per chunk",
+                min_value=0,
+                value=0,
+                help="0 plans the chunks from the model's token and latency budget.",
+            )
+            max_concurrency = st.number_input(
+                "Max concurrent requests", min_value=1, max_value=16, value=4
+            )
+
         st.markdown("---")
         st.markdown("### API Status")
 
@@ -82,6 +394,38 @@ if st.session_state["authentication_status"]:
         else:
             st.error("Requesty API Key missing")
 
+        for base_url, stats in client_stats().items():
+            st.caption(
+                f"{base_url}: {stats['requests']} requests, "
+                f"{stats['connections_reused']} on reused connections"
+            )
+        flight_stats = extraction_flights.stats()
+        if flight_stats["collapsed"]:
+            st.caption(
+                f"Duplicate extractions collapsed: {flight_stats['collapsed']} "
+                f"({flight_stats['collapse_rate']:.0%} of model calls)"
+            )
+
+        st.markdown("---")
+        st.markdown("### Extraction Cache")
+        use_cache = st.checkbox(
+            "Use cached results",
+            value=True,
+            help="Reuse previous results for the same PDF, model and prompt.",
+        )
+        cache_stats = extraction_cache.stats()
+        st.caption(
+            f"Hits: {cache_stats['hits']} | Misses: {cache_stats['misses']} "
+            f"| Hit rate: {cache_stats['hit_rate']:.0%}"
+        )
+        st.caption(
+            f"Entries: {cache_stats['entries']} "
+            f"({cache_stats['size_bytes'] / 1024:.1f} KB)"
+        )
+        if st.button("Clear Cache"):
+            extraction_cache.clear()
+            st.rerun()
+
     # --- Main Content ---
     st.title("📄 Clinical Analysis Extractor")
     st.markdown("Upload a clinical analysis PDF to extract structured data.")
@@ -102,218 +446,121 @@ if st.session_state["authentication_status"]:
             help="Modify the instructions for the AI extractor.",
         )
 
-    uploaded_file = st.file_uploader("Choose a PDF file", type="pdf")
+    uploaded_files = st.file_uploader(
+        "Choose PDF files", type="pdf", accept_multiple_files=True
+    )
+
+    if uploaded_files:
+        # Hash each upload once; reruns look it up by Streamlit's file id
+        file_hashes = st.session_state.setdefault("file_hashes", {})
+        documents = {}
+        for uploaded_file in uploaded_files:
+            file_bytes = uploaded_file.getvalue()
+            if uploaded_file.file_id not in file_hashes:
+                file_hashes[uploaded_file.file_id] = hash_pdf(file_bytes)
+            documents[file_hashes[uploaded_file.file_id]] = (
+                uploaded_file.name,
+                file_bytes,
+            )
+        results = st.session_state.setdefault("results", {})
+        session_job_ids = st.session_state.setdefault("job_ids", [])
+        manager = get_job_manager()
+
+        active_hashes = {
+            job.metadata["file_hash"]
+            for job in session_jobs(manager)
+            if not job.finished
+        }
+        pending = [
+            file_hash for file_hash in documents if file_hash not in active_hashes
+        ]
+        if st.button(
+            f"Start Extraction ({len(pending)} document{'s' if len(pending) != 1 else ''})",
+            disabled=not pending,
+        ):
+            workflow_app = {
+                "Concurrent page chunks": app_vision_chunked,
+                "Pipelined page chunks": app_vision_pipelined,
+            }.get(extraction_mode, app_vision)
+            for file_hash in pending:
+                name, file_bytes = documents[file_hash]
+                initial_state = {
+                    "pdf_bytes": file_bytes,
+                    "images": [],
+                    "extracted_data": [],
+                    "errors": [],
+                    "model_name": model_name,
+                    "system_prompt": system_prompt,
+                    "use_cache": use_cache,
+                    "chunk_size": chunk_size,
+                    "max_concurrency": max_concurrency,
+                }
+                job = manager.submit(
+                    name, workflow_app, initial_state, file_hash=file_hash
+                )
+                session_job_ids.append(job.id)
+                results.pop(file_hash, None)
+            st.rerun()
+
+        collect_finished_jobs(manager)
+        has_active_jobs = any(not job.finished for job in session_jobs(manager))
+        # Poll only while something is queued or running
+        st.fragment(
+            render_jobs_panel, run_every=JOBS_POLL_SECONDS if has_active_jobs else None
+        )()
+
+        if len(documents) > 1:
+            file_hash = st.selectbox(
+                "Document",
+                list(documents),
+                format_func=lambda file_hash: documents[file_hash][0],
+            )
+        else:
+            file_hash = next(iter(documents))
+        file_bytes = documents[file_hash][1]
 
-    if uploaded_file is not None:
         col1, col2 = st.columns([1, 1])
 
         with col1:
             st.subheader("Original Document")
             # Display PDF
-            base64_pdf = base64.b64encode(uploaded_file.read()).decode("utf-8")
-            uploaded_file.seek(0)  # Reset pointer
-            pdf_display = f'<iframe src="data:application/pdf;base64,{base64_pdf}#view=FitH" width="100%" height="1200" type="application/pdf"></iframe>'
-            st.markdown(pdf_display, unsafe_allow_html=True)
+            st.markdown(
+                build_pdf_preview(file_hash, file_bytes), unsafe_allow_html=True
+            )
 
         with col2:
             st.subheader("Extracted Information")
 
-            col_btn, col_timer = st.columns([1, 2])
-            with col_btn:
-                start_btn = st.button("Start Extraction")
-
-            timer_placeholder = col_timer.empty()
-
-            if start_btn:
-                import time
-
-                start_time = time.time()
-
-                with st.spinner("Processing document..."):
-                    # Prepare state
-                    file_bytes = uploaded_file.read()
-                    initial_state = {
-                        "pdf_bytes": file_bytes,
-                        "images": [],
-                        "extracted_data": [],
-                        "errors": [],
-                        "model_name": model_name,
-                        "system_prompt": system_prompt,
-                    }
-
-                    # Run Workflow
-                    try:
-                        result = app_vision.invoke(initial_state)
-
-                        end_time = time.time()
-                        elapsed_time = end_time - start_time
-                        timer_placeholder.success(
-                            f"Extraction completed in {elapsed_time:.2f} seconds"
-                        )
-
-                        # Display Results
-                        if result.get("errors"):
-                            for error in result["errors"]:
-                                st.error(error)
-
-                        data = result.get("extracted_data", [])
-                        if not data:
-                            st.info("No data extracted.")
-
-                        # Group elements by page
-                        elements_by_page = {}
-                        tests_by_page = {}
-                        urine_details_by_page = {}
-
-                        all_elements = []
-                        all_tests = []
-                        all_urine_details = []
-
-                        # Flatten all elements from all extraction results
-                        for item in data:
-                            content = item["content"]
-                            all_elements.extend(content.get("elements", []))
-                            all_tests.extend(content.get("tests", []))
-
-                            urine = content.get("urine_details")
-                            if urine:
-                                all_urine_details.append(urine)
-
-                        if not all_elements and not all_tests:
-                            st.warning("No data found.")
-                        else:
-                            # Group by page number
-                            for element in all_elements:
-                                page_num = element.get("page_number")
-                                if page_num:
-                                    if page_num not in elements_by_page:
-                                        elements_by_page[page_num] = []
-                                    elements_by_page[page_num].append(element)
-
-                            for test in all_tests:
-                                page_num = test.get("page_number")
-                                if page_num:
-                                    if page_num not in tests_by_page:
-                                        tests_by_page[page_num] = []
-                                    tests_by_page[page_num].append(test)
-
-                            for urine in all_urine_details:
-                                page_num = urine.get("page_number")
-                                if page_num:
-                                    urine_details_by_page[page_num] = urine
-
-                            # Sort pages
-                            all_pages = (
-                                set(elements_by_page.keys())
-                                | set(tests_by_page.keys())
-                                | set(urine_details_by_page.keys())
-                            )
-                            sorted_pages = sorted(all_pages)
-
-                            for page_num in sorted_pages:
-                                page_elements = elements_by_page.get(page_num, [])
-                                page_tests = tests_by_page.get(page_num, [])
-                                page_urine = urine_details_by_page.get(page_num)
-
-                                with st.expander(
-                                    f"Page {page_num} - Extracted Data", expanded=True
-                                ):
-                                    # 1. Display General Elements
-                                    if page_elements:
-                                        st.markdown("### General Information")
-                                        for element in page_elements:
-                                            st.markdown(
-                                                f"**{element['label']}**: {element['value']}"
-                                            )
-
-                                    # 2. Display Tests
-                                    if page_tests:
-                                        st.markdown("### Clinical Tests")
-                                        st.table(page_tests)
-
-                                    # 3. Display Urine Details
-                                    if page_urine:
-                                        st.markdown("### Urine Details")
-                                        st.json(page_urine)
-
-                                    # 4. Draw Bounding Boxes
-                                    try:
-                                        if "images" in result:
-                                            page_idx = page_num - 1
-                                            if 0 <= page_idx < len(result["images"]):
-                                                # Create a copy of the image to draw on
-                                                image = result["images"][
-                                                    page_idx
-                                                ].copy()
-
-                                                # Define color mapping
-                                                COLOR_MAPPING = {
-                                                    "Paciente": "red",
-                                                    "FechaNacimiento": "red",
-                                                    "Sexo": "red",
-                                                    "DocumentoIdentidad": "red",
-                                                    "Telefono": "red",
-                                                    "NombreMedico": "purple",
-                                                    "NumeroColegiado": "purple",
-                                                    "NumeroPeticion": "blue",
-                                                }
-
-                                                # Draw General Elements
-                                                for element in page_elements:
-                                                    if element.get("bounding_box"):
-                                                        box_color = COLOR_MAPPING.get(
-                                                            element["label"], "green"
-                                                        )
-                                                        image = utils.draw_bounding_box(
-                                                            image,
-                                                            element["bounding_box"],
-                                                            label=element["label"],
-                                                            color=box_color,
-                                                        )
-
-                                                # Draw Tests (Orange)
-                                                # Draw Test boxes
-                                                for test in page_tests:
-                                                    if test.get("bounding_box"):
-                                                        image = utils.draw_bounding_box(
-                                                            image,
-                                                            test["bounding_box"],
-                                                            label=test["description"],
-                                                            color="yellow",
-                                                        )
-
-                                                # Draw Urine Details (Yellow)
-                                                if page_urine and page_urine.get(
-                                                    "bounding_box"
-                                                ):
-                                                    image = utils.draw_bounding_box(
-                                                        image,
-                                                        page_urine["bounding_box"],
-                                                        label="Urine Info",
-                                                        color="#FFD700",  # Gold/Yellow
-                                                    )
-
-                                                st.image(
-                                                    image,
-                                                    caption=f"Visualized Page {page_num}",
-                                                    width="stretch",
-                                                )
-                                            else:
-                                                st.warning(
-                                                    f"Page number {page_num} out of range for images."
-                                                )
-                                        else:
-                                            st.warning(
-                                                "Images not available for visualization."
-                                            )
-
-                                    except Exception as img_e:
-                                        st.warning(
-                                            f"Could not visualize bounding boxes: {img_e}"
-                                        )
-
-                    except Exception as e:
-                        st.error(f"An error occurred during execution: {str(e)}")
+            # Results survive reruns (widget changes, expanding pages)
+            stored = results.get(file_hash)
+            if stored:
+                cache_note = " (cached)" if stored["cache_hit"] else ""
+                if stored.get("collapsed"):
+                    cache_note = " (shared with an identical in-flight extraction)"
+                first_field_note = (
+                    f", first field after {stored['first_field_time']:.2f} seconds"
+                    if stored["first_field_time"] is not None
+                    else ""
+                )
+                st.success(
+                    f"Extraction completed in {stored['elapsed_time']:.2f} seconds"
+                    f"{first_field_note}{cache_note}"
+                )
+                page_filter = stored.get("page_filter") or {}
+                if page_filter.get("pages_dropped"):
+                    saved_kb = page_filter.get("bytes_saved", 0) / 1024
+                    st.caption(
+                        f"Skipped {len(page_filter['blank_pages'])} blank and "
+                        f"{len(page_filter['duplicate_pages'])} duplicate pages "
+                        f"(about {saved_kb:.0f} KB not uploaded)."
+                    )
+                if stored.get("trace_id"):
+                    st.caption(f"Trace ID: `{stored['trace_id']}`")
+                render_extraction_results(file_hash, file_bytes, stored)
+            elif file_hash in active_hashes:
+                st.info("Extraction in progress, results will appear here.")
+            else:
+                st.info("Press Start Extraction to process this document.")
 
     else:
         st.info("Please upload a PDF to begin.")
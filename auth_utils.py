@@ -1,19 +1,36 @@
-import streamlit as st
-import streamlit_authenticator as stauth
 import os
+import secrets
 import yaml
 from yaml.loader import SafeLoader
 
 
+def get_admin_credentials():
+    """
+    Returns the (username, password) pair shared by the Streamlit login and
+    the HTTP API, from ADMIN_USER/ADMIN_PASSWORD.
+    """
+    # Default to 'admin'/'admin' if not set (ONLY FOR DEV/FALLBACK)
+    return os.getenv("ADMIN_USER", "admin"), os.getenv("ADMIN_PASSWORD", "admin")
+
+
+def check_credentials(username: str, password: str) -> bool:
+    """Constant-time comparison against the admin credentials."""
+    admin_user, admin_password = get_admin_credentials()
+    user_ok = secrets.compare_digest(username.encode(), admin_user.encode())
+    password_ok = secrets.compare_digest(password.encode(), admin_password.encode())
+    return user_ok and password_ok
+
+
 def setup_authenticator():
     """
     Sets up the Streamlit Authenticator using environment variables.
     Returns the authenticator object.
     """
+    # Imported here so the HTTP API can check credentials without Streamlit
+    import streamlit_authenticator as stauth
+
     # Get configuration from environment variables
-    # Default to 'admin'/'admin' if not set (ONLY FOR DEV/FALLBACK)
-    admin_user = os.getenv("ADMIN_USER", "admin")
-    admin_password = os.getenv("ADMIN_PASSWORD", "admin")
+    admin_user, admin_password = get_admin_credentials()
     auth_secret = os.getenv("AUTH_SECRET", "some_random_secret_key")
 
     # In a real scenario, we might want to hash the password if it's not already hashed.
@@ -0,0 +1,314 @@
+"""
+Headless batch extraction of PDF files to JSONL.
+
+Example:
+    python batch_extract.py reports/ "archive/**/*.pdf" -o results.jsonl --workers 4
+
+Each finished document is appended to the output file immediately, so an
+interrupted run can be resumed: documents whose hash already has an "ok"
+record for the same model and prompt in the output file are skipped. With
+--parquet DIR, the elements, tests and urine details of every successful
+document are also appended to date-partitioned Parquet datasets under DIR
+(see records.py).
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from cache import hash_pdf
+from records import DocumentRecords, ParquetWriter
+from workflows import (
+    app_vision,
+    app_vision_chunked,
+    app_vision_pipelined,
+    load_prompt,
+)
+
+WORKFLOWS = {
+    "single": app_vision,
+    "chunked": app_vision_chunked,
+    "pipelined": app_vision_pipelined,
+}
+
+
+def collect_pdf_paths(inputs: List[str]) -> List[str]:
+    """Expands files, directories (recursively) and glob patterns into PDF paths."""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            pattern = os.path.join(item, "**", "*")
+            matches = glob.glob(pattern, recursive=True)
+        elif os.path.isfile(item):
+            matches = [item]
+        else:
+            matches = glob.glob(item, recursive=True)
+        paths.extend(
+            path
+            for path in sorted(matches)
+            if path.lower().endswith(".pdf") and os.path.isfile(path)
+        )
+
+    # Keep the first occurrence of each path
+    seen = set()
+    unique_paths = []
+    for path in paths:
+        real_path = os.path.realpath(path)
+        if real_path not in seen:
+            seen.add(real_path)
+            unique_paths.append(path)
+    return unique_paths
+
+
+# (document sha256, model, system prompt sha256)
+ResumeKey = Tuple[str, str, str]
+
+
+def hash_prompt(system_prompt: str) -> str:
+    return hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+
+
+def load_completed_keys(output_path: str) -> Set[ResumeKey]:
+    """Returns the resume keys of documents already extracted successfully."""
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # Truncated line from an interrupted run
+            if record.get("status") == "ok" and record.get("sha256"):
+                completed.add(
+                    (record["sha256"], record.get("model"), record.get("prompt_sha256"))
+                )
+    return completed
+
+
+def extract_document(
+    path: str,
+    args: argparse.Namespace,
+    system_prompt: str,
+    claim: Callable[[ResumeKey], bool] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Runs the workflow for a single document and builds its JSONL record.
+    The document is skipped (None is returned) when `claim` rejects its resume
+    key because it was already extracted.
+    """
+    start = time.perf_counter()
+    # Read and hash inside the worker so only in-flight documents are held in
+    # memory and the first submit does not wait for every file to be hashed
+    with open(path, "rb") as f:
+        pdf_bytes = f.read()
+    file_hash = hash_pdf(pdf_bytes)
+    prompt_hash = hash_prompt(system_prompt)
+    if claim and not claim((file_hash, args.model, prompt_hash)):
+        return None
+    initial_state = {
+        "pdf_bytes": pdf_bytes,
+        "images": [],
+        "extracted_data": [],
+        "errors": [],
+        "model_name": args.model,
+        "system_prompt": system_prompt,
+        "use_cache": not args.no_cache,
+        "chunk_size": args.chunk_size,
+        "max_concurrency": args.chunk_concurrency,
+    }
+    try:
+        result = WORKFLOWS[args.workflow].invoke(initial_state)
+        errors = result.get("errors", [])
+        extracted_data = result.get("extracted_data", [])
+        pages = len(
+            result.get("images")
+            or result.get("page_timings")
+            or result.get("text_pages")
+            or []
+        )
+        trace_id = result.get("trace_id")
+        page_filter = result.get("page_filter")
+    except Exception as e:
+        errors = [f"{type(e).__name__}: {str(e)}"]
+        extracted_data = []
+        pages = 0
+        trace_id = None
+        page_filter = None
+
+    return {
+        "file": path,
+        "sha256": file_hash,
+        "model": args.model,
+        "prompt_sha256": prompt_hash,
+        "workflow": args.workflow,
+        "status": "ok" if extracted_data and not errors else "error",
+        "pages": pages,
+        "elapsed_seconds": round(time.perf_counter() - start, 3),
+        "finished_at": datetime.now(timezone.utc).isoformat(),
+        "trace_id": trace_id,  # Matches the node.end log records of this run
+        "page_filter": page_filter,  # Blank/duplicate pages not uploaded
+        "extracted_data": extracted_data,
+        "errors": errors,
+    }
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def print_summary(records: List[Dict[str, Any]], skipped: int, wall_seconds: float):
+    latencies = [record["elapsed_seconds"] for record in records]
+    ok = sum(1 for record in records if record["status"] == "ok")
+    pages = sum(record["pages"] for record in records)
+    print("\n=== Batch Summary ===")
+    print(f"Documents: {ok} ok, {len(records) - ok} failed, {skipped} skipped")
+    print(f"Wall time: {wall_seconds:.1f}s")
+    if wall_seconds > 0 and records:
+        print(
+            f"Throughput: {len(records) / wall_seconds * 60:.1f} docs/min, "
+            f"{pages / wall_seconds:.2f} pages/s"
+        )
+    if latencies:
+        print(
+            f"Latency: p50 {percentile(latencies, 50):.1f}s, "
+            f"p95 {percentile(latencies, 95):.1f}s, max {max(latencies):.1f}s"
+        )
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Extract clinical data from PDFs in batch and write JSONL."
+    )
+    parser.add_argument(
+        "inputs", nargs="+", help="PDF files, directories or glob patterns"
+    )
+    parser.add_argument(
+        "-o", "--output", default="extractions.jsonl", help="Output JSONL file"
+    )
+    parser.add_argument(
+        "-w", "--workers", type=int, default=4, help="Documents processed at once"
+    )
+    parser.add_argument(
+        "-m", "--model", default="vertex/gemini-3-pro-preview", help="Model name"
+    )
+    parser.add_argument("--workflow", choices=sorted(WORKFLOWS), default="single")
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=None,
+        help="Pages per chunk (default: planned from the token budget)",
+    )
+    parser.add_argument("--chunk-concurrency", type=int, default=None)
+    parser.add_argument(
+        "--prompt-file", default=None, help="System prompt file (default: built-in)"
+    )
+    parser.add_argument(
+        "--no-resume", action="store_true", help="Reprocess already extracted files"
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="Bypass the extraction cache"
+    )
+    parser.add_argument(
+        "--parquet",
+        metavar="DIR",
+        default=None,
+        help="Also append the results to Parquet datasets under DIR (needs pyarrow)",
+    )
+    return parser.parse_args(argv)
+
+
+def to_parquet(writer: ParquetWriter, record: Dict[str, Any]):
+    writer.write(
+        DocumentRecords.from_result(
+            record["extracted_data"],
+            doc_id=record["sha256"],
+            extracted_at=datetime.fromisoformat(record["finished_at"]),
+            file=record["file"],
+            model=record["model"],
+            trace_id=record["trace_id"],
+        )
+    )
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    try:
+        parquet = ParquetWriter(args.parquet) if args.parquet else None
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        return 2
+
+    if args.prompt_file:
+        with open(args.prompt_file, "r", encoding="utf-8") as f:
+            system_prompt = f.read().strip()
+    else:
+        system_prompt = load_prompt("vision_extraction.md")
+
+    paths = collect_pdf_paths(args.inputs)
+    completed = set() if args.no_resume else load_completed_keys(args.output)
+    print(f"Found {len(paths)} PDFs, {len(completed)} already extracted.")
+    claim_lock = threading.Lock()
+
+    def claim(key: ResumeKey) -> bool:
+        # Also skips duplicates within this run
+        with claim_lock:
+            if key in completed:
+                return False
+            completed.add(key)
+            return True
+
+    records = []
+    skipped = 0
+    start = time.perf_counter()
+
+    with open(args.output, "a", encoding="utf-8") as output, ThreadPoolExecutor(
+        max_workers=max(1, args.workers)
+    ) as executor:
+        futures = {
+            executor.submit(extract_document, path, args, system_prompt, claim): path
+            for path in paths
+        }
+
+        for done, future in enumerate(as_completed(futures), start=1):
+            record = future.result()
+            if record is None:
+                skipped += 1
+                continue
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            output.flush()
+            if parquet and record["status"] == "ok":
+                to_parquet(parquet, record)
+            # Only what the summary needs: the results are on disk already
+            records.append(
+                {
+                    key: record[key]
+                    for key in ("file", "status", "pages", "elapsed_seconds")
+                }
+            )
+            print(
+                f"[{done}/{len(futures)}] {record['status'].upper()} "
+                f"{record['file']} ({record['elapsed_seconds']:.1f}s)"
+            )
+
+    if parquet:
+        parquet.close()
+        print(f"Wrote {len(parquet.files_written)} Parquet files to {args.parquet}")
+    print_summary(records, skipped, time.perf_counter() - start)
+    return 0 if all(record["status"] == "ok" for record in records) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,219 @@
+"""
+Concurrency benchmark of the sync and async vision workflows.
+
+N documents are extracted with C in flight at a time, against the local mock
+server (mock_server.py), through:
+- sync: app_vision.invoke on a ThreadPoolExecutor with C threads
+- async: app_vision_async.ainvoke, C tasks at a time on one event loop
+
+Rasterization is replaced by pre-rendered synthetic pages
+(benchmarks/synthetic.py), so the numbers measure the serving overhead
+(threads, sockets, event loop) rather than poppler. Each mode runs in a fresh
+interpreter, so its peak RSS and thread count are its own; the mock server
+runs in the parent process.
+
+Run from the repository root:
+    python -m benchmarks.bench_concurrency
+    python -m benchmarks.bench_concurrency --docs 200 --concurrency 10 50 100 --latency 1
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import statistics
+import threading
+import time
+from typing import Any, Dict, List
+
+MODES = ["sync", "async"]
+
+
+def _initial_state(index: int) -> Dict[str, Any]:
+    return {
+        # Distinct bytes per document, so single-flight does not collapse them
+        "pdf_bytes": b"%PDF-bench-" + str(index).encode(),
+        "images": [],
+        "extracted_data": [],
+        "errors": [],
+        "model_name": "mock-model",
+        "use_cache": False,
+        "force_vision": True,
+    }
+
+
+class _ThreadSampler:
+    """Samples threading.active_count() in the background; keeps the peak."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, threading.active_count())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def _run_mode(
+    mode: str, base_url: str, docs: int, concurrency: int, pages: int, dpi: int
+) -> Dict[str, Any]:
+    """Runs in a child process: extracts `docs` documents and reports timings."""
+    # The connection pool is sized at client creation, so set it before import
+    os.environ["LLM_MAX_CONNECTIONS"] = str(concurrency)
+    os.environ["LLM_MAX_KEEPALIVE_CONNECTIONS"] = str(concurrency)
+    os.environ["LOG_LEVEL"] = "WARNING"
+
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+
+    import utils
+    import workflows
+    from benchmarks import synthetic
+
+    workflows.REQUESTY_BASE_URL = base_url
+    workflows.REQUESTY_API_KEY = "benchmark"
+    images = synthetic.make_page_images(pages, dpi=dpi)
+    utils.rasterize_pdf = lambda pdf_bytes, dpi, workers: (
+        list(images),
+        [{"page": page, "seconds": 0.0} for page in range(1, pages + 1)],
+    )
+
+    latencies: List[float] = []
+    errors = 0
+
+    def record(start: float, result: Dict[str, Any]):
+        nonlocal errors
+        latencies.append(time.perf_counter() - start)
+        errors += bool(result.get("errors"))
+
+    def run_sync():
+        def one(index: int):
+            start = time.perf_counter()
+            record(start, workflows.app_vision.invoke(_initial_state(index)))
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(one, range(docs)))
+
+    async def run_async():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(index: int):
+            async with semaphore:
+                start = time.perf_counter()
+                record(
+                    start,
+                    await workflows.app_vision_async.ainvoke(_initial_state(index)),
+                )
+
+        await asyncio.gather(*(one(index) for index in range(docs)))
+        await workflows.aclose_clients()
+
+    with _ThreadSampler() as sampler:
+        start = time.perf_counter()
+        if mode == "sync":
+            run_sync()
+        else:
+            asyncio.run(run_async())
+        wall = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "wall_seconds": wall,
+        "docs_per_second": docs / wall,
+        "p50_seconds": statistics.median(latencies),
+        "p95_seconds": latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))],
+        "errors": errors,
+        "peak_threads": sampler.peak,
+        # ru_maxrss is in KB on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def run(
+    modes: List[str],
+    concurrency_levels: List[int],
+    docs: int,
+    pages: int,
+    dpi: int,
+    latency: float,
+    token_delay: float,
+) -> List[Dict[str, Any]]:
+    import mock_server
+
+    server, base_url = mock_server.start_mock_server(
+        latency=latency, token_delay=token_delay
+    )
+    context = multiprocessing.get_context("spawn")
+    rows = []
+    try:
+        for concurrency in concurrency_levels:
+            for mode in modes:
+                with context.Pool(1) as pool:
+                    result = pool.apply(
+                        _run_mode, (mode, base_url, docs, concurrency, pages, dpi)
+                    )
+                rows.append({"mode": mode, "concurrency": concurrency, **result})
+    finally:
+        server.shutdown()
+    return rows
+
+
+def print_report(rows: List[Dict[str, Any]]):
+    print(
+        f"{'mode':<6} {'conc':>5} {'wall s':>8} {'docs/s':>8} {'p50 s':>7} "
+        f"{'p95 s':>7} {'threads':>8} {'RSS MB':>8} {'errors':>7}"
+    )
+    for row in rows:
+        print(
+            f"{row['mode']:<6} {row['concurrency']:>5} {row['wall_seconds']:>8.2f} "
+            f"{row['docs_per_second']:>8.1f} {row['p50_seconds']:>7.2f} "
+            f"{row['p95_seconds']:>7.2f} {row['peak_threads']:>8} "
+            f"{row['peak_rss_mb']:>8.1f} {row['errors']:>7}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--docs", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 50])
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument("--pages", type=int, default=2)
+    parser.add_argument("--dpi", type=int, default=100)
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.5,
+        help="Mock server seconds before the first token.",
+    )
+    parser.add_argument(
+        "--token-delay",
+        type=float,
+        default=0.0,
+        help="Mock server seconds between streamed chunks.",
+    )
+    args = parser.parse_args(argv)
+
+    rows = run(
+        args.modes,
+        args.concurrency,
+        args.docs,
+        args.pages,
+        args.dpi,
+        args.latency,
+        args.token_delay,
+    )
+    print_report(rows)
+
+
+if __name__ == "__main__":
+    main()
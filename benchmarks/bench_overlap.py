@@ -0,0 +1,147 @@
+"""
+Wall-time benchmark of the staged and pipelined vision workflows.
+
+Synthetic scanned reports (benchmarks/synthetic.py) are extracted against the
+local mock server (mock_server.py) through:
+- staged: app_vision_chunked, where every page is rendered, then filtered,
+  cropped and encoded, before the first request starts
+- pipelined: app_vision_pipelined, where the stages overlap (pipeline.py)
+
+Both use the same chunk size and request concurrency. Besides the wall time,
+the report shows the summed time of each stage, so the pipelined wall time can
+be compared with its slowest stage. Needs poppler (pdftoppm/pdfinfo).
+
+Run from the repository root:
+    python -m benchmarks.bench_overlap
+    python -m benchmarks.bench_overlap --pages 10 40 --chunk-size 4 --latency 2
+"""
+
+import argparse
+import shutil
+import time
+from typing import Any, Dict, List
+
+MODES = ["staged", "pipelined"]
+
+
+def _initial_state(pdf_bytes: bytes, chunk_size: int, concurrency: int):
+    return {
+        "pdf_bytes": pdf_bytes,
+        "images": [],
+        "extracted_data": [],
+        "errors": [],
+        "model_name": "mock-model",
+        "use_cache": False,
+        "force_vision": True,
+        "chunk_size": chunk_size,
+        "max_concurrency": concurrency,
+    }
+
+
+def run(
+    modes: List[str],
+    page_counts: List[int],
+    chunk_size: int,
+    concurrency: int,
+    dpi: int,
+    latency: float,
+    repeat: int,
+) -> List[Dict[str, Any]]:
+    import mock_server
+    import workflows
+    from benchmarks import synthetic
+
+    apps = {
+        "staged": workflows.app_vision_chunked,
+        "pipelined": workflows.app_vision_pipelined,
+    }
+    server, base_url = mock_server.start_mock_server(latency=latency)
+    workflows.REQUESTY_BASE_URL = base_url
+    workflows.REQUESTY_API_KEY = "benchmark"
+    rows = []
+    try:
+        for pages in page_counts:
+            pdf_bytes, _ = synthetic.make_scanned_pdf(pages, dpi=dpi)
+            for mode in modes:
+                best = None
+                for _ in range(repeat):
+                    state = _initial_state(pdf_bytes, chunk_size, concurrency)
+                    start = time.perf_counter()
+                    result = apps[mode].invoke(state)
+                    wall = time.perf_counter() - start
+                    if best is None or wall < best["wall_seconds"]:
+                        best = {"wall_seconds": wall, "result": result}
+                result = best["result"]
+                stats = result.get("pipeline_stats") or {}
+                rows.append(
+                    {
+                        "mode": mode,
+                        "pages": pages,
+                        "wall_seconds": best["wall_seconds"],
+                        # Summed over pages: the stage's cost if run on its own
+                        "render_seconds": sum(
+                            timing["seconds"]
+                            for timing in result.get("page_timings") or []
+                        ),
+                        "prepare_seconds": stats.get("prepare_seconds"),
+                        "generation_seconds": (result.get("stream_stats") or {}).get(
+                            "generation_seconds"
+                        ),
+                        "errors": len(result.get("errors") or []),
+                    }
+                )
+    finally:
+        server.shutdown()
+    return rows
+
+
+def print_report(rows: List[Dict[str, Any]]):
+    def seconds(value):
+        return f"{value:.2f}" if value is not None else "-"
+
+    print(
+        f"{'mode':<10} {'pages':>5} {'wall s':>8} {'render s':>9} "
+        f"{'prepare s':>10} {'model s':>8} {'errors':>7}"
+    )
+    for row in rows:
+        print(
+            f"{row['mode']:<10} {row['pages']:>5} {row['wall_seconds']:>8.2f} "
+            f"{seconds(row['render_seconds']):>9} "
+            f"{seconds(row['prepare_seconds']):>10} "
+            f"{seconds(row['generation_seconds']):>8} {row['errors']:>7}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pages", type=int, nargs="+", default=[8, 24])
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument("--chunk-size", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--dpi", type=int, default=150)
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=1.0,
+        help="Mock server seconds before the first token.",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    if not shutil.which("pdftoppm"):
+        parser.error("needs poppler's pdftoppm on the PATH")
+    print_report(
+        run(
+            args.modes,
+            args.pages,
+            args.chunk_size,
+            args.concurrency,
+            args.dpi,
+            args.latency,
+            args.repeat,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
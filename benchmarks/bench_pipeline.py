@@ -0,0 +1,288 @@
+"""
+Per-stage microbenchmarks of the rasterize/encode/prompt/render pipeline.
+
+Synthetic clinical reports (benchmarks/synthetic.py) of several page counts
+go through each hot path on its own:
+- rasterize: utils.pdf_to_images (serial) and with RASTER_WORKERS threads
+- text_layer: utils.extract_text_layer
+- encode: encode_image_to_base64, get_image_data_url and encode_page_for_upload
+- prompt: workflows._get_extraction_spec plus validation of a mock response
+- render: draw_bounding_box per box and draw_bounding_boxes per page
+
+Each stage runs in a fresh interpreter, so its peak RSS is its own. Results
+are compared against benchmarks/baselines.json when it exists.
+
+Run from the repository root:
+    python -m benchmarks.bench_pipeline                   # compare with baseline
+    python -m benchmarks.bench_pipeline --save-baseline   # record a new baseline
+    python -m benchmarks.bench_pipeline --pages 1 10 --stages encode render
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from typing import Any, Callable, Dict, List
+
+BASELINE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "baselines.json"
+)
+DEFAULT_PAGES = [1, 5, 20]
+STAGES = ["rasterize", "text_layer", "encode", "prompt", "render"]
+
+
+def _best_of(repeat: int, func: Callable[[], Any]) -> float:
+    """Minimum wall time of `repeat` runs, in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _page_images(pages: int, dpi: int):
+    from benchmarks import synthetic
+
+    return synthetic.make_page_images(pages, dpi=dpi)
+
+
+# --- Stages ---
+# Each returns {case: {"seconds", ...extra metrics}} for one document size.
+
+
+def stage_rasterize(pages: int, dpi: int, repeat: int) -> Dict[str, Dict[str, float]]:
+    import utils
+    import workflows
+    from benchmarks import synthetic
+
+    pdf_bytes, _ = synthetic.make_text_pdf(pages)
+    return {
+        "pdf_to_images": {
+            "seconds": _best_of(
+                repeat, lambda: utils.pdf_to_images(pdf_bytes=pdf_bytes, dpi=dpi)
+            )
+        },
+        "pdf_to_images_parallel": {
+            "seconds": _best_of(
+                repeat,
+                lambda: utils.pdf_to_images(
+                    pdf_bytes=pdf_bytes,
+                    dpi=dpi,
+                    workers=workflows.RASTER_WORKERS or os.cpu_count(),
+                ),
+            )
+        },
+    }
+
+
+def stage_text_layer(pages: int, dpi: int, repeat: int) -> Dict[str, Dict[str, float]]:
+    import utils
+    from benchmarks import synthetic
+
+    pdf_bytes, _ = synthetic.make_text_pdf(pages)
+    return {
+        "extract_text_layer": {
+            "seconds": _best_of(
+                repeat, lambda: utils.extract_text_layer(pdf_bytes=pdf_bytes)
+            )
+        }
+    }
+
+
+def stage_encode(pages: int, dpi: int, repeat: int) -> Dict[str, Dict[str, float]]:
+    import utils
+    import workflows
+
+    images = _page_images(pages, dpi)
+    results = {}
+    for case, encode in (
+        ("encode_image_to_base64", utils.encode_image_to_base64),
+        ("get_image_data_url", utils.get_image_data_url),
+    ):
+        payload = sum(len(encode(image)) for image in images)
+        results[case] = {
+            "seconds": _best_of(repeat, lambda: [encode(image) for image in images]),
+            "payload_bytes_per_page": payload / pages,
+        }
+
+    def upload():
+        return [
+            utils.encode_page_for_upload(image, **workflows.UPLOAD_ENCODING)
+            for image in images
+        ]
+
+    results["encode_page_for_upload"] = {
+        "seconds": _best_of(repeat, upload),
+        "payload_bytes_per_page": sum(page["bytes"] for page in upload()) / pages,
+    }
+    return results
+
+
+def stage_prompt(pages: int, dpi: int, repeat: int) -> Dict[str, Dict[str, float]]:
+    import workflows
+    from mock_server import build_mock_result
+
+    response = json.dumps(build_mock_result(pages))
+
+    def request():
+        result_model, _ = workflows._get_extraction_spec({"system_prompt": None})
+        result_model.model_validate_json(response)
+
+    iterations = 50
+    return {
+        "spec_and_validation": {
+            "seconds": _best_of(repeat, lambda: [request() for _ in range(iterations)])
+            / iterations
+        }
+    }
+
+
+def stage_render(pages: int, dpi: int, repeat: int) -> Dict[str, Dict[str, float]]:
+    import utils
+    from mock_server import build_mock_result
+
+    images = _page_images(pages, dpi)
+    result = build_mock_result(pages)
+    boxes_by_page = {page: [] for page in range(1, pages + 1)}
+    for item in result["elements"] + result["tests"] * 10:  # ~10 tests per page
+        boxes_by_page[item["page_number"]].append(
+            {"bbox": item["bounding_box"], "label": "Glucosa", "color": "green"}
+        )
+
+    def one_by_one():
+        for page, image in enumerate(images, start=1):
+            for box in boxes_by_page[page]:
+                image = utils.draw_bounding_box(
+                    image, box["bbox"], label=box["label"], color=box["color"]
+                )
+
+    def batched():
+        for page, image in enumerate(images, start=1):
+            utils.draw_bounding_boxes(image, boxes_by_page[page])
+
+    return {
+        "draw_bounding_box": {"seconds": _best_of(repeat, one_by_one)},
+        "draw_bounding_boxes": {"seconds": _best_of(repeat, batched)},
+    }
+
+
+def _run_stage(stage: str, pages: int, dpi: int, repeat: int) -> Dict[str, Any]:
+    """Runs in a child process; reports the child's own peak RSS."""
+    try:
+        cases = globals()[f"stage_{stage}"](pages, dpi, repeat)
+    except Exception as e:  # e.g. poppler is not installed
+        return {"skipped": f"{type(e).__name__}: {e}"}
+    # ru_maxrss is in kilobytes on Linux
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    for metrics in cases.values():
+        metrics["pages_per_second"] = pages / metrics["seconds"]
+        metrics["peak_rss_mb"] = peak_rss_mb
+    return {"cases": cases}
+
+
+def run(stages: List[str], page_counts: List[int], dpi: int, repeat: int) -> dict:
+    """Returns {"<stage>/<case>/<pages>p": metrics} for every measured case."""
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    for stage in stages:
+        for pages in page_counts:
+            with context.Pool(1) as pool:
+                outcome = pool.apply(_run_stage, (stage, pages, dpi, repeat))
+            if "skipped" in outcome:
+                print(f"{stage:>10} {pages:>3}p  skipped ({outcome['skipped']})")
+                continue
+            for case, metrics in outcome["cases"].items():
+                results[f"{stage}/{case}/{pages}p"] = metrics
+    return results
+
+
+# --- Reporting ---
+
+
+def load_baseline(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f).get("results", {})
+
+
+def save_baseline(path: str, results: dict, dpi: int):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "python": sys.version.split()[0],
+                "cpu_count": os.cpu_count(),
+                "dpi": dpi,
+                "results": results,
+            },
+            f,
+            indent=2,
+            sort_keys=True,
+        )
+
+
+def print_report(results: dict, baseline: dict, threshold: float) -> List[str]:
+    """Prints one row per case and returns the keys that regressed."""
+    regressions = []
+    print(
+        f"{'case':<52} {'ms':>9} {'pages/s':>9} {'KB/page':>9} {'RSS MB':>8} {'vs base':>8}"
+    )
+    for key, metrics in results.items():
+        payload = metrics.get("payload_bytes_per_page")
+        change = ""
+        if key in baseline:
+            ratio = metrics["seconds"] / baseline[key]["seconds"] - 1
+            change = f"{ratio:+.0%}"
+            if ratio > threshold:
+                regressions.append(key)
+                change += " !"
+        print(
+            f"{key:<52} {metrics['seconds'] * 1000:>9.2f} "
+            f"{metrics['pages_per_second']:>9.1f} "
+            f"{(payload / 1024 if payload else 0):>9.1f} "
+            f"{metrics['peak_rss_mb']:>8.1f} {change:>8}"
+        )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pages", type=int, nargs="+", default=DEFAULT_PAGES)
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--dpi", type=int, default=200)
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Write the results as the new baseline instead of comparing",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="Relative slowdown reported as a regression (default: 0.25)",
+    )
+    args = parser.parse_args(argv)
+
+    results = run(args.stages, args.pages, args.dpi, args.repeat)
+    baseline = {} if args.save_baseline else load_baseline(args.baseline)
+    regressions = print_report(results, baseline, args.threshold)
+
+    if args.save_baseline:
+        save_baseline(args.baseline, results, args.dpi)
+        print(f"Baseline saved to {args.baseline}")
+    elif regressions:
+        print(
+            f"{len(regressions)} case(s) slower than baseline by > {args.threshold:.0%}"
+        )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
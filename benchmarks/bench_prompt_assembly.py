@@ -0,0 +1,96 @@
+"""
+Microbenchmark of the per-request schema and prompt assembly overhead.
+
+Compares the previous hot path (Pydantic models redefined inside the node,
+schema rebuilt and pretty-printed, prompt re-read from disk on every call)
+with the precompiled extraction spec in workflows.py.
+
+Run from the repository root:
+    python -m benchmarks.bench_prompt_assembly
+"""
+
+import argparse
+import json
+import os
+import timeit
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
+
+import workflows
+from mock_server import build_mock_result
+
+PROMPT_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "prompts",
+    "vision_extraction.md",
+)
+
+
+def legacy_spec():
+    """The per-request work done before the spec was hoisted to module level."""
+
+    class Element(BaseModel):
+        label: str = Field(description="The label of the extracted element")
+        value: str = Field(description="The extracted value")
+        page_number: int = Field(description="The page number (1-indexed).")
+        bounding_box: Optional[List[int]] = Field(description="The bounding box")
+
+    class Test(BaseModel):
+        description: str = Field(description="Name or description of the test")
+        sample_type: Optional[str] = Field(description="Type of sample")
+        loinc_code: Optional[str] = Field(description="Proposed LOINC code")
+        page_number: int = Field(description="The page number (1-indexed).")
+        bounding_box: Optional[List[int]] = Field(description="The bounding box")
+
+    class UrineDetails(BaseModel):
+        collection_type: str = Field(
+            description="Type of urine collection", enum=["24h", "Spot", "Random"]
+        )
+        volume: Optional[str] = Field(description="Total volume if specified")
+        page_number: int = Field(description="The page number (1-indexed).")
+        bounding_box: Optional[List[int]] = Field(description="The bounding box")
+
+    class ExtractionResult(BaseModel):
+        elements: List[Element] = Field(description="List of extracted elements")
+        tests: List[Test] = Field(description="List of clinical tests")
+        urine_details: Optional[UrineDetails] = Field(description="Urine details")
+
+    with open(PROMPT_PATH, "r", encoding="utf-8") as f:
+        system_prompt = f.read().strip()
+    schema_json = ExtractionResult.model_json_schema()
+    system_prompt += f"\n\n# JSON Schema\n{json.dumps(schema_json, indent=2)}"
+    return ExtractionResult, system_prompt
+
+
+def current_spec():
+    return workflows._get_extraction_spec({"system_prompt": None})
+
+
+def run(iterations: int) -> dict:
+    response = json.dumps(build_mock_result(page_count=20))
+    results = {}
+    for name, spec in (("legacy", legacy_spec), ("precompiled", current_spec)):
+
+        def request():
+            result_model, _ = spec()
+            result_model.model_validate_json(response)
+
+        seconds = min(timeit.repeat(request, number=iterations, repeat=3))
+        results[name] = seconds / iterations * 1e6  # microseconds per request
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("-n", "--iterations", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    results = run(args.iterations)
+    for name, micros in results.items():
+        print(f"{name:>12}: {micros:10.1f} us/request (spec + validation)")
+    print(f"{'speedup':>12}: {results['legacy'] / results['precompiled']:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
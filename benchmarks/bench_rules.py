@@ -0,0 +1,129 @@
+"""
+Hit-rate benchmark of the rule-based header extraction (rules.py).
+
+Runs rules.apply_rules over the text layer of synthetic documents
+(benchmarks/synthetic.py) and compares with their ground truth. Per field it
+reports the hit rate (documents where the rules resolved the field), the
+precision of the resolved values and the misses left to the model, plus the
+rule time per document and the prompt/output characters the model no longer
+has to read or generate.
+
+Layouts:
+- plain: the fixed labels of make_text_pdf
+- varied: label synonyms, value formats (spaced phones, 2-digit years, NIEs,
+  hyphenated DNIs) and values in separate text runs right of their labels
+
+Run from the repository root:
+    python -m benchmarks.bench_rules
+    python -m benchmarks.bench_rules --docs 500 --layouts varied
+    python -m benchmarks.bench_rules --pdf   # plain layout through pdftotext
+"""
+
+import argparse
+import json
+import shutil
+import statistics
+import time
+from typing import Any, Dict, List
+
+import rules
+from benchmarks import synthetic
+
+LAYOUTS = ["plain", "varied"]
+
+
+def _text_pages(layout: str, pages: int, seed: int, use_pdf: bool):
+    if use_pdf and layout == "plain":
+        import utils
+
+        pdf_bytes, ground_truth = synthetic.make_text_pdf(pages, seed=seed)
+        return utils.extract_text_layer(pdf_bytes=pdf_bytes), ground_truth
+    return synthetic.make_text_pages(pages, seed=seed, varied=layout == "varied")
+
+
+def _correct(label: str, values: List[str], expected: str) -> bool:
+    canonical = {rules.canonical_value(label, value) for value in values}
+    return canonical == {rules.canonical_value(label, expected)}
+
+
+def run(
+    layout: str, docs: int, pages: int, use_pdf: bool = False, prompt: str = ""
+) -> Dict[str, Any]:
+    counts = {
+        label: {"resolved": 0, "correct": 0, "missed": 0} for label in rules.RULE_LABELS
+    }
+    seconds: List[float] = []
+    prompt_saved: List[int] = []
+    output_saved: List[int] = []
+    for seed in range(docs):
+        text_pages, ground_truth = _text_pages(layout, pages, seed, use_pdf)
+        start = time.perf_counter()
+        result = rules.apply_rules(text_pages)
+        seconds.append(time.perf_counter() - start)
+
+        for label in rules.RULE_LABELS:
+            values = [
+                element["value"]
+                for element in result["elements"]
+                if element["label"] == label
+            ]
+            if label in result["resolved"]:
+                counts[label]["resolved"] += 1
+                counts[label]["correct"] += _correct(
+                    label, values, ground_truth["fields"][label]
+                )
+            else:
+                counts[label]["missed"] += 1
+        narrowed = rules.narrow_prompt(prompt, tuple(result["resolved"]))
+        prompt_saved.append(len(prompt) - len(narrowed))
+        output_saved.append(
+            sum(len(json.dumps(element)) for element in result["elements"])
+        )
+
+    return {
+        "layout": layout + (" (pdf)" if use_pdf and layout == "plain" else ""),
+        "docs": docs,
+        "fields": counts,
+        "ms_per_doc": 1000 * statistics.mean(seconds),
+        "prompt_chars_saved": statistics.mean(prompt_saved),
+        "output_chars_saved": statistics.mean(output_saved),
+    }
+
+
+def print_report(report: Dict[str, Any]):
+    print(
+        f"\n{report['layout']}: {report['docs']} documents, "
+        f"{report['ms_per_doc']:.2f} ms/doc, "
+        f"~{report['prompt_chars_saved']:.0f} prompt and "
+        f"~{report['output_chars_saved']:.0f} output characters saved per document"
+    )
+    print(f"{'field':<20} {'hit rate':>9} {'precision':>10} {'to model':>9}")
+    for label, counts in report["fields"].items():
+        hit_rate = counts["resolved"] / report["docs"]
+        precision = counts["correct"] / counts["resolved"] if counts["resolved"] else 0
+        print(f"{label:<20} {hit_rate:>9.1%} {precision:>10.1%} {counts['missed']:>9}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--docs", type=int, default=200)
+    parser.add_argument("--pages", type=int, default=2)
+    parser.add_argument("--layouts", nargs="+", choices=LAYOUTS, default=LAYOUTS)
+    parser.add_argument(
+        "--pdf",
+        action="store_true",
+        help="Read the plain layout from generated PDFs with pdftotext (poppler).",
+    )
+    args = parser.parse_args(argv)
+
+    if args.pdf and not shutil.which("pdftotext"):
+        parser.error("--pdf needs poppler's pdftotext on the PATH")
+    from workflows import load_prompt
+
+    prompt = load_prompt("vision_extraction.md")
+    for layout in args.layouts:
+        print_report(run(layout, args.docs, args.pages, args.pdf, prompt))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+"""
+Synthetic clinical-report PDFs for benchmarks.
+
+Documents are generated locally and deterministically (seeded), so runs are
+comparable across machines and no patient data is needed. Two flavours:
+- make_text_pdf: a digital PDF with a real text layer (Helvetica).
+- make_scanned_pdf: image-only pages, like a scanned referral.
+
+Both return (pdf_bytes, ground_truth), where ground_truth holds the header
+fields and tests written on each page. make_text_pages builds the text layer
+of make_text_pdf directly (no poppler), optionally with varied header labels,
+value formats and label/value layouts (`varied=True`).
+"""
+
+import io
+import random
+from typing import Any, Dict, List, Optional, Tuple
+
+from PIL import Image, ImageDraw
+
+PAGE_WIDTH = 595  # A4 in points
+PAGE_HEIGHT = 842
+
+FIRST_NAMES = ["MARIA", "JOSE", "ANTONIO", "CARMEN", "LUCIA", "JAVIER", "ELENA"]
+LAST_NAMES = ["GARCIA", "MARTINEZ", "LOPEZ", "SANCHEZ", "PEREZ", "GOMEZ", "RUIZ"]
+TESTS = [
+    ("Glucosa", "Suero"),
+    ("Creatinina", "Suero"),
+    ("Colesterol total", "Suero"),
+    ("Triglicéridos", "Suero"),
+    ("Hemoglobina glicosilada", "Sangre total"),
+    ("Hemograma", "Sangre total"),
+    ("TSH", "Suero"),
+    ("Ferritina", "Suero"),
+    ("Sodio", "Suero"),
+    ("Potasio", "Suero"),
+    ("Proteínas en orina 24h", "Orina"),
+    ("Creatinina en orina", "Orina"),
+    ("Sedimento urinario", "Orina"),
+]
+DNI_LETTERS = "TRWAGMYFPDXBNJZSQVHLCKE"
+
+# Header label templates for varied documents ({} is the value)
+HEADER_LABELS = {
+    "Paciente": ["Paciente: {}", "Nombre: {}", "D./Dña. {}"],
+    "DocumentoIdentidad": ["DNI: {}", "D.N.I. {}", "NIF/NIE: {}", "Documento: {}"],
+    "FechaNacimiento": [
+        "Fecha de nacimiento: {}",
+        "F. Nacimiento: {}",
+        "Fecha Nac.: {}",
+        "Nacido el {}",
+    ],
+    "Sexo": ["Sexo: {}", "Género: {}"],
+    "Telefono": ["Teléfono: {}", "Telf. {}", "Móvil: {}", "Tfno.: {}"],
+    "NumeroPeticion": ["Nº Petición: {}", "Petición {}", "Nº de petición: {}", "{}"],
+    "NombreMedico": ["Médico: {}", "Dr./Dra.: {}", "Facultativo: {}"],
+    "NumeroColegiado": ["Nº Colegiado: {}", "Colegiado nº {}", "Nº Col.: {}"],
+}
+HEADER_POSITIONS = {
+    "Paciente": (40, 80),
+    "DocumentoIdentidad": (330, 80),
+    "FechaNacimiento": (40, 98),
+    "Sexo": (330, 98),
+    "Telefono": (40, 116),
+    "NumeroPeticion": (330, 116),
+    "NombreMedico": (40, 134),
+    "NumeroColegiado": (330, 134),
+}
+AVERAGE_CHAR_WIDTH = 5.0  # Helvetica 10 pt, in points
+
+
+def _random_dni(rng: random.Random) -> str:
+    number = rng.randint(10000000, 99999999)
+    return f"{number}{DNI_LETTERS[number % 23]}"
+
+
+def _random_nie(rng: random.Random) -> str:
+    prefix = rng.randint(0, 2)
+    number = rng.randint(1000000, 9999999)
+    return f"{'XYZ'[prefix]}{number}{DNI_LETTERS[int(f'{prefix}{number}') % 23]}"
+
+
+def _document_fields(rng: random.Random, varied: bool = False) -> Dict[str, str]:
+    return {
+        "Paciente": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {rng.choice(LAST_NAMES)}",
+        "FechaNacimiento": f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.randint(1940, 2015)}",
+        "Sexo": rng.choice(["H", "M"]),
+        "DocumentoIdentidad": (
+            _random_nie(rng) if varied and rng.random() < 0.3 else _random_dni(rng)
+        ),
+        "Telefono": f"6{rng.randint(10000000, 99999999)}",
+        "NombreMedico": f"DR. {rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+        "NumeroColegiado": str(rng.randint(280000000, 289999999)),
+        "NumeroPeticion": f"W{rng.randint(10000000, 99999999)}",
+    }
+
+
+def _written_value(rng: random.Random, label: str, value: str) -> str:
+    """The value as a varied document may print it (same canonical value)."""
+    if label == "Telefono":
+        return rng.choice(
+            [
+                value,
+                f"{value[:3]} {value[3:5]} {value[5:7]} {value[7:]}",
+                f"+34 {value}",
+            ]
+        )
+    if label == "FechaNacimiento":
+        day, month, year = value.split("/")
+        return rng.choice([value, f"{day}-{month}-{year}", f"{day}.{month}.{year[2:]}"])
+    if label == "DocumentoIdentidad" and rng.random() < 0.3:
+        return f"{value[:-1]}-{value[-1]}"
+    return value
+
+
+def _header_lines(
+    fields: Dict[str, str], rng: Optional[random.Random] = None
+) -> List[Tuple[int, int, str]]:
+    """Header as (x, y_from_top, text): fixed labels, or varied ones with an rng."""
+    if rng is None:
+        return [
+            (40, 80, f"Paciente: {fields['Paciente']}"),
+            (330, 80, f"DNI: {fields['DocumentoIdentidad']}"),
+            (40, 98, f"Fecha de nacimiento: {fields['FechaNacimiento']}"),
+            (330, 98, f"Sexo: {fields['Sexo']}"),
+            (40, 116, f"Teléfono: {fields['Telefono']}"),
+            (330, 116, f"Nº Petición: {fields['NumeroPeticion']}"),
+            (40, 134, f"Médico: {fields['NombreMedico']}"),
+            (330, 134, f"Nº Colegiado: {fields['NumeroColegiado']}"),
+        ]
+    lines = []
+    for label, (x, y) in HEADER_POSITIONS.items():
+        template = rng.choice(HEADER_LABELS[label])
+        value = _written_value(rng, label, fields[label])
+        if template != "{}" and rng.random() < 0.3:
+            # Form layout: the value is a separate text run right of its label
+            lines.append((x, y, template.replace("{}", "").strip()))
+            lines.append((x + 120, y, value))
+        else:
+            lines.append((x, y, template.format(value)))
+    return lines
+
+
+def _page_lines(
+    fields: Dict[str, str],
+    tests: List[Tuple[str, str]],
+    page: int,
+    pages: int,
+    header: Optional[List[Tuple[int, int, str]]] = None,
+) -> List[Tuple[int, int, str]]:
+    """Layout of one page as (x, y_from_top, text) in points."""
+    lines = [
+        (40, 40, "LABORATORIO CLINICO - SOLICITUD DE ANALISIS"),
+        *(header or _header_lines(fields)),
+        (40, 170, "PRUEBAS SOLICITADAS"),
+        (40, 188, "Prueba"),
+        (330, 188, "Muestra"),
+    ]
+    y = 206
+    for description, sample_type in tests:
+        lines.append((40, y, description))
+        lines.append((330, y, sample_type))
+        y += 18
+    lines.append((40, PAGE_HEIGHT - 40, f"Página {page} de {pages}"))
+    return lines
+
+
+def _generate(pages: int, seed: int, varied: bool = False):
+    rng = random.Random(seed)
+    fields = _document_fields(rng, varied)
+    header = _header_lines(fields, rng) if varied else None
+    layout = []
+    truth_tests = []
+    for page in range(1, pages + 1):
+        tests = rng.sample(TESTS, rng.randint(6, 12))
+        truth_tests.extend(
+            {"description": d, "sample_type": s, "page_number": page} for d, s in tests
+        )
+        layout.append(_page_lines(fields, tests, page, pages, header))
+    ground_truth = {"fields": fields, "tests": truth_tests, "pages": pages}
+    return layout, ground_truth
+
+
+def _escape_pdf_text(text: str) -> bytes:
+    encoded = text.encode("cp1252", errors="replace")  # WinAnsiEncoding
+    return encoded.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+
+
+def make_text_pdf(pages: int = 5, seed: int = 0) -> Tuple[bytes, Dict[str, Any]]:
+    """A digital PDF with an embedded text layer."""
+    layout, ground_truth = _generate(pages, seed)
+
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # Pages, filled in below
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    ]
+    page_refs = []
+    for lines in layout:
+        content = b"BT /F1 10 Tf\n"
+        for x, y, text in lines:
+            content += b"1 0 0 1 %d %d Tm (%s) Tj\n" % (
+                x,
+                PAGE_HEIGHT - y,
+                _escape_pdf_text(text),
+            )
+        content += b"ET"
+        objects.append(
+            b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content)
+        )
+        content_ref = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>"
+            % (PAGE_WIDTH, PAGE_HEIGHT, content_ref)
+        )
+        page_refs.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % ref for ref in page_refs),
+        len(page_refs),
+    )
+
+    output = io.BytesIO()
+    output.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(output.tell())
+        output.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+    xref_offset = output.tell()
+    output.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        output.write(b"%010d 00000 n \n" % offset)
+    output.write(
+        b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+        % (len(objects) + 1, xref_offset)
+    )
+    return output.getvalue(), ground_truth
+
+
+def _text_box(x: float, y: float, width: float) -> List[int]:
+    """[ymin, xmin, ymax, xmax] on the 0-1000 scale for text at baseline y."""
+    return [
+        round((y - 8) * 1000 / PAGE_HEIGHT),
+        round(x * 1000 / PAGE_WIDTH),
+        round((y + 2) * 1000 / PAGE_HEIGHT),
+        round((x + width) * 1000 / PAGE_WIDTH),
+    ]
+
+
+def make_text_pages(
+    pages: int = 5, seed: int = 0, varied: bool = False
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    The text layer of make_text_pdf in the utils.extract_text_layer format,
+    with word boxes from an average character width, and the ground truth.
+    """
+    layout, ground_truth = _generate(pages, seed, varied)
+    text_pages = []
+    for page, lines in enumerate(layout, start=1):
+        text_lines = []
+        for x, y, text in lines:
+            words = []
+            position = x
+            for word in text.split():
+                width = len(word) * AVERAGE_CHAR_WIDTH
+                words.append({"text": word, "bbox": _text_box(position, y, width)})
+                position += width + AVERAGE_CHAR_WIDTH
+            text_lines.append(
+                {
+                    "text": " ".join(word["text"] for word in words),
+                    "bbox": _text_box(x, y, position - AVERAGE_CHAR_WIDTH - x),
+                    "words": words,
+                }
+            )
+        text_pages.append(
+            {
+                "page": page,
+                "width": PAGE_WIDTH,
+                "height": PAGE_HEIGHT,
+                "lines": text_lines,
+            }
+        )
+    return text_pages, ground_truth
+
+
+def render_page_image(lines: List[Tuple[int, int, str]], dpi: int = 150) -> Image.Image:
+    """Draws a page layout as a grayscale-looking RGB image."""
+    scale = dpi / 72
+    image = Image.new(
+        "RGB", (int(PAGE_WIDTH * scale), int(PAGE_HEIGHT * scale)), "white"
+    )
+    draw = ImageDraw.Draw(image)
+    for x, y, text in lines:
+        draw.text((x * scale, y * scale), text, fill="black")
+    return image
+
+
+def make_scanned_pdf(
+    pages: int = 5, seed: int = 0, dpi: int = 150
+) -> Tuple[bytes, Dict[str, Any]]:
+    """An image-only PDF (no text layer), like a scanned document."""
+    layout, ground_truth = _generate(pages, seed)
+    images = [render_page_image(lines, dpi=dpi) for lines in layout]
+    output = io.BytesIO()
+    images[0].save(
+        output, format="PDF", save_all=True, append_images=images[1:], resolution=dpi
+    )
+    return output.getvalue(), ground_truth
+
+
+def make_page_images(
+    pages: int = 5, seed: int = 0, dpi: int = 150
+) -> List[Image.Image]:
+    """Page images without going through poppler (for encode/render stages)."""
+    layout, _ = _generate(pages, seed)
+    return [render_page_image(lines, dpi=dpi) for lines in layout]
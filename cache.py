@@ -0,0 +1,207 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- Configuration ---
+CACHE_ENABLED = os.getenv("EXTRACTION_CACHE_ENABLED", "true").lower() not in (
+    "0",
+    "false",
+    "no",
+)
+CACHE_DIR = os.getenv(
+    "EXTRACTION_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "extractions"),
+)
+CACHE_MAX_MB = float(os.getenv("EXTRACTION_CACHE_MAX_MB", "256"))
+CACHE_MAX_AGE_DAYS = float(os.getenv("EXTRACTION_CACHE_MAX_AGE_DAYS", "30"))
+
+
+def hash_pdf(pdf_bytes: bytes) -> str:
+    """Returns the SHA-256 hex digest of the PDF bytes."""
+    return hashlib.sha256(pdf_bytes).hexdigest()
+
+
+def make_cache_key(
+    pdf_bytes: bytes,
+    model_name: str,
+    system_prompt: str,
+    variant: str = "",
+    settings: Optional[Dict[str, Any]] = None,
+) -> str:
+    """
+    Builds a content-addressed key for an extraction.
+    `system_prompt` must be the effective prompt sent to the model (schema included),
+    so any change to the instructions or the schema produces a different key.
+    `variant` separates results produced by different workflows, and `settings`
+    (JSON-serializable) those produced with different page settings such as
+    the DPI, upload encoding, cropping and filtering.
+    """
+    h = hashlib.sha256()
+    parts = (
+        hash_pdf(pdf_bytes),
+        model_name or "",
+        system_prompt or "",
+        variant,
+        json.dumps(settings, sort_keys=True) if settings else "",
+    )
+    for part in parts:
+        encoded = part.encode("utf-8")
+        # Length-prefix each part so ("ab", "c") and ("a", "bc") never collide
+        h.update(len(encoded).to_bytes(8, "big"))
+        h.update(encoded)
+    return h.hexdigest()
+
+
+class ExtractionCache:
+    """
+    Persistent cache of `extracted_data` lists, one JSON file per key.
+    Entries are evicted in least-recently-used order (file mtime is refreshed on
+    every hit) once the directory exceeds `max_bytes`, and dropped once older
+    than `max_age_seconds`.
+    """
+
+    def __init__(
+        self,
+        directory: str = CACHE_DIR,
+        max_bytes: int = int(CACHE_MAX_MB * 1024 * 1024),
+        max_age_seconds: float = CACHE_MAX_AGE_DAYS * 86400,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        """Returns the cached extraction for `key`, or None on a miss."""
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        if time.time() - entry.get("created_at", 0) > self.max_age_seconds:
+            self._remove(path)
+            with self._lock:
+                self.misses += 1
+                self.evictions += 1
+            return None
+
+        try:
+            os.utime(path, None)  # Mark as recently used
+        except OSError:
+            pass
+
+        with self._lock:
+            self.hits += 1
+        return entry["extracted_data"]
+
+    def set(self, key: str, extracted_data: List[Dict[str, Any]]) -> None:
+        """Stores an extraction result and evicts old entries if needed."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry = {"created_at": time.time(), "extracted_data": extracted_data}
+
+        # Write atomically so concurrent readers never see a partial file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self.writes += 1
+        self.evict()
+
+    def _entries(self) -> List[os.DirEntry]:
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(".json"):
+                    entries.append(entry)
+        return entries
+
+    def _remove(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def evict(self) -> int:
+        """
+        Removes expired entries, then least-recently-used entries until the
+        cache fits in `max_bytes`. Returns the number of entries removed.
+        """
+        now = time.time()
+        removed = 0
+        live = []
+        for entry in self._entries():
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            # mtime is never older than the creation time, so this is safe
+            if now - stat.st_mtime > self.max_age_seconds:
+                self._remove(entry.path)
+                removed += 1
+            else:
+                live.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in live)
+        for _, size, path in sorted(live):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+            removed += 1
+
+        with self._lock:
+            self.evictions += removed
+        return removed
+
+    def clear(self) -> None:
+        """Removes every entry from the cache."""
+        for entry in self._entries():
+            self._remove(entry.path)
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns hit/miss counters and the current on-disk footprint."""
+        sizes = []
+        for entry in self._entries():
+            try:
+                sizes.append(entry.stat().st_size)
+            except OSError:
+                continue
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "writes": self.writes,
+                "evictions": self.evictions,
+                "entries": len(sizes),
+                "size_bytes": sum(sizes),
+            }
+
+
+extraction_cache = ExtractionCache()
@@ -0,0 +1,210 @@
+"""
+Background extraction jobs.
+
+A JobManager runs workflow invocations on a bounded worker pool, off the
+Streamlit script thread, so reruns, tab switches and new uploads neither
+block nor lose work. Each job has an ID, a status (queued, running, done,
+failed, cancelled), the items streamed so far and, once finished, a result
+summary that the UI polls for.
+
+Cancellation removes a queued job immediately. A running job stops at its
+next streamed event; a model call already in flight finishes in the
+background (and still fills the extraction cache).
+"""
+
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from telemetry import get_logger, registry
+
+load_dotenv()
+
+# --- Configuration ---
+JOBS_MAX_WORKERS = int(os.getenv("JOBS_MAX_WORKERS", "2"))
+JOBS_MAX_FINISHED = int(os.getenv("JOBS_MAX_FINISHED", "100"))
+
+log = get_logger("jobs")
+
+JOBS_TOTAL = registry.counter(
+    "extractor_jobs_total", "Finished background jobs by final status."
+)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATUSES = (DONE, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    """State of one extraction job. Fields are written by the worker thread only."""
+
+    def __init__(self, name: str, workflow, initial_state: Dict[str, Any], **metadata):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.workflow = workflow
+        self.initial_state = initial_state
+        self.metadata = metadata  # e.g. file_hash, owner
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.first_field_time: Optional[float] = None
+        self.items: List[Dict[str, Any]] = []  # Streamed (section, item) events
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.cancel_event = threading.Event()
+        self.future = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    @property
+    def elapsed(self) -> float:
+        """Seconds since the job started running (0 while queued)."""
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+
+class JobManager:
+    """Bounded pool of workflow runs with job IDs, polling and cancellation."""
+
+    def __init__(
+        self, max_workers: int = JOBS_MAX_WORKERS, max_finished: int = JOBS_MAX_FINISHED
+    ):
+        self.max_finished = max_finished
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, max_workers), thread_name_prefix="extraction-job"
+        )
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(
+        self, name: str, workflow, initial_state: Dict[str, Any], **metadata
+    ) -> Job:
+        """Queues a workflow run; returns the job immediately."""
+        job = Job(name, workflow, initial_state, **metadata)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._evict_finished()
+        job.future = self._executor.submit(self._run, job)
+        log.info(
+            "Queued job %s (%s)",
+            job.id,
+            name,
+            extra={"event": "job.queued", "job_id": job.id},
+        )
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self, **metadata) -> List[Job]:
+        """Jobs in submission order, optionally filtered by metadata (e.g. owner=...)."""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [
+            job
+            for job in jobs
+            if all(job.metadata.get(key) == value for key, value in metadata.items())
+        ]
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancels a queued or running job. Returns False if it already finished."""
+        job = self.get(job_id)
+        if job is None or job.finished:
+            return False
+        job.cancel_event.set()
+        if job.future is not None and job.future.cancel():
+            # Never started: finish it here, the worker will not run
+            self._finish(job, CANCELLED)
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        counts = {status: 0 for status in (QUEUED, RUNNING) + FINISHED_STATUSES}
+        with self._lock:
+            for job in self._jobs.values():
+                counts[job.status] += 1
+        return counts
+
+    def shutdown(self, wait: bool = True):
+        for job in self.list():
+            if not job.finished:
+                self.cancel(job.id)
+        self._executor.shutdown(wait=wait)
+
+    def _evict_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[: max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+
+    def _finish(self, job: Job, status: str, error: str = None):
+        job.initial_state = None  # Release the PDF bytes
+        job.error = error
+        job.finished_at = time.time()
+        job.status = status
+        JOBS_TOTAL.inc(status=status)
+        log.info(
+            "Job %s %s after %.2fs",
+            job.id,
+            status,
+            job.elapsed,
+            extra={"event": "job.finished", "job_id": job.id, "status": status},
+        )
+
+    def _run(self, job: Job):
+        if job.cancel_event.is_set():
+            self._finish(job, CANCELLED)
+            return
+        job.status = RUNNING
+        job.started_at = time.time()
+        result = job.initial_state
+        try:
+            # "custom" events carry each element/test as soon as it is parsed,
+            # "values" the latest full state
+            for mode, chunk in job.workflow.stream(
+                job.initial_state, stream_mode=["custom", "values"]
+            ):
+                if job.cancel_event.is_set():
+                    raise JobCancelled()
+                if mode == "values":
+                    result = chunk
+                elif chunk.get("type") == "item":
+                    if job.first_field_time is None:
+                        job.first_field_time = time.time() - job.started_at
+                    job.items.append(chunk)
+        except JobCancelled:
+            self._finish(job, CANCELLED)
+            return
+        except Exception as e:
+            log.exception("Job %s failed", job.id, extra={"job_id": job.id})
+            self._finish(job, FAILED, f"{type(e).__name__}: {e}")
+            return
+
+        job.result = {
+            "extracted_data": result.get("extracted_data", []),
+            "errors": result.get("errors", []),
+            "images": result.get("images") or [],
+            "cache_hit": result.get("cache_hit"),
+            "collapsed": result.get("collapsed"),
+            "elapsed_time": time.time() - job.started_at,
+            "first_field_time": job.first_field_time,
+            "trace_id": result.get("trace_id"),
+            "page_filter": result.get("page_filter"),
+        }
+        self._finish(job, DONE)
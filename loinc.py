@@ -0,0 +1,337 @@
+"""
+Local LOINC code lookup.
+
+Maps extracted tests (description + sample type) to LOINC codes from a local
+table, instead of trusting the codes proposed by the model. The table is a
+CSV file (LOINC_TABLE), either:
+- the seed table data/loinc_es.csv: code, name, system, synonyms ("|"-separated)
+- a LOINC table or linguistic variant export: LOINC_NUM, LONG_COMMON_NAME,
+  SHORTNAME, SYSTEM, RELATEDNAMES2 (";"-separated) and STATUS columns
+
+Names are normalized once at load (lowercase, no accents, punctuation or
+specimen words) into an exact-name dict and a character trigram index. A
+lookup is an exact hit or, failing that, the best trigram (Dice) similarity
+among the names sharing a trigram with the query and the same modifier words
+("no", "HDL"/"VLDL", "libre", "24 horas"...): a similar name with another
+modifier is another test. Entries whose specimen system matches the sample
+type are preferred. Only exact hits are reliable enough to replace a code;
+fuzzy hits are suggestions (see workflows.node_assign_loinc).
+"""
+
+import csv
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+
+from telemetry import get_logger
+
+load_dotenv()
+
+# --- Configuration ---
+LOINC_TABLE = os.getenv(
+    "LOINC_TABLE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "loinc_es.csv"),
+)
+LOINC_MIN_SCORE = float(os.getenv("LOINC_MIN_SCORE", "0.8"))
+
+# Score multiplier for an entry whose system does not match the sample type
+SYSTEM_MISMATCH_PENALTY = 0.85
+
+log = get_logger("loinc")
+
+# --- Normalization ---
+
+# Sample type keywords -> LOINC SYSTEM values, checked in order
+SAMPLE_SYSTEMS = [
+    ("orina", ("Urine",)),
+    ("urine", ("Urine",)),
+    ("heces", ("Stool",)),
+    ("lcr", ("CSF",)),
+    ("cefalorraquideo", ("CSF",)),
+    ("sangre", ("Bld", "BldV", "BldA")),
+    ("blood", ("Bld", "BldV", "BldA")),
+    ("plasma", ("Ser/Plas", "Plas", "PPP")),
+    ("suero", ("Ser/Plas", "Ser")),
+    ("serum", ("Ser/Plas", "Ser")),
+]
+
+# Dropped from names and descriptions: the specimen is matched by system
+IGNORED_WORDS = {
+    "en",
+    "de",
+    "del",
+    "la",
+    "el",
+    "in",
+    "of",
+    "s",
+    "suero",
+    "serum",
+    "serico",
+    "serica",
+    "plasma",
+    "sangre",
+    "blood",
+    "orina",
+    "urine",
+}
+
+
+# Words that make a name another test: a fuzzy match must have the same ones
+MODIFIER_WORDS = {
+    "no",
+    "non",
+    "sin",
+    "v",
+    "hdl",
+    "ldl",
+    "vldl",
+    "idl",
+    "libre",
+    "total",
+    "directa",
+    "directo",
+    "indirecta",
+    "indirecto",
+    "conjugada",
+    "24",
+    "horas",
+    "%",
+    "porcentaje",
+    "absolutos",
+}
+
+# Sample type phrases that qualify the test ("Orina 24h"), added to its name
+SAMPLE_QUALIFIERS = ["24 horas"]
+
+
+def normalize(text: str) -> str:
+    """Lowercase ASCII words: accents, punctuation and extra spaces removed."""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    text = re.sub(r"[^a-z0-9%]+", " ", text.lower())
+    text = re.sub(r"\b24\s*h\b", "24 horas", text)
+    return " ".join(text.split())
+
+
+def name_key(text: str) -> str:
+    """Normalized name without specimen and filler words (the index key)."""
+    # Rejoin spelled-out abbreviations first: "T.S.H." -> "tsh"
+    words: List[str] = []
+    previous = ""
+    for word in normalize(text).split():
+        if len(word) == 1 and len(previous) == 1:
+            words[-1] += word
+        else:
+            words.append(word)
+        previous = word
+    kept = [word for word in words if word not in IGNORED_WORDS]
+    return " ".join(kept or words)
+
+
+def modifiers(key: str) -> frozenset:
+    """The MODIFIER_WORDS of a name key."""
+    return frozenset(word for word in key.split() if word in MODIFIER_WORDS)
+
+
+def lookup_key(description: str, sample_type: Optional[str] = None) -> str:
+    """name_key of a test, plus the qualifiers only found in its sample type."""
+    key = name_key(description)
+    sample = normalize(sample_type or "")
+    for qualifier in SAMPLE_QUALIFIERS:
+        if key and qualifier in sample and qualifier not in key:
+            key = f"{key} {qualifier}"
+    return key
+
+
+def sample_systems(sample_type: Optional[str]) -> Tuple[str, ...]:
+    """LOINC systems that match a sample type ("Suero", "Orina 24h"...), or ()."""
+    sample = normalize(sample_type or "")
+    for keyword, systems in SAMPLE_SYSTEMS:
+        if keyword in sample:
+            return systems
+    return ()
+
+
+def trigrams(key: str) -> Set[str]:
+    padded = f"  {key} "
+    return {padded[index : index + 3] for index in range(len(padded) - 2)}
+
+
+# --- Index ---
+
+
+def _column(row: Dict[str, str], *names: str) -> str:
+    for name in names:
+        value = (row.get(name) or "").strip()
+        if value:
+            return value
+    return ""
+
+
+def read_table(path: str) -> List[Dict[str, Any]]:
+    """Reads a LOINC CSV (seed or LOINC export format) into entry dicts."""
+    entries = []
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        for row in csv.DictReader(f):
+            code = _column(row, "code", "loinc_code", "LOINC_NUM")
+            name = _column(
+                row,
+                "name",
+                "LinguisticVariantDisplayName",
+                "LONG_COMMON_NAME",
+                "COMPONENT",
+            )
+            if not code or not name:
+                continue
+            if _column(row, "STATUS").upper() in ("DEPRECATED", "DISCOURAGED"):
+                continue
+            names = [name, _column(row, "SHORTNAME")]
+            names += _column(row, "synonyms").split("|")
+            names += _column(row, "RELATEDNAMES2").split(";")
+            entries.append(
+                {
+                    "code": code,
+                    "name": name,
+                    "system": _column(row, "system", "SYSTEM"),
+                    "names": [synonym for synonym in names if synonym.strip()],
+                }
+            )
+    return entries
+
+
+class LoincIndex:
+    """
+    Normalized-name index over a LOINC table. Built once and read-only
+    afterwards, so it can be shared between threads.
+    """
+
+    def __init__(self, entries: List[Dict[str, Any]], min_score: float = None):
+        self.entries = entries
+        self.min_score = LOINC_MIN_SCORE if min_score is None else min_score
+        self._exact: Dict[str, List[int]] = {}
+        # (entry id, trigram count, modifier words)
+        self._keys: List[Tuple[int, int, frozenset]] = []
+        self._postings: Dict[str, List[int]] = {}
+        for entry_id, entry in enumerate(entries):
+            for key in {name_key(name) for name in entry["names"]}:
+                if not key:
+                    continue
+                self._exact.setdefault(key, []).append(entry_id)
+                key_trigrams = trigrams(key)
+                key_id = len(self._keys)
+                self._keys.append((entry_id, len(key_trigrams), modifiers(key)))
+                for trigram in key_trigrams:
+                    self._postings.setdefault(trigram, []).append(key_id)
+
+    @classmethod
+    def from_csv(cls, path: str = None, min_score: float = None) -> "LoincIndex":
+        path = path or LOINC_TABLE
+        index = cls(read_table(path), min_score=min_score)
+        log.info(
+            "Loaded %d LOINC codes (%d names) from %s.",
+            len(index.entries),
+            len(index._keys),
+            path,
+            extra={
+                "event": "loinc.load",
+                "codes": len(index.entries),
+                "names": len(index._keys),
+            },
+        )
+        return index
+
+    def _match(self, entry_id: int, score: float, systems: Tuple[str, ...]):
+        entry = self.entries[entry_id]
+        if systems and entry["system"] not in systems:
+            score *= SYSTEM_MISMATCH_PENALTY
+        return score, entry
+
+    def _best(self, scored: Iterable[Tuple[float, Dict[str, Any]]], exact: bool):
+        # max() keeps the first of equal scores, i.e. the table order
+        best = max(scored, key=lambda item: item[0], default=None)
+        if best is None or best[0] < self.min_score:
+            return None
+        score, entry = best
+        return {
+            "code": entry["code"],
+            "name": entry["name"],
+            "system": entry["system"],
+            "score": round(score, 3),
+            # Exact name and specimen: safe to replace the model's code
+            "exact": exact and score >= 1.0,
+        }
+
+    def lookup(
+        self, description: str, sample_type: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Best entry for a test as {"code", "name", "system", "score", "exact"},
+        or None when nothing scores LOINC_MIN_SCORE. `exact` is True for an
+        exact name or synonym hit whose system matches the specimen. Without a
+        sample type, the specimen is taken from the description ("Creatinina
+        en orina").
+        """
+        key = lookup_key(description, sample_type)
+        if not key:
+            return None
+        systems = sample_systems(sample_type) or sample_systems(description)
+
+        exact = self._exact.get(key)
+        if exact:
+            match = self._best(
+                (self._match(entry_id, 1.0, systems) for entry_id in exact),
+                exact=True,
+            )
+            if match:
+                return match
+
+        query = trigrams(key)
+        query_modifiers = modifiers(key)
+        shared = Counter()
+        for trigram in query:
+            shared.update(self._postings.get(trigram, ()))
+        scored = []
+        for key_id, count in shared.items():
+            entry_id, key_size, key_modifiers = self._keys[key_id]
+            if key_modifiers != query_modifiers:
+                continue  # "Colesterol no HDL" is not "Colesterol HDL"
+            scored.append(
+                self._match(entry_id, 2 * count / (len(query) + key_size), systems)
+            )
+        return self._best(scored, exact=False)
+
+    def lookup_batch(
+        self, tests: Iterable[Tuple[str, Optional[str]]]
+    ) -> List[Optional[Dict[str, Any]]]:
+        """lookup() for (description, sample_type) pairs; repeated pairs are looked up once."""
+        memo: Dict[Tuple[str, Tuple[str, ...]], Optional[Dict[str, Any]]] = {}
+        results = []
+        for description, sample_type in tests:
+            memo_key = (
+                lookup_key(description or "", sample_type),
+                sample_systems(sample_type) or sample_systems(description or ""),
+            )
+            if memo_key not in memo:
+                memo[memo_key] = self.lookup(description or "", sample_type)
+            results.append(memo[memo_key])
+        return results
+
+
+_index: Optional[LoincIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> LoincIndex:
+    """The shared index of LOINC_TABLE, loaded on first use."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = LoincIndex.from_csv()
+    return _index
@@ -0,0 +1,243 @@
+"""
+Local OpenAI-compatible mock of the Requesty chat completions endpoint.
+
+Streams a fixed ExtractionResult (one test per page image received) as
+server-sent events over HTTP/1.1 keep-alive, so the workflows, the pooled
+clients and the benchmarks can run without network access or API costs.
+
+Faults can be injected to exercise the resilience layer: HTTP 500s, 429s
+with Retry-After, and stalls (no response for a while), either at random
+rates or as a fixed sequence for the first requests (`faults`).
+
+Run standalone:
+    python mock_server.py --port 8787
+    REQUESTY_BASE_URL=http://127.0.0.1:8787/v1 streamlit run app.py
+
+Or from Python:
+    server, base_url = start_mock_server()
+    workflows.get_client(base_url=base_url, api_key="test")
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Tuple
+
+
+def build_mock_result(page_count: int) -> Dict[str, Any]:
+    """A schema-valid ExtractionResult with one test per page."""
+    return {
+        "elements": [
+            {
+                "label": "Paciente",
+                "value": "PACIENTE DE PRUEBA",
+                "page_number": 1,
+                "bounding_box": [80, 100, 100, 400],
+            },
+            {
+                "label": "NumeroPeticion",
+                "value": "W12345678",
+                "page_number": 1,
+                "bounding_box": [110, 100, 130, 300],
+            },
+        ],
+        "tests": [
+            {
+                "description": "Glucosa",
+                "sample_type": "Suero",
+                "loinc_code": "2345-7",
+                "page_number": page,
+                "bounding_box": [300, 100, 320, 400],
+            }
+            for page in range(1, max(page_count, 1) + 1)
+        ],
+        "urine_details": None,
+    }
+
+
+class MockCompletionHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, so connection reuse is observable
+
+    # Tuned through the server attributes (see start_mock_server)
+    def _settings(self):
+        return self.server.mock_settings
+
+    def log_message(self, format, *args):
+        if self._settings().get("verbose"):
+            super().log_message(format, *args)
+
+    def _send_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _next_fault(self):
+        settings = self._settings()
+        with self.server.counter_lock:
+            if self.server.pending_faults:
+                return self.server.pending_faults.pop(0)
+            roll = self.server.fault_random.random()
+        for fault, rate_key in (
+            ("error", "error_rate"),
+            ("rate_limit", "rate_limit_rate"),
+            ("stall", "stall_rate"),
+        ):
+            rate = settings.get(rate_key, 0.0)
+            if roll < rate:
+                return fault
+            roll -= rate
+        return None
+
+    def _send_error_response(self, status: int, message: str, headers=None):
+        body = json.dumps({"error": {"message": message, "type": "mock_fault"}})
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        settings = self._settings()
+
+        with self.server.counter_lock:
+            self.server.request_count += 1
+
+        fault = self._next_fault()
+        if fault:
+            with self.server.counter_lock:
+                self.server.fault_counts[fault] = (
+                    self.server.fault_counts.get(fault, 0) + 1
+                )
+        if fault == "error":
+            self._send_error_response(500, "Injected server error")
+            return
+        if fault == "rate_limit":
+            self._send_error_response(
+                429,
+                "Injected rate limit",
+                {"Retry-After": str(settings.get("retry_after", 1))},
+            )
+            return
+        if fault == "stall":
+            # Hold the request, as an overloaded upstream would
+            time.sleep(settings.get("stall_seconds", 30.0))
+
+        page_count = 0
+        for message in body.get("messages", []):
+            if isinstance(message.get("content"), list):
+                page_count += sum(
+                    1 for part in message["content"] if part.get("type") == "image_url"
+                )
+
+        time.sleep(settings.get("latency", 0.0))
+        content = json.dumps(build_mock_result(page_count))
+        piece_size = settings.get("chunk_chars", 40)
+        pieces = [
+            content[i : i + piece_size] for i in range(0, len(content), piece_size)
+        ]
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for piece in pieces:
+            event = {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "mock"),
+                "choices": [
+                    {"index": 0, "delta": {"content": piece}, "finish_reason": None}
+                ],
+            }
+            self._send_chunk(f"data: {json.dumps(event)}\n\n".encode())
+            time.sleep(settings.get("token_delay", 0.0))
+        if body.get("stream_options", {}).get("include_usage"):
+            # Rough token counts: ~4 characters per token, ~800 per page image
+            prompt_tokens = len(json.dumps(body.get("messages", [])[:1])) // 4
+            prompt_tokens += 800 * page_count
+            completion_tokens = len(content) // 4
+            usage_event = {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "mock"),
+                "choices": [],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            }
+            self._send_chunk(f"data: {json.dumps(usage_event)}\n\n".encode())
+        # Send [DONE] and the end of the chunked body in one write, so clients
+        # that stop reading at [DONE] still see a complete response
+        done = b"data: [DONE]\n\n"
+        self.wfile.write(f"{len(done):X}\r\n".encode() + done + b"\r\n0\r\n\r\n")
+        self.wfile.flush()
+
+
+def start_mock_server(
+    host: str = "127.0.0.1", port: int = 0, **settings
+) -> Tuple[ThreadingHTTPServer, str]:
+    """
+    Starts the mock server in a daemon thread and returns (server, base_url).
+    Settings: latency (seconds before the first token), token_delay (seconds
+    between chunks), chunk_chars (characters per chunk), verbose.
+    Faults: error_rate (HTTP 500), rate_limit_rate (HTTP 429 with
+    Retry-After: retry_after seconds), stall_rate (wait stall_seconds before
+    answering), fault_seed, and faults, a list of "error"/"rate_limit"/"stall"
+    (or None) applied in order to the first requests.
+    Injected faults are counted in server.fault_counts.
+    Call server.shutdown() to stop it.
+    """
+    server = ThreadingHTTPServer((host, port), MockCompletionHandler)
+    server.daemon_threads = True
+    server.mock_settings = settings
+    server.request_count = 0
+    server.counter_lock = threading.Lock()
+    server.pending_faults = list(settings.get("faults") or [])
+    server.fault_counts = {}
+    server.fault_random = random.Random(settings.get("fault_seed"))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = f"http://{host}:{server.server_address[1]}/v1"
+    return server, base_url
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the mock completion server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--token-delay", type=float, default=0.01)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--stall-rate", type=float, default=0.0)
+    parser.add_argument("--stall-seconds", type=float, default=30.0)
+    args = parser.parse_args()
+
+    server, base_url = start_mock_server(
+        args.host,
+        args.port,
+        latency=args.latency,
+        token_delay=args.token_delay,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        stall_rate=args.stall_rate,
+        stall_seconds=args.stall_seconds,
+        verbose=True,
+    )
+    print(f"Mock server listening on {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
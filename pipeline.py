@@ -0,0 +1,248 @@
+"""
+Overlapped rasterize -> prepare -> upload pipeline for the vision path.
+
+The staged vision graph runs every stage over the whole document before the
+next one starts: all pages are rendered, then filtered, cropped and encoded,
+and only then is the request sent. PagePipeline streams pages through the
+stages instead:
+
+    poppler windows -> [bounded queue] -> prepare pool -> in-order pages
+    (RASTER_WORKERS)                      (blank check,    (duplicate check,
+                                           crop, encode)    request builder)
+
+- utils.iter_rasterized_pages renders small windows of pages in parallel and
+  yields them in document order as soon as each window is done.
+- Every page is prepared in a worker pool: thumbnail for the page filter,
+  content box and crop, and the upload encoding (skipped for blank pages).
+- The consumer gets the prepared pages in order, drops duplicates of earlier
+  pages (which needs those pages) and hands the rest to the request builder,
+  e.g. a chunk request that starts as soon as its pages are encoded.
+
+The queue between rendering and the consumer is bounded
+(PIPELINE_QUEUE_PAGES), so rendering pauses when preparing or the consumer
+falls behind. Rendered pages are not kept once they are encoded (only their
+thumbnails and hashes, for the duplicate check), so the pixels held at any
+time are bounded by the windows in flight and the queue, not by the length
+of the document. Wall time then approaches the slowest stage rather than the
+sum of all stages.
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from dotenv import load_dotenv
+
+import utils
+from telemetry import get_logger
+
+load_dotenv()
+
+# --- Configuration ---
+PIPELINE_WINDOW_PAGES = int(os.getenv("PIPELINE_WINDOW_PAGES", "2"))
+PIPELINE_PREPARE_WORKERS = int(os.getenv("PIPELINE_PREPARE_WORKERS", "0")) or None
+PIPELINE_QUEUE_PAGES = int(os.getenv("PIPELINE_QUEUE_PAGES", "8"))
+
+log = get_logger("pipeline")
+
+_DONE = object()
+
+
+class PagePipeline:
+    """
+    Rasterizes, filters, crops and encodes the pages of a PDF with the stages
+    overlapped. Iterating yields the pages to upload, in order, as
+    {"position", "page", "encoded"} (position in the upload, original page
+    number and the result of `encode(image, page_number)`, by default
+    utils.encode_page_for_upload).
+
+    The per-page results grow while iterating, so the pages yielded so far
+    can already be mapped back (see workflows._page_number_fixer):
+    - page_count, page_timings: every rendered page (the images themselves
+      are dropped once encoded)
+    - page_map: original page number of each uploaded page
+    - page_crops: crop of every page (None: uncropped), or None without cropping
+    After iteration, `page_filter` holds the utils.filter_pages result (None
+    without filtering) and `stats` the time spent per stage.
+    """
+
+    def __init__(
+        self,
+        pdf_bytes: bytes,
+        dpi: int = 200,
+        raster_workers: int = None,
+        prepare_workers: int = None,
+        window_pages: int = None,
+        queue_pages: int = None,
+        filter_settings: Optional[Dict[str, Any]] = None,
+        crop_settings: Optional[Dict[str, Any]] = None,
+        encode: Optional[Callable[[Any, int], Dict[str, Any]]] = None,
+    ):
+        self.pdf_bytes = pdf_bytes
+        self.dpi = dpi
+        self.raster_workers = raster_workers or os.cpu_count() or 1
+        self.prepare_workers = (
+            prepare_workers or PIPELINE_PREPARE_WORKERS or os.cpu_count() or 1
+        )
+        self.window_pages = max(1, window_pages or PIPELINE_WINDOW_PAGES)
+        self.queue_pages = max(1, queue_pages or PIPELINE_QUEUE_PAGES)
+        self.crop_settings = crop_settings
+        self.encode = encode or (
+            lambda image, page_number: utils.encode_page_for_upload(image)
+        )
+        self._filter = (
+            utils.PageFilter(**filter_settings) if filter_settings is not None else None
+        )
+
+        self.page_count = 0
+        self.page_timings: List[Dict[str, Any]] = []
+        self.page_map: List[int] = []
+        self.page_crops: Optional[List[Optional[List[int]]]] = (
+            [] if crop_settings is not None else None
+        )
+        self.page_filter: Optional[Dict[str, Any]] = None
+        self.stats: Dict[str, Any] = {}
+        self._prepare_seconds = 0.0
+        # First blank page, kept only until a page is uploaded: the upload
+        # fallback when every page is blank
+        self._fallback: Optional[Dict[str, Any]] = None
+
+    def _prepare(self, page_number: int, image, force: bool = False):
+        """Worker stage: blank check, crop and encoding of one page."""
+        start = time.perf_counter()
+        prepared = {"page": page_number, "thumbnail": None, "crop": None}
+        if self._filter is not None:
+            prepared["thumbnail"] = utils.page_thumbnail(image)
+            if not force and self._filter.is_blank(prepared["thumbnail"]):
+                prepared["encoded"] = None  # Dropped: no need to encode it
+                prepared["image"] = image  # Until the consumer sees a kept page
+                prepared["seconds"] = time.perf_counter() - start
+                return prepared
+            prepared["digest"] = utils.page_digest(image)
+        if self.crop_settings is not None:
+            prepared["crop"] = utils.content_box(image, **self.crop_settings)
+        prepared["encoded"] = self.encode(
+            utils.crop_page(image, prepared["crop"]), page_number
+        )
+        prepared["seconds"] = time.perf_counter() - start
+        return prepared
+
+    def _keep(self, prepared: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Consumer stage, in page order: the upload entry, or None if dropped."""
+        page_number = prepared["page"]
+        self._prepare_seconds += prepared["seconds"]
+        if self.page_crops is not None:
+            self.page_crops.append(prepared["crop"])
+        image = prepared.pop("image", None)
+        if image is not None and self._fallback is None and not self.page_map:
+            self._fallback = {"page": page_number, "image": image}
+        if self._filter is not None and not self._filter.add(
+            page_number, thumbnail=prepared["thumbnail"], digest=prepared.get("digest")
+        ):
+            return None
+        self.page_map.append(page_number)
+        self._fallback = None
+        return {
+            "position": len(self.page_map),
+            "page": page_number,
+            "encoded": prepared["encoded"],
+        }
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        start = time.perf_counter()
+        prepared_pages: queue.Queue = queue.Queue(maxsize=self.queue_pages)
+        stop = threading.Event()
+        first_page_at = None
+
+        def put(item) -> bool:
+            # Blocks while the queue is full, unless the consumer has stopped
+            while not stop.is_set():
+                try:
+                    prepared_pages.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce(executor: ThreadPoolExecutor):
+            try:
+                for page_number, image, seconds in utils.iter_rasterized_pages(
+                    pdf_bytes=self.pdf_bytes,
+                    dpi=self.dpi,
+                    workers=self.raster_workers,
+                    pages_per_window=self.window_pages,
+                    max_pending_windows=self.raster_workers,
+                ):
+                    self.page_count += 1
+                    self.page_timings.append({"page": page_number, "seconds": seconds})
+                    future = executor.submit(self._prepare, page_number, image)
+                    if not put(future):
+                        return
+                put(_DONE)
+            except Exception as e:
+                put(e)
+
+        with ThreadPoolExecutor(max_workers=self.prepare_workers) as executor:
+            producer = threading.Thread(
+                target=produce, args=(executor,), name="page-pipeline", daemon=True
+            )
+            producer.start()
+            try:
+                while True:
+                    item = prepared_pages.get()
+                    if item is _DONE:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    page = self._keep(item.result())
+                    if page:
+                        if first_page_at is None:
+                            first_page_at = time.perf_counter() - start
+                        yield page
+            finally:
+                stop.set()
+                producer.join()
+
+        if self._filter is not None:
+            self.page_filter = self._filter.result()
+            if not self.page_map and self._fallback is not None:
+                # Nothing but blank pages: still send one so the result is well formed
+                page_number = self._fallback["page"]
+                prepared = self._prepare(
+                    page_number, self._fallback.pop("image"), force=True
+                )
+                self.page_map.append(page_number)
+                if self.page_crops is not None:
+                    self.page_crops[page_number - 1] = prepared["crop"]
+                first_page_at = time.perf_counter() - start
+                yield {
+                    "position": 1,
+                    "page": page_number,
+                    "encoded": prepared["encoded"],
+                }
+
+        self.stats = {
+            "pages": self.page_count,
+            "uploaded_pages": len(self.page_map),
+            "render_seconds": round(
+                sum(timing["seconds"] for timing in self.page_timings), 4
+            ),
+            "prepare_seconds": round(self._prepare_seconds, 4),
+            "first_page_seconds": (
+                round(first_page_at, 4) if first_page_at is not None else None
+            ),
+            "wall_seconds": round(time.perf_counter() - start, 4),
+        }
+        log.info(
+            "Pipeline: %d pages rendered (%.2fs) and prepared (%.2fs) in %.2fs wall,"
+            " first page ready after %.2fs.",
+            self.stats["pages"],
+            self.stats["render_seconds"],
+            self.stats["prepare_seconds"],
+            self.stats["wall_seconds"],
+            self.stats["first_page_seconds"] or 0.0,
+            extra={"event": "pipeline", **self.stats},
+        )
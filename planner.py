@@ -0,0 +1,234 @@
+"""
+Token-budget-aware page batching.
+
+Estimates the image tokens each uploaded page costs for the target model and
+groups pages into contiguous request batches that fit both a token budget
+and a latency budget. When the document needs several requests anyway, the
+batches are spread over the available concurrency and balanced by tokens, so
+a long referral finishes in a predictable number of parallel rounds instead of
+one request running into its timeout.
+
+Image token estimates follow the providers' published accounting:
+- OpenAI (gpt-4o and similar): fit in 2048x2048, shortest side 768, then
+  170 tokens per 512 px tile plus 85.
+- Anthropic (claude): fit in 1568 px, about width * height / 750.
+- Google (gemini): 258 tokens per 768x768 tile (258 for a small image).
+"""
+
+import math
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+
+from telemetry import get_logger
+
+load_dotenv()
+
+# --- Configuration ---
+PLANNER_MAX_TOKENS_PER_REQUEST = int(
+    os.getenv("PLANNER_MAX_TOKENS_PER_REQUEST", "60000")
+)
+PLANNER_MAX_PAGES_PER_REQUEST = int(os.getenv("PLANNER_MAX_PAGES_PER_REQUEST", "20"))
+PLANNER_LATENCY_BUDGET = float(os.getenv("PLANNER_LATENCY_BUDGET", "120"))
+PLANNER_SECONDS_PER_PAGE = float(os.getenv("PLANNER_SECONDS_PER_PAGE", "6"))
+PLANNER_MIN_PAGES_PER_BATCH = int(os.getenv("PLANNER_MIN_PAGES_PER_BATCH", "2"))
+
+log = get_logger("planner")
+
+
+# --- Image Token Estimates ---
+
+
+def _fit(width: int, height: int, max_side: int) -> Tuple[float, float]:
+    scale = min(1.0, max_side / max(width, height))
+    return width * scale, height * scale
+
+
+def _openai_tokens(width: int, height: int) -> int:
+    width, height = _fit(width, height, 2048)
+    scale = min(1.0, 768 / min(width, height))
+    tiles = math.ceil(width * scale / 512) * math.ceil(height * scale / 512)
+    return 85 + 170 * tiles
+
+
+def _anthropic_tokens(width: int, height: int) -> int:
+    width, height = _fit(width, height, 1568)
+    return math.ceil(width * height / 750)
+
+
+def _gemini_tokens(width: int, height: int) -> int:
+    if width <= 384 and height <= 384:
+        return 258
+    return 258 * math.ceil(width / 768) * math.ceil(height / 768)
+
+
+# Matched as substrings of the (possibly provider-prefixed) model name
+MODEL_FAMILIES = [
+    ("claude", _anthropic_tokens),
+    ("anthropic", _anthropic_tokens),
+    ("gemini", _gemini_tokens),
+    ("vertex", _gemini_tokens),
+    ("google", _gemini_tokens),
+]
+
+
+def estimate_image_tokens(width: int, height: int, model: str) -> int:
+    """Estimated input tokens for one image of width x height pixels."""
+    name = (model or "").lower()
+    for family, estimate in MODEL_FAMILIES:
+        if family in name:
+            return estimate(width, height)
+    return _openai_tokens(width, height)  # OpenAI-style tiling by default
+
+
+def upload_size(
+    width: int, height: int, max_dimension: Optional[int] = None
+) -> Tuple[int, int]:
+    """Size of a page after utils.prepare_image_for_upload downscaling."""
+    if max_dimension and max(width, height) > max_dimension:
+        scale = max_dimension / max(width, height)
+        return max(1, round(width * scale)), max(1, round(height * scale))
+    return width, height
+
+
+# --- Planning ---
+
+
+def _fits(batch_tokens: int, batch_pages: int, limits: Dict[str, float]) -> bool:
+    return (
+        batch_pages <= limits["max_pages"]
+        and batch_tokens <= limits["max_tokens"]
+        and batch_pages * limits["seconds_per_page"] <= limits["latency_budget"]
+    )
+
+
+def _pack(page_tokens: Sequence[int], limits: Dict[str, float]) -> List[List[int]]:
+    """Greedy contiguous packing: the fewest batches that respect the limits."""
+    batches: List[List[int]] = []
+    batch: List[int] = []
+    batch_tokens = limits["overhead"]
+    for index, tokens in enumerate(page_tokens):
+        if batch and not _fits(batch_tokens + tokens, len(batch) + 1, limits):
+            batches.append(batch)
+            batch, batch_tokens = [], limits["overhead"]
+        batch.append(index)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _balanced(page_tokens: Sequence[int], count: int) -> List[List[int]]:
+    """Splits pages into `count` contiguous batches of roughly equal tokens."""
+    total = sum(page_tokens)
+    batches: List[List[int]] = []
+    start = 0
+    cumulative = 0
+    for position in range(1, count):
+        # Cut where the running total passes position/count of the tokens,
+        # leaving at least one page for every remaining batch
+        target = total * position / count
+        cumulative += page_tokens[start]
+        end = start + 1
+        while (
+            end < len(page_tokens) - (count - position)
+            and cumulative + page_tokens[end] / 2 <= target
+        ):
+            cumulative += page_tokens[end]
+            end += 1
+        batches.append(list(range(start, end)))
+        start = end
+    batches.append(list(range(start, len(page_tokens))))
+    return batches
+
+
+def plan_batches(
+    page_sizes: Sequence[Tuple[int, int]],
+    model: str,
+    max_concurrency: int = 1,
+    overhead_tokens: int = 0,
+    seconds_per_page: Optional[float] = None,
+    max_tokens: int = None,
+    max_pages: int = None,
+    latency_budget: float = None,
+    min_pages_per_batch: int = None,
+) -> Dict[str, Any]:
+    """
+    Groups pages (their upload sizes in pixels) into contiguous request
+    batches. Each batch stays within `max_tokens` (image tokens plus the
+    prompt `overhead_tokens`), `max_pages` and `latency_budget` seconds at
+    `seconds_per_page`. If more than one batch is needed, the batches are
+    spread over up to `max_concurrency` requests of at least
+    `min_pages_per_batch` pages each and balanced by tokens.
+
+    Returns {"batches": [[0-based page index, ...], ...], "page_tokens",
+    "batch_tokens", "estimated_seconds"}.
+    """
+    limits = {
+        "max_tokens": max_tokens or PLANNER_MAX_TOKENS_PER_REQUEST,
+        "max_pages": max(1, max_pages or PLANNER_MAX_PAGES_PER_REQUEST),
+        "latency_budget": latency_budget or PLANNER_LATENCY_BUDGET,
+        "seconds_per_page": seconds_per_page or PLANNER_SECONDS_PER_PAGE,
+        "overhead": overhead_tokens,
+    }
+    min_pages = max(1, min_pages_per_batch or PLANNER_MIN_PAGES_PER_BATCH)
+    page_tokens = [
+        estimate_image_tokens(width, height, model) for width, height in page_sizes
+    ]
+
+    batches = _pack(page_tokens, limits)
+    if len(batches) > 1:
+        # Several requests are needed anyway: use the idle concurrency too
+        target = min(max(1, max_concurrency), len(page_tokens) // min_pages)
+        for count in range(max(len(batches), target), len(page_tokens) + 1):
+            balanced = _balanced(page_tokens, count)
+            if all(
+                _fits(
+                    limits["overhead"] + sum(page_tokens[index] for index in batch),
+                    len(batch),
+                    limits,
+                )
+                for batch in balanced
+            ):
+                batches = balanced
+                break
+
+    batch_tokens = [
+        limits["overhead"] + sum(page_tokens[index] for index in batch)
+        for batch in batches
+    ]
+    rounds = math.ceil(len(batches) / max(1, max_concurrency))
+    largest = max((len(batch) for batch in batches), default=0)
+    return {
+        "batches": batches,
+        "page_tokens": page_tokens,
+        "batch_tokens": batch_tokens,
+        "estimated_seconds": rounds * largest * limits["seconds_per_page"],
+    }
+
+
+def log_plan(plan: Dict[str, Any], model: str, page_map: Optional[List[int]] = None):
+    """Logs the chosen batches with their (original) page ranges and token estimates."""
+    ranges = []
+    for batch, tokens in zip(plan["batches"], plan["batch_tokens"]):
+        first, last = batch[0] + 1, batch[-1] + 1
+        if page_map:
+            first, last = page_map[batch[0]], page_map[batch[-1]]
+        ranges.append(f"{first}-{last} (~{tokens} tokens)")
+    log.info(
+        "Batch plan for %s: %d pages in %d requests: %s",
+        model,
+        len(plan["page_tokens"]),
+        len(plan["batches"]),
+        ", ".join(ranges),
+        extra={
+            "event": "batch_plan",
+            "model": model,
+            "pages": len(plan["page_tokens"]),
+            "requests": len(plan["batches"]),
+            "batch_pages": [len(batch) for batch in plan["batches"]],
+            "batch_tokens": plan["batch_tokens"],
+            "estimated_seconds": round(plan["estimated_seconds"], 1),
+        },
+    )
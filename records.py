@@ -0,0 +1,342 @@
+"""
+Compact extraction records and columnar export.
+
+`DocumentRecords` holds the elements, tests and urine details of one document
+column by column: strings in lists (interned, so repeated labels, sample types
+and codes are shared across documents), page numbers and bounding boxes in
+fixed-width `array("i")` columns (4 ints per box, -1 for a missing box), and
+nested objects such as a test's `loinc_suggestion` as tuples (structs in
+Parquet).
+Thousands of documents then cost a fraction of the nested result dicts, and
+rows are only materialized as dicts when a page is rendered.
+
+`ParquetWriter` appends documents to Parquet datasets partitioned by
+extraction date, one per section:
+
+    <root>/elements/date=2024-05-01/part-....parquet
+    <root>/tests/date=2024-05-01/part-....parquet
+    <root>/urine_details/date=2024-05-01/part-....parquet
+
+They can be scanned without loading JSON, e.g.
+`pyarrow.dataset.dataset("<root>/tests", partitioning="hive")`.
+pyarrow is optional: it is only needed to write Parquet.
+"""
+
+import os
+import sys
+import threading
+import uuid
+from array import array
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - optional dependency
+    pa = None
+    pq = None
+
+load_dotenv()
+
+# --- Configuration ---
+RECORDS_PARQUET_MAX_ROWS = int(os.getenv("RECORDS_PARQUET_MAX_ROWS", "100000"))
+
+MISSING_BOX = (-1, -1, -1, -1)
+
+# Section -> (key in the extraction result, string fields, nested fields)
+SECTIONS = {
+    "elements": ("elements", ("label", "value"), ()),
+    "tests": (
+        "tests",
+        ("description", "sample_type", "loinc_code"),
+        ("loinc_suggestion",),
+    ),
+    "urine_details": ("urine_details", ("collection_type", "volume"), ()),
+}
+
+# Nested field -> its (key, type) pairs; stored as a tuple per row (None if absent)
+NESTED_FIELDS = {
+    "loinc_suggestion": (("code", str), ("name", str), ("score", float)),
+}
+
+
+def _intern(value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    return sys.intern(str(value))
+
+
+def _nested(field: str, value: Any) -> Optional[Tuple[Any, ...]]:
+    if not isinstance(value, dict):
+        return None
+    parts = []
+    for key, kind in NESTED_FIELDS[field]:
+        part = value.get(key)
+        if part is not None:
+            part = _intern(part) if kind is str else kind(part)
+        parts.append(part)
+    return tuple(parts)
+
+
+def _box(bbox: Any) -> Tuple[int, int, int, int]:
+    try:
+        if bbox and len(bbox) == 4:
+            return tuple(int(coordinate) for coordinate in bbox)
+    except (TypeError, ValueError):
+        pass
+    return MISSING_BOX
+
+
+# --- Records ---
+
+
+class RecordColumns:
+    """One section of a document: string and nested columns, pages and boxes."""
+
+    __slots__ = ("fields", "strings", "nested_fields", "nested", "pages", "boxes")
+
+    def __init__(self, fields: Tuple[str, ...], nested_fields: Tuple[str, ...] = ()):
+        self.fields = fields
+        self.strings: Tuple[List[Optional[str]], ...] = tuple([] for _ in fields)
+        self.nested_fields = nested_fields
+        self.nested: Tuple[List[Optional[Tuple[Any, ...]]], ...] = tuple(
+            [] for _ in nested_fields
+        )
+        self.pages = array("i")
+        self.boxes = array("i")  # 4 per row
+
+    def __len__(self) -> int:
+        return len(self.pages)
+
+    def append(self, item: Dict[str, Any]):
+        for column, field in zip(self.strings, self.fields):
+            column.append(_intern(item.get(field)))
+        for column, field in zip(self.nested, self.nested_fields):
+            column.append(_nested(field, item.get(field)))
+        self.pages.append(int(item.get("page_number") or 0))
+        self.boxes.extend(_box(item.get("bounding_box")))
+
+    def box(self, index: int) -> Optional[List[int]]:
+        box = self.boxes[4 * index : 4 * index + 4].tolist()
+        return None if tuple(box) == MISSING_BOX else box
+
+    def row(self, index: int) -> Dict[str, Any]:
+        """The item as a result dict (same keys as the extraction schema)."""
+        item = {
+            field: column[index] for field, column in zip(self.fields, self.strings)
+        }
+        for field, column in zip(self.nested_fields, self.nested):
+            value = column[index]
+            item[field] = (
+                None
+                if value is None
+                else {key: part for (key, _), part in zip(NESTED_FIELDS[field], value)}
+            )
+        item["page_number"] = self.pages[index]
+        item["bounding_box"] = self.box(index)
+        return item
+
+    def rows(self) -> List[Dict[str, Any]]:
+        return [self.row(index) for index in range(len(self))]
+
+
+class DocumentRecords:
+    """The extraction result of one document in compact columns."""
+
+    __slots__ = ("doc_id", "metadata", "extracted_at", "sections", "_page_index")
+
+    def __init__(
+        self,
+        doc_id: str,
+        extracted_at: Optional[datetime] = None,
+        metadata: Optional[Dict[str, Any]] = None,
+    ):
+        self.doc_id = doc_id
+        self.extracted_at = extracted_at or datetime.now(timezone.utc)
+        self.metadata = metadata or {}  # file, model, trace_id...
+        self.sections = {
+            name: RecordColumns(fields, nested_fields)
+            for name, (_, fields, nested_fields) in SECTIONS.items()
+        }
+        self._page_index = None
+
+    @classmethod
+    def from_result(
+        cls,
+        extracted_data: Iterable[Dict[str, Any]],
+        doc_id: str,
+        extracted_at: Optional[datetime] = None,
+        **metadata,
+    ) -> "DocumentRecords":
+        """Builds the records from a workflow's `extracted_data` entries."""
+        records = cls(doc_id, extracted_at, metadata)
+        for entry in extracted_data or []:
+            content = entry.get("content") or {}
+            for name, (key, _, _) in SECTIONS.items():
+                items = content.get(key) or []
+                if isinstance(items, dict):
+                    items = [items]  # urine_details is a single object
+                for item in items:
+                    records.sections[name].append(item)
+        return records
+
+    def __len__(self) -> int:
+        return sum(len(section) for section in self.sections.values())
+
+    def pages(self) -> List[int]:
+        """Sorted page numbers that have at least one item."""
+        return sorted(self._index())
+
+    def _index(self) -> Dict[int, Dict[str, List[int]]]:
+        # page -> section -> row indexes, built once per document
+        if self._page_index is None:
+            index: Dict[int, Dict[str, List[int]]] = {}
+            for name, section in self.sections.items():
+                for row, page in enumerate(section.pages):
+                    if page:
+                        index.setdefault(page, {}).setdefault(name, []).append(row)
+            self._page_index = index
+        return self._page_index
+
+    def page_rows(self, page: int) -> Dict[str, List[Dict[str, Any]]]:
+        """{"elements", "tests", "urine_details"} rows of one page, as dicts."""
+        rows = self._index().get(page, {})
+        return {
+            name: [section.row(index) for index in rows.get(name, [])]
+            for name, section in self.sections.items()
+        }
+
+
+# --- Parquet Export ---
+
+
+def _arrow_type(field: str):
+    """Struct type of a nested field."""
+    types = {str: pa.string(), float: pa.float64()}
+    return pa.struct([(key, types[kind]) for key, kind in NESTED_FIELDS[field]])
+
+
+def _arrow_schema(name: str):
+    _, fields, nested_fields = SECTIONS[name]
+    return pa.schema(
+        [
+            ("doc_id", pa.string()),
+            ("file", pa.string()),
+            ("model", pa.string()),
+            ("trace_id", pa.string()),
+            ("extracted_at", pa.timestamp("ms", tz="UTC")),
+            *[(field, pa.string()) for field in fields],
+            *[(field, _arrow_type(field)) for field in nested_fields],
+            ("page_number", pa.int32()),
+            # Fixed width in memory; a plain list on disk, since null
+            # fixed-size lists do not round-trip through Parquet
+            ("bounding_box", pa.list_(pa.int32())),
+        ]
+    )
+
+
+def _arrow_table(name: str, documents: List[DocumentRecords]):
+    """One Arrow table of a section for several documents, built column-wise."""
+    _, fields, nested_fields = SECTIONS[name]
+    sections = [document.sections[name] for document in documents]
+    counts = [len(section) for section in sections]
+
+    def repeated(values):
+        return [value for value, count in zip(values, counts) for _ in range(count)]
+
+    pages = array("i")
+    boxes = array("i")
+    for section in sections:
+        pages.extend(section.pages)
+        boxes.extend(section.boxes)
+    box_values = pa.array(boxes, type=pa.int32())
+    missing = [
+        boxes[4 * row : 4 * row + 4].tolist() == list(MISSING_BOX)
+        for row in range(len(pages))
+    ]
+    bounding_boxes = pa.FixedSizeListArray.from_arrays(
+        box_values, 4, mask=pa.array(missing, type=pa.bool_())
+    ).cast(pa.list_(pa.int32()))
+    columns = {
+        "doc_id": repeated([document.doc_id for document in documents]),
+        "file": repeated([document.metadata.get("file") for document in documents]),
+        "model": repeated([document.metadata.get("model") for document in documents]),
+        "trace_id": repeated(
+            [document.metadata.get("trace_id") for document in documents]
+        ),
+        "extracted_at": repeated([document.extracted_at for document in documents]),
+    }
+    for position, field in enumerate(fields):
+        columns[field] = [
+            value for section in sections for value in section.strings[position]
+        ]
+    for position, field in enumerate(nested_fields):
+        keys = [key for key, _ in NESTED_FIELDS[field]]
+        columns[field] = [
+            None if value is None else dict(zip(keys, value))
+            for section in sections
+            for value in section.nested[position]
+        ]
+    columns["page_number"] = pa.array(pages, type=pa.int32())
+    columns["bounding_box"] = bounding_boxes
+    return pa.Table.from_pydict(columns, schema=_arrow_schema(name))
+
+
+class ParquetWriter:
+    """
+    Buffers DocumentRecords and appends them to date-partitioned Parquet
+    datasets under `root`. A new file is written per section and date every
+    `max_rows` buffered rows and on flush()/close(). Thread-safe.
+    """
+
+    def __init__(self, root: str, max_rows: int = RECORDS_PARQUET_MAX_ROWS):
+        if pa is None:
+            raise RuntimeError("Parquet export needs pyarrow: pip install pyarrow")
+        self.root = root
+        self.max_rows = max_rows
+        self._buffer: List[DocumentRecords] = []
+        self._rows = 0
+        self._lock = threading.Lock()
+        self.files_written: List[str] = []
+
+    def write(self, document: DocumentRecords):
+        with self._lock:
+            self._buffer.append(document)
+            self._rows += len(document)
+            if self._rows >= self.max_rows:
+                self._flush_locked()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        by_date: Dict[str, List[DocumentRecords]] = {}
+        for document in self._buffer:
+            date = document.extracted_at.astimezone(timezone.utc).date().isoformat()
+            by_date.setdefault(date, []).append(document)
+        self._buffer, self._rows = [], 0
+
+        part = f"part-{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+        for date, documents in by_date.items():
+            for name in SECTIONS:
+                table = _arrow_table(name, documents)
+                if not table.num_rows:
+                    continue
+                directory = os.path.join(self.root, name, f"date={date}")
+                os.makedirs(directory, exist_ok=True)
+                path = os.path.join(directory, f"{part}.parquet")
+                pq.write_table(table, path)
+                self.files_written.append(path)
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,445 @@
+"""
+Resilience layer around the completion call.
+
+- Adaptive timeouts: each model call gets a deadline derived from the latency
+  observed for that model (seconds per page, p95 and p99) and the number of
+  pages, instead of a flat 600 s. Until enough samples exist the flat
+  RESILIENCE_TIMEOUT_MAX is kept.
+- Retries: connection errors, timeouts, 408/409/429 and 5xx responses are
+  retried with full-jitter exponential backoff. A Retry-After header (or
+  retry-after-ms) sets the delay instead.
+- Hedging (optional): once the call has been running longer than the p95
+  latency for its size, a duplicate request is sent (to
+  RESILIENCE_FALLBACK_MODEL when set) and whichever finishes first wins. The
+  other attempt is cancelled.
+
+call_with_resilience runs thread-based attempts; acall_with_resilience is the
+asyncio equivalent used by the async workflow nodes.
+"""
+
+import asyncio
+import contextvars
+import email.utils
+import os
+import queue
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+import httpx
+import openai
+from dotenv import load_dotenv
+
+from telemetry import get_logger, registry
+
+load_dotenv()
+
+# --- Configuration ---
+RESILIENCE_MAX_ATTEMPTS = int(os.getenv("RESILIENCE_MAX_ATTEMPTS", "3"))
+RESILIENCE_BACKOFF_BASE = float(os.getenv("RESILIENCE_BACKOFF_BASE", "1"))
+RESILIENCE_BACKOFF_MAX = float(os.getenv("RESILIENCE_BACKOFF_MAX", "30"))
+RESILIENCE_TIMEOUT_MIN = float(os.getenv("RESILIENCE_TIMEOUT_MIN", "30"))
+RESILIENCE_TIMEOUT_MAX = float(os.getenv("RESILIENCE_TIMEOUT_MAX", "600"))
+RESILIENCE_TIMEOUT_MULTIPLIER = float(os.getenv("RESILIENCE_TIMEOUT_MULTIPLIER", "3"))
+RESILIENCE_HEDGE_ENABLED = os.getenv("RESILIENCE_HEDGE_ENABLED", "false").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+RESILIENCE_HEDGE_PERCENTILE = float(os.getenv("RESILIENCE_HEDGE_PERCENTILE", "95"))
+RESILIENCE_MIN_SAMPLES = int(os.getenv("RESILIENCE_MIN_SAMPLES", "20"))
+RESILIENCE_FALLBACK_MODEL = os.getenv("RESILIENCE_FALLBACK_MODEL") or None
+
+log = get_logger("resilience")
+
+LLM_ATTEMPTS = registry.counter(
+    "extractor_llm_attempts_total", "Model call attempts by outcome."
+)
+LLM_HEDGES = registry.counter(
+    "extractor_llm_hedges_total", "Hedged requests sent, by winner (primary, hedge)."
+)
+
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+
+
+class DeadlineExceeded(TimeoutError):
+    """The call ran past its adaptive deadline."""
+
+
+class Cancelled(Exception):
+    """The attempt lost a hedged race and was stopped."""
+
+
+# --- Latency Tracking ---
+
+
+class LatencyTracker:
+    """
+    Rolling window of observed seconds-per-page per model. Normalizing by page
+    count lets one history serve single-page chunks and whole documents.
+    """
+
+    def __init__(self, window: int = 200, min_samples: int = RESILIENCE_MIN_SAMPLES):
+        self.min_samples = min_samples
+        self._samples: Dict[str, Deque[float]] = defaultdict(
+            lambda: deque(maxlen=window)
+        )
+        self._lock = threading.Lock()
+
+    def observe(self, model: str, seconds: float, pages: int):
+        with self._lock:
+            self._samples[model].append(seconds / max(pages, 1))
+
+    def percentile(self, model: str, pages: int, pct: float) -> Optional[float]:
+        """Expected seconds at the given percentile, or None with too few samples."""
+        with self._lock:
+            samples = sorted(self._samples.get(model, ()))
+        if len(samples) < self.min_samples:
+            return None
+        index = min(len(samples) - 1, int(round(pct / 100 * (len(samples) - 1))))
+        return samples[index] * max(pages, 1)
+
+    def timeout_for(self, model: str, pages: int) -> float:
+        """
+        Deadline for one attempt: a multiple of p95, never below p99, or
+        RESILIENCE_TIMEOUT_MAX while there are too few samples to tell.
+        """
+        p95 = self.percentile(model, pages, 95)
+        if p95 is None:
+            return RESILIENCE_TIMEOUT_MAX
+        p99 = self.percentile(model, pages, 99)
+        timeout = max(p95 * RESILIENCE_TIMEOUT_MULTIPLIER, p99)
+        return min(RESILIENCE_TIMEOUT_MAX, max(RESILIENCE_TIMEOUT_MIN, timeout))
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+
+
+latency_tracker = LatencyTracker()
+
+
+# --- Retry Policy ---
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Reads retry-after-ms / Retry-After (seconds or HTTP date) from an API error."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(
+        error, (DeadlineExceeded, openai.APIConnectionError, httpx.TransportError)
+    ):
+        return True  # APITimeoutError is an APIConnectionError
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES or error.status_code >= 500
+    return False
+
+
+def backoff_delay(attempt: int, error: Exception = None) -> float:
+    """Delay before retry number `attempt` (1-based): Retry-After or full jitter."""
+    retry_after = retry_after_seconds(error) if error is not None else None
+    if retry_after is not None:
+        return min(retry_after, RESILIENCE_BACKOFF_MAX)
+    ceiling = min(RESILIENCE_BACKOFF_MAX, RESILIENCE_BACKOFF_BASE * 2 ** (attempt - 1))
+    return random.uniform(0, ceiling)
+
+
+# --- Hedged Execution ---
+
+# attempt(model, timeout, cancel_event) -> result
+Attempt = Callable[[str, float, threading.Event], Any]
+
+
+def _hedged(
+    attempt: Attempt,
+    model: str,
+    timeout: float,
+    hedge_after: Optional[float],
+    hedge_model: str,
+) -> Tuple[Any, bool, float]:
+    """
+    Runs `attempt` and, if it is still running after `hedge_after` seconds,
+    a second one with `hedge_model`. Returns (result, hedge_won, started),
+    where `started` is the perf_counter time the winning attempt began. If
+    every started attempt fails, the primary's error is raised.
+    """
+    started = {"primary": time.perf_counter()}
+    if hedge_after is None or hedge_after >= timeout:
+        return attempt(model, timeout, threading.Event()), False, started["primary"]
+
+    results: "queue.Queue[Tuple[str, bool, Any]]" = queue.Queue()
+    cancel_events = {"primary": threading.Event(), "hedge": threading.Event()}
+
+    def run(name: str, attempt_model: str):
+        try:
+            results.put(
+                (name, True, attempt(attempt_model, timeout, cancel_events[name]))
+            )
+        except BaseException as e:
+            results.put((name, False, e))
+
+    def start(name: str, attempt_model: str):
+        started[name] = time.perf_counter()
+        # Copy the context so the attempt can still use the LangGraph stream writer
+        context = contextvars.copy_context()
+        threading.Thread(
+            target=context.run, args=(run, name, attempt_model), daemon=True
+        ).start()
+
+    start("primary", model)
+    running = 1
+    errors: Dict[str, BaseException] = {}
+    try:
+        name, ok, value = results.get(timeout=hedge_after)
+    except queue.Empty:
+        log.info(
+            "No response after %.1fs, sending a hedged request to %s.",
+            hedge_after,
+            hedge_model,
+            extra={"event": "llm.hedge", "model": model, "hedge_model": hedge_model},
+        )
+        start("hedge", hedge_model)
+        running += 1
+        name, ok, value = results.get()
+
+    while True:
+        if ok:
+            for other, event in cancel_events.items():
+                if other != name:
+                    event.set()
+            if running > 1:
+                LLM_HEDGES.inc(model=model, winner=name)
+            return value, name == "hedge", started[name]
+        errors[name] = value
+        running -= 1
+        if running == 0:
+            raise errors.get("primary") or value
+        name, ok, value = results.get()
+
+
+# await attempt(model, timeout) -> result
+AsyncAttempt = Callable[[str, float], Awaitable[Any]]
+
+
+async def _ahedged(
+    attempt: AsyncAttempt,
+    model: str,
+    timeout: float,
+    hedge_after: Optional[float],
+    hedge_model: str,
+) -> Tuple[Any, bool, float]:
+    """Async version of _hedged: attempts are tasks, the loser is cancelled."""
+
+    async def run(attempt_model: str):
+        try:
+            return await asyncio.wait_for(attempt(attempt_model, timeout), timeout)
+        except asyncio.TimeoutError as e:
+            raise DeadlineExceeded(
+                f"{attempt_model} did not finish within {timeout:.0f}s"
+            ) from e
+
+    started = {"primary": time.perf_counter()}
+    if hedge_after is None or hedge_after >= timeout:
+        return await run(model), False, started["primary"]
+
+    tasks = {asyncio.ensure_future(run(model)): "primary"}
+    done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+    if not done:
+        log.info(
+            "No response after %.1fs, sending a hedged request to %s.",
+            hedge_after,
+            hedge_model,
+            extra={"event": "llm.hedge", "model": model, "hedge_model": hedge_model},
+        )
+        started["hedge"] = time.perf_counter()
+        tasks[asyncio.ensure_future(run(hedge_model))] = "hedge"
+
+    errors: Dict[str, BaseException] = {}
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                name = tasks[task]
+                if task.exception() is None:
+                    if len(tasks) > 1:
+                        LLM_HEDGES.inc(model=model, winner=name)
+                    return task.result(), name == "hedge", started[name]
+                errors[name] = task.exception()
+    finally:
+        for task in pending:
+            task.cancel()
+    raise errors.get("primary") or errors["hedge"]
+
+
+def call_with_resilience(
+    attempt: Attempt,
+    model: str,
+    pages: int,
+    tracker: LatencyTracker = None,
+    max_attempts: int = None,
+    hedge: bool = None,
+    fallback_model: str = None,
+) -> Tuple[Any, Dict[str, Any]]:
+    """
+    Calls `attempt(model, timeout, cancel_event)` with adaptive deadlines,
+    retries and optional hedging. The attempt must stop (raising Cancelled or
+    DeadlineExceeded) once `cancel_event` is set or `timeout` has elapsed.
+
+    Returns (result, info) where info has "retries", "hedged", "model" (the
+    model that produced the result) and "timeout" (the last deadline used).
+    Non-retryable errors and the last retryable one are raised unchanged.
+    """
+    tracker = tracker or latency_tracker
+    max_attempts = max(1, max_attempts or RESILIENCE_MAX_ATTEMPTS)
+    hedge = RESILIENCE_HEDGE_ENABLED if hedge is None else hedge
+    hedge_model = fallback_model or RESILIENCE_FALLBACK_MODEL or model
+
+    for attempt_number in range(1, max_attempts + 1):
+        timeout = tracker.timeout_for(model, pages)
+        hedge_after = (
+            tracker.percentile(model, pages, RESILIENCE_HEDGE_PERCENTILE)
+            if hedge
+            else None
+        )
+        try:
+            result, hedge_won, started = _hedged(
+                attempt, model, timeout, hedge_after, hedge_model
+            )
+        except Exception as error:
+            LLM_ATTEMPTS.inc(model=model, outcome=type(error).__name__)
+            if attempt_number == max_attempts or not is_retryable(error):
+                raise
+            time.sleep(_retry_delay(model, attempt_number, max_attempts, error))
+            continue
+
+        return result, _succeeded(
+            tracker,
+            model,
+            hedge_model,
+            hedge_won,
+            started,
+            pages,
+            attempt_number,
+            timeout,
+        )
+
+
+async def acall_with_resilience(
+    attempt: AsyncAttempt,
+    model: str,
+    pages: int,
+    tracker: LatencyTracker = None,
+    max_attempts: int = None,
+    hedge: bool = None,
+    fallback_model: str = None,
+) -> Tuple[Any, Dict[str, Any]]:
+    """
+    Async version of call_with_resilience for `await attempt(model, timeout)`.
+    The deadline is enforced here as well, and a lost hedge is cancelled as a
+    task, so the attempt needs no cancel event.
+    """
+    tracker = tracker or latency_tracker
+    max_attempts = max(1, max_attempts or RESILIENCE_MAX_ATTEMPTS)
+    hedge = RESILIENCE_HEDGE_ENABLED if hedge is None else hedge
+    hedge_model = fallback_model or RESILIENCE_FALLBACK_MODEL or model
+
+    for attempt_number in range(1, max_attempts + 1):
+        timeout = tracker.timeout_for(model, pages)
+        hedge_after = (
+            tracker.percentile(model, pages, RESILIENCE_HEDGE_PERCENTILE)
+            if hedge
+            else None
+        )
+        try:
+            result, hedge_won, started = await _ahedged(
+                attempt, model, timeout, hedge_after, hedge_model
+            )
+        except Exception as error:
+            LLM_ATTEMPTS.inc(model=model, outcome=type(error).__name__)
+            if attempt_number == max_attempts or not is_retryable(error):
+                raise
+            await asyncio.sleep(
+                _retry_delay(model, attempt_number, max_attempts, error)
+            )
+            continue
+
+        return result, _succeeded(
+            tracker,
+            model,
+            hedge_model,
+            hedge_won,
+            started,
+            pages,
+            attempt_number,
+            timeout,
+        )
+
+
+def _retry_delay(
+    model: str, attempt_number: int, max_attempts: int, error: Exception
+) -> float:
+    delay = backoff_delay(attempt_number, error)
+    log.warning(
+        "Attempt %d/%d failed (%s: %s), retrying in %.1fs.",
+        attempt_number,
+        max_attempts,
+        type(error).__name__,
+        error,
+        delay,
+        extra={
+            "event": "llm.retry",
+            "model": model,
+            "attempt": attempt_number,
+            "delay_seconds": round(delay, 3),
+        },
+    )
+    return delay
+
+
+def _succeeded(
+    tracker: LatencyTracker,
+    model: str,
+    hedge_model: str,
+    hedge_won: bool,
+    started: float,
+    pages: int,
+    attempt_number: int,
+    timeout: float,
+) -> Dict[str, Any]:
+    LLM_ATTEMPTS.inc(model=model, outcome="ok")
+    winner_model = hedge_model if hedge_won else model
+    # Measured from the winner's own start: a hedge began hedge_after later
+    tracker.observe(winner_model, time.perf_counter() - started, pages)
+    return {
+        "retries": attempt_number - 1,
+        "hedged": hedge_won,
+        "model": winner_model,
+        "timeout": timeout,
+    }
@@ -0,0 +1,338 @@
+"""
+Rule-based extraction of header fields from the PDF text layer.
+
+Identity document, phone, date of birth, collegiate number and petition
+number follow rigid formats, so they can be read from the text layer
+(utils.extract_text_layer) without the model: precompiled label and value
+patterns, checksums where the format has one, and label proximity (the value
+follows the label on the same line, in the next line to the right, or just
+below it). Only the fields the rules cannot resolve unambiguously are left to
+the model, whose prompt is narrowed to them (see narrow_prompt).
+"""
+
+import datetime
+import functools
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+# --- Patterns ---
+
+DNI_LETTERS = "TRWAGMYFPDXBNJZSQVHLCKE"
+
+
+def _valid_dni(value: str) -> Optional[str]:
+    """Canonical DNI/NIE (no separators) when the control letter matches."""
+    value = re.sub(r"[\s.-]", "", value.upper())
+    match = re.fullmatch(r"([XYZ]?)(\d{7,8})([A-Z])", value)
+    if not match:
+        return None
+    prefix, digits, letter = match.groups()
+    if prefix:
+        if len(digits) != 7:
+            return None
+        digits = str("XYZ".index(prefix)) + digits
+    elif len(digits) != 8:
+        return None
+    return value if DNI_LETTERS[int(digits) % 23] == letter else None
+
+
+def _valid_phone(value: str) -> Optional[str]:
+    digits = re.sub(r"\D", "", value)
+    if digits.startswith("34") and len(digits) == 11:
+        digits = digits[2:]
+    if len(digits) != 9 or digits[0] not in "6789":
+        return None
+    return value.strip()
+
+
+def _valid_date(value: str) -> Optional[str]:
+    """dd/mm/yyyy for a plausible date of birth (two-digit years are expanded)."""
+    day, month, year = (int(part) for part in re.split(r"[/.-]", value))
+    today = datetime.date.today()
+    if year < 100:
+        year += 2000 if 2000 + year <= today.year else 1900
+    try:
+        date = datetime.date(year, month, day)
+    except ValueError:
+        return None
+    if not datetime.date(1900, 1, 1) <= date <= today:
+        return None
+    return date.strftime("%d/%m/%Y")
+
+
+def _valid_code(value: str) -> Optional[str]:
+    return value.strip()
+
+
+# Unlabeled matches of header-only fields must start above this line (0-1000 page scale)
+HEADER_MAX_Y = 250
+
+# Per field: label pattern, value pattern, validator (canonical value or None),
+# where a value counts without a label (False, "anywhere" or "header"), and
+# whether several values are kept
+RULES: Dict[str, Dict[str, Any]] = {
+    "DocumentoIdentidad": {
+        "label": re.compile(
+            r"\b(?:D\.?\s?N\.?\s?I|N\.?\s?I\.?\s?[FE]|Documento(?:\s+de\s+identidad)?)\b\.?",
+            re.IGNORECASE,
+        ),
+        "value": re.compile(
+            r"(?<![\w-])(?:[XYZ][\s-]?\d{7}|\d{8})[\s-]?[A-Z](?![\w-])"
+        ),
+        "validate": _valid_dni,
+        "unlabeled": "anywhere",  # The control letter makes a bare match reliable
+        "multiple": False,
+    },
+    "Telefono": {
+        "label": re.compile(
+            r"\b(?:Tel[eé]fonos?|Telf?|Tfno|M[oó]vil|Celular)\b\.?", re.IGNORECASE
+        ),
+        "value": re.compile(r"(?<![\d+])(?:\+34[\s.-]?)?[6789](?:[\s.-]?\d){8}(?!\d)"),
+        "validate": _valid_phone,
+        "unlabeled": False,
+        "multiple": False,
+    },
+    "FechaNacimiento": {
+        "label": re.compile(
+            r"(?:\bFecha\s+(?:de\s+)?nac(?:imiento)?|\bF\.?\s*(?:de\s+)?nac(?:imiento|im)?"
+            r"|\bNacid[oa](?:\s+el)?)\b\.?",
+            re.IGNORECASE,
+        ),
+        "value": re.compile(r"(?<!\d)\d{1,2}[/.-]\d{1,2}[/.-](?:\d{4}|\d{2})(?!\d)"),
+        "validate": _valid_date,
+        "unlabeled": False,
+        "multiple": False,
+    },
+    "NumeroColegiado": {
+        "label": re.compile(
+            r"(?:\bN(?:[ºo°]|[uú]m)?\.?\s*(?:de\s+)?Col(?:egiado)?|\bColegiado(?:\s+n[ºo°]?)?)\b\.?",
+            re.IGNORECASE,
+        ),
+        "value": re.compile(r"(?<![\w/.-])\d{5,10}(?![\w/.-])"),
+        "validate": _valid_code,
+        "unlabeled": False,
+        "multiple": False,
+    },
+    "NumeroPeticion": {
+        "label": re.compile(
+            r"(?:\bN(?:[ºo°]|[uú]m)?\.?\s*(?:de\s+)?)?\bPetici[oó]n\b\.?", re.IGNORECASE
+        ),
+        "value": re.compile(r"(?<!\w)[A-Z]\d{8}(?!\w)"),
+        "validate": _valid_code,
+        # Letter + 8 digits also matches sample and report codes in the body
+        "unlabeled": "header",
+        "multiple": True,
+    },
+}
+
+RULE_LABELS = tuple(RULES)
+
+# Lines below a label that still count as its value (0-1000 page scale)
+BELOW_MAX_GAP = 30
+
+# --- Text Layer Geometry ---
+
+
+def _word_spans(line: Dict[str, Any]) -> List[Tuple[int, int, List[int]]]:
+    """(start, end, bbox) of every word in line["text"] (words joined by spaces)."""
+    spans = []
+    position = 0
+    for word in line["words"]:
+        spans.append((position, position + len(word["text"]), word["bbox"]))
+        position += len(word["text"]) + 1
+    return spans
+
+
+def _span_box(line: Dict[str, Any], start: int, end: int) -> List[int]:
+    """Union of the boxes of the words overlapping text[start:end]."""
+    boxes = [
+        bbox
+        for word_start, word_end, bbox in _word_spans(line)
+        if word_start < end and word_end > start
+    ] or [line["bbox"]]
+    return [
+        min(box[0] for box in boxes),
+        min(box[1] for box in boxes),
+        max(box[2] for box in boxes),
+        max(box[3] for box in boxes),
+    ]
+
+
+def _label_spans(text: str) -> List[Tuple[int, int, str]]:
+    """(start, end, field) of every label in a line, in text order."""
+    spans = [
+        (match.start(), match.end(), field)
+        for field, rule in RULES.items()
+        for match in rule["label"].finditer(text)
+    ]
+    return sorted(spans)
+
+
+def _neighbours(lines: List[Dict[str, Any]], line: Dict[str, Any], label_box):
+    """Lines to the right of a label on the same row, then lines just below it."""
+    right, below = [], []
+    for other in lines:
+        if other is line:
+            continue
+        box = other["bbox"]
+        same_row = box[0] < label_box[2] and box[2] > label_box[0]
+        if same_row and box[1] >= label_box[3]:
+            right.append((box[1] - label_box[3], other))
+        elif (
+            0 <= box[0] - label_box[2] <= BELOW_MAX_GAP
+            and box[1] < label_box[3] + 200
+            and box[3] > label_box[1]
+        ):
+            below.append((box[0] - label_box[2], other))
+    right.sort(key=lambda item: item[0])
+    below.sort(key=lambda item: item[0])
+    return [other for _, other in right] + [other for _, other in below]
+
+
+def _first_value(field: str, line: Dict[str, Any], start: int = 0, end: int = None):
+    """First valid value of `field` in line["text"][start:end]: (value, bbox)."""
+    rule = RULES[field]
+    text = line["text"]
+    for match in rule["value"].finditer(text, start, len(text) if end is None else end):
+        value = rule["validate"](match.group())
+        if value:
+            return value, _span_box(line, match.start(), match.end())
+    return None
+
+
+# --- Rule Engine ---
+
+
+def _candidates(text_pages: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    """Every value found per field, as {"value", "page_number", "bounding_box", "labeled"}."""
+    found: Dict[str, List[Dict[str, Any]]] = {field: [] for field in RULES}
+
+    def add(field, page, hit, labeled):
+        value, bbox = hit
+        found[field].append(
+            {
+                "value": value,
+                "page_number": page,
+                "bounding_box": bbox,
+                "labeled": labeled,
+            }
+        )
+
+    for page in text_pages:
+        lines = page["lines"]
+        for line in lines:
+            labels = _label_spans(line["text"])
+            for position, (start, end, field) in enumerate(labels):
+                # The value runs up to the next label on the same line
+                stop = labels[position + 1][0] if position + 1 < len(labels) else None
+                hit = _first_value(field, line, end, stop)
+                if hit is None and stop is None:
+                    label_box = _span_box(line, start, end)
+                    for other in _neighbours(lines, line, label_box):
+                        other_labels = _label_spans(other["text"])
+                        if other_labels and other_labels[0][0] == 0:
+                            continue  # Another field's label line
+                        hit = _first_value(field, other)
+                        if hit:
+                            break
+                if hit:
+                    add(field, page["page"], hit, True)
+            for field, rule in RULES.items():
+                if not rule["unlabeled"]:
+                    continue
+                if rule["unlabeled"] == "header" and line["bbox"][0] >= HEADER_MAX_Y:
+                    continue
+                for match in rule["value"].finditer(line["text"]):
+                    value = rule["validate"](match.group())
+                    if value:
+                        bbox = _span_box(line, match.start(), match.end())
+                        add(field, page["page"], (value, bbox), False)
+    return found
+
+
+def canonical_value(field: str, value: str) -> str:
+    """Comparison key: values that only differ in separators are the same."""
+    if field == "FechaNacimiento":
+        return value
+    value = re.sub(r"[\s.+-]", "", value.upper())
+    if field == "Telefono" and len(value) == 11:
+        return value.removeprefix("34")
+    return value
+
+
+def apply_rules(text_pages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Runs the rules over a text layer. Returns {"elements": [Element dicts],
+    "resolved": [labels], "unresolved": [labels]}. A single-valued field is
+    resolved only when all its labeled matches (or, when there are none and the
+    field allows it, its unlabeled matches) agree on one value.
+    """
+    elements: List[Dict[str, Any]] = []
+    resolved: List[str] = []
+    for field, candidates in _candidates(text_pages).items():
+        labeled = [candidate for candidate in candidates if candidate["labeled"]]
+        candidates = labeled or candidates
+        distinct: Dict[str, Dict[str, Any]] = {}
+        for candidate in candidates:
+            distinct.setdefault(canonical_value(field, candidate["value"]), candidate)
+        if not distinct:
+            continue
+        if len(distinct) > 1 and not RULES[field]["multiple"]:
+            continue  # Ambiguous: leave it to the model
+        resolved.append(field)
+        elements.extend(
+            {
+                "label": field,
+                "value": candidate["value"],
+                "page_number": candidate["page_number"],
+                "bounding_box": candidate["bounding_box"],
+            }
+            for candidate in distinct.values()
+        )
+    return {
+        "elements": elements,
+        "resolved": resolved,
+        "unresolved": [field for field in RULES if field not in resolved],
+    }
+
+
+# --- Prompt Narrowing ---
+
+_SECTION = re.compile(r"^## .*?(?=^#{1,2} |\Z)", re.MULTILINE | re.DOTALL)
+
+
+@functools.lru_cache(maxsize=64)
+def narrow_prompt(prompt: str, resolved: Tuple[str, ...]) -> str:
+    """
+    Removes the "## N. ..." sections of the resolved labels from an
+    extraction prompt and tells the model not to extract them.
+    """
+    if not resolved:
+        return prompt
+
+    def drop(section: re.Match) -> str:
+        text = section.group()
+        if any(f"**Label**: `{label}`" in text for label in resolved):
+            return ""
+        return text
+
+    narrowed = _SECTION.sub(drop, prompt).rstrip()
+    labels = ", ".join(f"`{label}`" for label in resolved)
+    return (
+        f"{narrowed}\n\n# Already Extracted\n"
+        f"The fields {labels} have already been extracted. Do not include "
+        "elements with these labels."
+    )
+
+
+def merge_rule_elements(
+    extracted_dict: Dict[str, Any], rule_result: Dict[str, Any]
+) -> Dict[str, Any]:
+    """The model's result with the rule elements in place of resolved labels."""
+    resolved = set(rule_result["resolved"])
+    elements = [
+        element
+        for element in extracted_dict.get("elements") or []
+        if element.get("label") not in resolved
+    ]
+    return {**extracted_dict, "elements": rule_result["elements"] + elements}
@@ -0,0 +1,136 @@
+"""
+Single-flight deduplication of identical concurrent calls.
+
+When several sessions extract the same PDF with the same model and prompt at
+the same time, only the first call (the leader) runs; the others attach to it
+and receive its result (or its exception) when it finishes. Keys are the
+extraction cache keys (PDF hash, model, effective prompt, workflow variant).
+
+`do` is for threads; `ado` is the asyncio equivalent. Flights are tracked
+separately for the two (an event loop must not block on a thread's flight).
+"""
+
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from telemetry import registry
+
+SINGLE_FLIGHT_CALLS = registry.counter(
+    "extractor_single_flight_calls_total",
+    "Deduplicated calls by role (leader runs, follower attaches to a leader).",
+)
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time; concurrent callers share it."""
+
+    def __init__(self, name: str = "extraction"):
+        self.name = name
+        self._flights: Dict[str, _Flight] = {}
+        self._async_flights: Dict[Tuple[int, str], asyncio.Future] = {}
+        self._lock = threading.Lock()
+        self._stats = {"leaders": 0, "collapsed": 0, "errors": 0}
+
+    def do(self, key: str, func: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Returns (result, shared). `shared` is True when the result came from
+        another caller's in-flight call. Exceptions raised by the leader are
+        raised in every attached caller as well.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self._stats["leaders"] += 1
+            else:
+                flight.followers += 1
+                self._stats["collapsed"] += 1
+        SINGLE_FLIGHT_CALLS.inc(
+            flight=self.name, role="leader" if leader else "follower"
+        )
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        try:
+            flight.result = func()
+        except BaseException as e:
+            flight.error = e
+            with self._lock:
+                self._stats["errors"] += 1
+            raise
+        finally:
+            # Later callers start a new flight (and usually hit the cache)
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result, False
+
+    async def ado(
+        self, key: str, func: Callable[[], Awaitable[Any]]
+    ) -> Tuple[Any, bool]:
+        """Async version of `do`: followers await the leader's coroutine."""
+        loop = asyncio.get_running_loop()
+        flight_key = (id(loop), key)
+        with self._lock:
+            future = self._async_flights.get(flight_key)
+            leader = future is None
+            if leader:
+                future = self._async_flights[flight_key] = loop.create_future()
+                self._stats["leaders"] += 1
+            else:
+                self._stats["collapsed"] += 1
+        SINGLE_FLIGHT_CALLS.inc(
+            flight=self.name, role="leader" if leader else "follower"
+        )
+
+        if not leader:
+            # shield: a cancelled follower must not cancel the shared result
+            return await asyncio.shield(future), True
+
+        try:
+            result = await func()
+        except BaseException as e:
+            with self._lock:
+                self._stats["errors"] += 1
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                future.exception()  # Retrieved: no warning when nobody waits
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            with self._lock:
+                del self._async_flights[flight_key]
+        return result, False
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._flights) + len(self._async_flights)
+
+    def stats(self) -> Dict[str, Any]:
+        """Leader calls, collapsed (attached) calls, failed leaders and in-flight keys."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._flights) + len(self._async_flights)
+        total = stats["leaders"] + stats["collapsed"]
+        stats["collapse_rate"] = stats["collapsed"] / total if total else 0.0
+        return stats
+
+
+extraction_flights = SingleFlight()
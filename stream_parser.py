@@ -0,0 +1,94 @@
+import json
+from typing import Any, Dict, List, Tuple
+
+# Top-level keys of ExtractionResult whose items are emitted as they complete
+LIST_SECTIONS = ("elements", "tests")
+OBJECT_SECTIONS = ("urine_details",)
+
+
+class StreamingExtractionParser:
+    """
+    Incremental parser for a streamed ExtractionResult JSON document.
+
+    Feed it the completion deltas as they arrive; every time an item of
+    `elements`/`tests` (or the `urine_details` object) is closed, `feed`
+    returns it as a (section, item) tuple. Only brace/bracket nesting and
+    string state are tracked, so each character is scanned once and complete
+    items are decoded with json.loads.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self._position = 0
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._pending_key = None
+        self._root_key = None
+        self._item_start = None
+        self._item_depth = 0
+
+    def feed(self, text: str) -> List[Tuple[str, Dict[str, Any]]]:
+        """Consumes a chunk of the response and returns the items it completed."""
+        self.buffer += text
+        completed = []
+        buffer = self.buffer
+        for index in range(self._position, len(buffer)):
+            char = buffer[index]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if len(self._stack) == 1:
+                        # A string directly inside the root object may be a key
+                        self._pending_key = buffer[self._string_start + 1 : index]
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_start = index
+            elif char == ":" and len(self._stack) == 1:
+                self._root_key = self._pending_key
+            elif char in "{[":
+                self._stack.append(char)
+                if char == "{" and self._is_item_start():
+                    self._item_start = index
+                    self._item_depth = len(self._stack)
+            elif char in "}]":
+                if not self._stack:
+                    continue
+                if (
+                    char == "}"
+                    and self._item_start is not None
+                    and len(self._stack) == self._item_depth
+                ):
+                    raw_item = buffer[self._item_start : index + 1]
+                    self._item_start = None
+                    try:
+                        completed.append((self._root_key, json.loads(raw_item)))
+                    except ValueError:
+                        pass  # Malformed item; the final validation reports it
+                self._stack.pop()
+            elif char == "," and len(self._stack) == 1:
+                self._pending_key = None
+
+        self._position = len(buffer)
+        return completed
+
+    def _is_item_start(self) -> bool:
+        # Called after pushing "{": root > "[" > "{" or root > "{"
+        if len(self._stack) == 3 and self._stack[1] == "[":
+            return self._root_key in LIST_SECTIONS
+        if len(self._stack) == 2:
+            return self._root_key in OBJECT_SECTIONS
+        return False
+
+    @property
+    def text(self) -> str:
+        """The full response received so far."""
+        return self.buffer
@@ -0,0 +1,443 @@
+"""
+Structured logging and per-node metrics for the extraction workflows.
+
+- Logging: every module logs through `get_logger(name)`. Records carry their
+  context as `extra` fields and are rendered as `key=value` text or as one
+  JSON object per line (LOG_FORMAT=json), at LOG_LEVEL.
+- Metrics: `instrument_node` wraps a LangGraph node and records its duration,
+  pages, uploaded bytes, time to first token, generation time, token usage
+  and retries in an in-process registry. The registry is exported in the
+  Prometheus text format to METRICS_FILE (rewritten after every node) and/or
+  served on http://METRICS_HOST:METRICS_PORT/metrics.
+"""
+
+import bisect
+import functools
+import inspect
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- Configuration ---
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()  # text | json
+METRICS_FILE = os.getenv("METRICS_FILE") or None
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0")) or None
+
+LOGGER_NAME = "clinical_pdf_extractor"
+
+# Attributes every LogRecord has; anything else came in through `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+    "message",
+    "asctime",
+    "taskName",
+}
+
+
+# --- Logging ---
+
+
+def _record_fields(record: logging.LogRecord) -> Dict[str, Any]:
+    return {
+        key: value
+        for key, value in vars(record).items()
+        if key not in _RECORD_ATTRIBUTES
+    }
+
+
+class TextFormatter(logging.Formatter):
+    """`time LEVEL logger: message key=value ...`"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = _record_fields(record)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with the `extra` fields at the top level."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **_record_fields(record),
+        }
+        if record.exc_info:
+            payload["exception"] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str, ensure_ascii=False)
+
+
+def configure_logging(level: str = None, log_format: str = None):
+    """Installs a single stderr handler on the package logger (idempotent)."""
+    logger = logging.getLogger(LOGGER_NAME)
+    formatter = (
+        JsonFormatter() if (log_format or LOG_FORMAT) == "json" else TextFormatter()
+    )
+    for handler in logger.handlers:
+        if getattr(handler, "_telemetry", False):
+            handler.setFormatter(formatter)
+            break
+    else:
+        handler = logging.StreamHandler(sys.stderr)
+        handler._telemetry = True
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
+    logger.setLevel(level or LOG_LEVEL)
+    logger.propagate = False
+    return logger
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger under the package namespace, e.g. get_logger("workflows")."""
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
+
+
+log = get_logger("telemetry")
+
+
+# --- Metrics Registry ---
+
+# Buckets in seconds, from fast local stages up to long vision generations
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+
+class _Metric:
+    def __init__(self, name: str, help_text: str, metric_type: str):
+        self.name = name
+        self.help = help_text
+        self.type = metric_type
+        self._values: Dict[Tuple[Tuple[str, str], ...], Any] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(labels: Dict[str, Any]) -> Tuple[Tuple[str, str], ...]:
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    @staticmethod
+    def _format_labels(key, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+        pairs = key + extra
+        if not pairs:
+            return ""
+        escaped = (
+            name
+            + '="'
+            + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            + '"'
+            for name, value in pairs
+        )
+        return "{" + ",".join(escaped) + "}"
+
+
+class Counter(_Metric):
+    def __init__(self, name: str, help_text: str):
+        super().__init__(name, help_text, "counter")
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def render(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{self._format_labels(key)} {value}"
+
+
+class Histogram(_Metric):
+    def __init__(self, name: str, help_text: str, buckets=DURATION_BUCKETS):
+        super().__init__(name, help_text, "histogram")
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.setdefault(
+                key, {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            )
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series["counts"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def count(self, **labels) -> int:
+        series = self._values.get(self._key(labels))
+        return series["count"] if series else 0
+
+    def render(self):
+        with self._lock:
+            items = [
+                (key, dict(series, counts=list(series["counts"])))
+                for key, series in self._values.items()
+            ]
+        for key, series in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, series["counts"]):
+                cumulative += bucket_count
+                labels = self._format_labels(key, (("le", str(bound)),))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = self._format_labels(key, (("le", "+Inf"),))
+            yield f"{self.name}_bucket{labels} {series['count']}"
+            yield f"{self.name}_sum{self._format_labels(key)} {series['sum']}"
+            yield f"{self.name}_count{self._format_labels(key)} {series['count']}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, metric_class, name, help_text, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metric_class(name, help_text, **kwargs)
+            return metric
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self._get_or_create(Counter, name, help_text)
+
+    def histogram(self, name: str, help_text: str, **kwargs) -> Histogram:
+        return self._get_or_create(Histogram, name, help_text, **kwargs)
+
+    def render(self) -> str:
+        """The whole registry in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+NODE_DURATION = registry.histogram(
+    "extractor_node_duration_seconds", "Wall time of each workflow node."
+)
+NODE_RUNS = registry.counter(
+    "extractor_node_runs_total", "Workflow node runs by outcome (ok, error)."
+)
+NODE_PAGES = registry.counter(
+    "extractor_node_pages_total", "Pages processed by each workflow node."
+)
+UPLOAD_BYTES = registry.counter(
+    "extractor_upload_bytes_total", "Encoded page bytes sent to the model."
+)
+TIME_TO_FIRST_TOKEN = registry.histogram(
+    "extractor_llm_time_to_first_token_seconds", "Time to the first streamed token."
+)
+GENERATION_SECONDS = registry.histogram(
+    "extractor_llm_generation_seconds", "Time from request to the end of the stream."
+)
+LLM_TOKENS = registry.counter(
+    "extractor_llm_tokens_total",
+    "Tokens reported by the provider (prompt, completion).",
+)
+LLM_RETRIES = registry.counter(
+    "extractor_llm_retries_total", "Retried attempts per model call."
+)
+CACHE_LOOKUPS = registry.counter(
+    "extractor_cache_lookups_total", "Extraction cache lookups by result (hit, miss)."
+)
+
+
+# --- Node Instrumentation ---
+
+
+def _page_count(state: Dict[str, Any], result: Dict[str, Any]) -> int:
+    for key in ("images", "text_pages"):
+        pages = result.get(key) or state.get(key)
+        if pages:
+            return len(pages)
+    return 0
+
+
+def record_stream_stats(model: str, stream_stats: Optional[Dict[str, Any]]):
+    """Records the time to first token, generation time, tokens and retries of a call."""
+    if not stream_stats:
+        return
+    if stream_stats.get("time_to_first_token") is not None:
+        TIME_TO_FIRST_TOKEN.observe(stream_stats["time_to_first_token"], model=model)
+    if stream_stats.get("generation_seconds") is not None:
+        GENERATION_SECONDS.observe(stream_stats["generation_seconds"], model=model)
+    for kind in ("prompt", "completion"):
+        tokens = stream_stats.get(f"{kind}_tokens")
+        if tokens:
+            LLM_TOKENS.inc(tokens, model=model, kind=kind)
+    if stream_stats.get("retries"):
+        LLM_RETRIES.inc(stream_stats["retries"], model=model)
+
+
+def _record_node(name: str, state, result, trace_id: str, duration: float):
+    errors_before = len(state.get("errors") or [])
+    failed = len(result.get("errors") or []) > errors_before
+    pages = _page_count(state, result)
+    upload_bytes = sum(result.get("page_payload_bytes") or [])
+    stream_stats = result.get("stream_stats") or {}
+
+    NODE_DURATION.observe(duration, node=name)
+    NODE_RUNS.inc(node=name, status="error" if failed else "ok")
+    if pages:
+        NODE_PAGES.inc(pages, node=name)
+    if upload_bytes:
+        UPLOAD_BYTES.inc(upload_bytes, node=name)
+    if "cache_hit" in result:
+        CACHE_LOOKUPS.inc(result="hit" if result["cache_hit"] else "miss")
+    record_stream_stats(state.get("model_name") or "unknown", stream_stats)
+
+    log.info(
+        "Node %s finished in %.2fs",
+        name,
+        duration,
+        extra={
+            "event": "node.end",
+            "trace_id": trace_id,
+            "node": name,
+            "status": "error" if failed else "ok",
+            "duration_seconds": round(duration, 4),
+            "pages": pages,
+            "upload_bytes": upload_bytes,
+            **{key: value for key, value in stream_stats.items() if value is not None},
+        },
+    )
+    export_metrics_file()
+
+    if not state.get("trace_id"):
+        result = {**result, "trace_id": trace_id}
+    return result
+
+
+def instrument_node(name: str) -> Callable:
+    """
+    Decorator for LangGraph nodes (plain or async). Assigns a `trace_id` to
+    the run (on its first node), times the node, logs a `node.end` record and
+    updates the metrics. Nodes that add entries to `errors` count as failed
+    runs.
+    """
+
+    def decorator(node: Callable) -> Callable:
+        if inspect.iscoroutinefunction(node):
+
+            @functools.wraps(node)
+            async def async_wrapper(state):
+                trace_id = state.get("trace_id") or uuid.uuid4().hex[:16]
+                start = time.perf_counter()
+                result = await node(state) or {}
+                duration = time.perf_counter() - start
+                return _record_node(name, state, result, trace_id, duration)
+
+            return async_wrapper
+
+        @functools.wraps(node)
+        def wrapper(state):
+            trace_id = state.get("trace_id") or uuid.uuid4().hex[:16]
+            start = time.perf_counter()
+            result = node(state) or {}
+            duration = time.perf_counter() - start
+            return _record_node(name, state, result, trace_id, duration)
+
+        return wrapper
+
+    return decorator
+
+
+# --- Exporters ---
+
+
+def export_metrics_file(path: str = None):
+    """Rewrites the metrics file atomically (no-op when METRICS_FILE is unset)."""
+    path = path or METRICS_FILE
+    if not path:
+        return
+    try:
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(registry.render())
+        os.replace(temp_path, path)
+    except OSError as e:
+        log.warning(
+            "Could not write metrics file: %s", e, extra={"event": "metrics.error"}
+        )
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes are too frequent to log
+
+
+_server: Optional[ThreadingHTTPServer] = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(host: str = None, port: int = None):
+    """
+    Serves /metrics in a daemon thread. Safe to call repeatedly (Streamlit
+    reruns): the server is started once per process. Returns the server, or
+    None when no port is configured.
+    """
+    global _server
+    port = port if port is not None else METRICS_PORT
+    if port is None:
+        return None
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer(
+                    (host or METRICS_HOST, port), _MetricsHandler
+                )
+            except OSError as e:
+                log.warning(
+                    "Could not start metrics server on port %s: %s",
+                    port,
+                    e,
+                    extra={"event": "metrics.error"},
+                )
+                return None
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+            log.info(
+                "Serving metrics on http://%s:%s/metrics",
+                _server.server_address[0],
+                _server.server_address[1],
+                extra={"event": "metrics.start"},
+            )
+        return _server
@@ -0,0 +1,79 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import api
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(api, "API_AUTH_ENABLED", False)
+    extracted = []
+
+    async def ainvoke(state):
+        extracted.append(state)
+        return {**state, "extracted_data": [{"page": "All", "content": {}}]}
+
+    monkeypatch.setattr(api.app_vision_async, "ainvoke", ainvoke)
+    with TestClient(api.app) as client:
+        client.extracted = extracted
+        yield client
+
+
+def test_small_pdf_is_extracted(client):
+    response = client.post(
+        "/extract", files={"file": ("a.pdf", b"%PDF-1.4 small", "application/pdf")}
+    )
+
+    assert response.status_code == 200
+    assert client.extracted[0]["pdf_bytes"] == b"%PDF-1.4 small"
+
+
+def test_not_a_pdf(client):
+    response = client.post("/extract", files={"file": ("a.txt", b"hello")})
+
+    assert response.status_code == 415
+
+
+def test_content_length_over_the_limit_is_rejected_before_reading(client):
+    def body():
+        yield b"x" * 1024
+
+    response = client.post(
+        "/extract",
+        content=body(),
+        headers={
+            "content-type": "multipart/form-data; boundary=x",
+            "content-length": str(api.MAX_BODY_BYTES + 1),
+        },
+    )
+
+    assert response.status_code == 413
+    assert not client.extracted
+
+
+def test_streamed_body_over_the_limit_is_cut_off(client):
+    def body():
+        # No Content-Length: sent with chunked transfer encoding
+        chunk = b"x" * (256 * 1024)
+        for _ in range(api.MAX_BODY_BYTES // len(chunk) + 2):
+            yield chunk
+
+    response = client.post(
+        "/extract",
+        content=body(),
+        headers={"content-type": "multipart/form-data; boundary=x"},
+    )
+
+    assert response.status_code == 413
+    assert not client.extracted
+
+
+def test_file_over_the_limit(client, monkeypatch):
+    monkeypatch.setattr(api, "MAX_UPLOAD_BYTES", 1024)
+
+    response = client.post(
+        "/extract", files={"file": ("a.pdf", b"%PDF" + b"x" * 2048, "application/pdf")}
+    )
+
+    assert response.status_code == 413
+    assert not client.extracted
@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+from PIL import Image
+
+import mock_server
+import workflows
+
+
+@pytest.fixture
+def model_calls(monkeypatch):
+    """Replaces the async model call; records how many calls overlap."""
+    calls = {"count": 0, "in_flight": 0, "max_in_flight": 0}
+
+    async def acall_model(client, model, system_prompt, user_content, *args, **kw):
+        calls["count"] += 1
+        calls["in_flight"] += 1
+        calls["max_in_flight"] = max(calls["max_in_flight"], calls["in_flight"])
+        try:
+            await asyncio.sleep(0.05)
+        finally:
+            calls["in_flight"] -= 1
+        pages = len(user_content) - 1  # Intro text, then one image per page
+        return mock_server.build_mock_result(pages), {
+            "time_to_first_token": 0.01,
+            "time_to_first_field": 0.02,
+            "generation_seconds": 0.05,
+        }
+
+    def no_sync_client(*args, **kwargs):
+        raise AssertionError("the async path used the sync client")
+
+    monkeypatch.setattr(workflows, "_acall_model", acall_model)
+    monkeypatch.setattr(workflows, "get_client", no_sync_client)
+    monkeypatch.setattr(workflows, "get_async_client", lambda: object())
+    return calls
+
+
+def _state(pages, **overrides):
+    return {
+        "pdf_bytes": b"%PDF-async",
+        "images": [Image.new("RGB", (200, 280), "white") for _ in range(pages)],
+        "extracted_data": [],
+        "errors": [],
+        "model_name": "mock-model",
+        "use_cache": False,
+        **overrides,
+    }
+
+
+def test_chunks_run_on_the_event_loop_within_max_concurrency(model_calls):
+    state = _state(7, chunk_size=1, max_concurrency=3)
+
+    update = asyncio.run(workflows.anode_requesty_vision_extraction_chunked(state))
+
+    assert update["errors"] == []
+    assert model_calls["count"] == 7
+    assert model_calls["max_in_flight"] == 3
+    assert len(update["page_payload_bytes"]) == 7
+    assert update["extracted_data"][0]["source"].startswith("Requesty Vision (7 chunks")
+
+
+def test_multi_batch_document_fans_out_from_the_async_node(model_calls, monkeypatch):
+    def plan_batches(state, images, model, system_prompt, max_concurrency, **kw):
+        return {
+            "batches": [[0, 1], [2, 3], [4]],
+            "batch_tokens": [2000, 2000, 1000],
+            "estimated_seconds": 1.0,
+        }
+
+    monkeypatch.setattr(workflows, "_plan_batches", plan_batches)
+    state = _state(5, max_concurrency=2)
+
+    update = asyncio.run(workflows.anode_requesty_vision_extraction(state))
+
+    assert update["errors"] == []
+    assert model_calls["count"] == 3
+    assert model_calls["max_in_flight"] == 2
+    assert update["batch_plan"]["batch_pages"] == [2, 2, 1]
+
+
+def test_failed_chunk_keeps_the_others(model_calls, monkeypatch):
+    succeed = workflows._acall_model
+
+    async def acall_model(client, model, system_prompt, user_content, *args, **kw):
+        if "pages 3 to 3" in user_content[0]["text"]:
+            raise ValueError("invalid JSON")
+        return await succeed(client, model, system_prompt, user_content)
+
+    monkeypatch.setattr(workflows, "_acall_model", acall_model)
+    state = _state(4, chunk_size=1, max_concurrency=4)
+
+    update = asyncio.run(workflows.anode_requesty_vision_extraction_chunked(state))
+
+    assert len(update["errors"]) == 1
+    assert "pages 3-3" in update["errors"][0]
+    assert update["extracted_data"]
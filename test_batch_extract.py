@@ -0,0 +1,87 @@
+import json
+
+import pytest
+
+import batch_extract
+
+
+class FakeApp:
+    def __init__(self):
+        self.invoked = []
+        self.errors = []
+
+    def invoke(self, state):
+        self.invoked.append(state)
+        return {
+            **state,
+            "extracted_data": [{"page": "All", "content": {}}],
+            "errors": self.errors,
+        }
+
+
+@pytest.fixture
+def app(monkeypatch):
+    app = FakeApp()
+    monkeypatch.setitem(batch_extract.WORKFLOWS, "single", app)
+    return app
+
+
+@pytest.fixture
+def pdfs(tmp_path):
+    directory = tmp_path / "pdfs"
+    directory.mkdir()
+    for name, content in [("a", b"%PDF-a"), ("b", b"%PDF-b"), ("copy", b"%PDF-a")]:
+        (directory / f"{name}.pdf").write_bytes(content)
+    return directory
+
+
+def run(pdfs, output, *extra):
+    return batch_extract.main([str(pdfs), "-o", str(output), "--no-cache", *extra])
+
+
+def read(output):
+    return [json.loads(line) for line in output.read_text().splitlines()]
+
+
+def test_duplicates_within_a_run_are_extracted_once(app, pdfs, tmp_path):
+    output = tmp_path / "out.jsonl"
+
+    assert run(pdfs, output) == 0
+
+    records = read(output)
+    assert len(app.invoked) == 2
+    assert sorted(record["sha256"] for record in records) == sorted(
+        {batch_extract.hash_pdf(b"%PDF-a"), batch_extract.hash_pdf(b"%PDF-b")}
+    )
+    assert all(record["prompt_sha256"] for record in records)
+
+
+def test_resume_skips_documents_done_with_the_same_model_and_prompt(
+    app, pdfs, tmp_path
+):
+    output = tmp_path / "out.jsonl"
+    run(pdfs, output)
+    app.invoked.clear()
+
+    run(pdfs, output)
+    assert app.invoked == []
+
+    run(pdfs, output, "-m", "other-model")
+    assert len(app.invoked) == 2
+
+    prompt = tmp_path / "prompt.md"
+    prompt.write_text("Extract everything.")
+    run(pdfs, output, "--prompt-file", str(prompt))
+    assert len(app.invoked) == 4
+    assert app.invoked[-1]["system_prompt"] == "Extract everything."
+
+
+def test_failed_documents_are_retried(app, pdfs, tmp_path):
+    output = tmp_path / "out.jsonl"
+    app.errors = ["boom"]
+    assert run(pdfs, output) == 1
+    app.errors = []
+
+    assert run(pdfs, output) == 0
+
+    assert len(app.invoked) == 4
@@ -0,0 +1,128 @@
+import os
+import time
+
+import pytest
+
+import cache
+import utils
+import workflows
+
+
+@pytest.fixture
+def extraction_cache(tmp_path, monkeypatch):
+    extraction_cache = cache.ExtractionCache(directory=str(tmp_path))
+    monkeypatch.setattr(workflows, "extraction_cache", extraction_cache)
+    monkeypatch.setattr(workflows, "CACHE_ENABLED", True)
+    return extraction_cache
+
+
+def test_cache_key_parts():
+    key = cache.make_cache_key(b"%PDF", "model", "prompt", "vision", {"dpi": 200})
+
+    assert key == cache.make_cache_key(
+        b"%PDF", "model", "prompt", "vision", {"dpi": 200}
+    )
+    assert key != cache.make_cache_key(b"%PDF2", "model", "prompt", "vision")
+    assert key != cache.make_cache_key(
+        b"%PDF", "model", "prompt", "vision", {"dpi": 300}
+    )
+    assert key != cache.make_cache_key(b"%PDF", "model", "prompt", "chunked:4")
+    # Parts are length-prefixed
+    assert cache.make_cache_key(b"%PDF", "ab", "c") != cache.make_cache_key(
+        b"%PDF", "a", "bc"
+    )
+
+
+def test_cache_round_trip_and_stats(tmp_path):
+    extraction_cache = cache.ExtractionCache(directory=str(tmp_path))
+    data = [{"page": "All", "content": {"elements": [], "tests": []}}]
+
+    assert extraction_cache.get("ab" * 32) is None
+    extraction_cache.set("ab" * 32, data)
+
+    assert extraction_cache.get("ab" * 32) == data
+    stats = extraction_cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+
+
+def test_cache_evicts_expired_and_least_recently_used(tmp_path, monkeypatch):
+    extraction_cache = cache.ExtractionCache(
+        directory=str(tmp_path), max_bytes=10**6, max_age_seconds=3600
+    )
+    now = time.time()
+    monkeypatch.setattr(cache.time, "time", lambda: now - 7200)
+    extraction_cache.set("aa" * 32, [{"page": "All", "content": {}}])
+    monkeypatch.setattr(cache.time, "time", lambda: now)
+    for key in ("bb" * 32, "cc" * 32):
+        extraction_cache.set(key, [{"page": "All", "content": {}}])
+    os.utime(extraction_cache._path("bb" * 32), (now - 60, now - 60))
+
+    assert extraction_cache.get("aa" * 32) is None  # Expired
+    extraction_cache.max_bytes = os.path.getsize(extraction_cache._path("cc" * 32))
+    extraction_cache.evict()
+
+    assert extraction_cache.get("bb" * 32) is None  # Least recently used
+    assert extraction_cache.get("cc" * 32) is not None
+
+
+def _vision_state(**overrides):
+    return {
+        "pdf_bytes": b"%PDF-cache-test",
+        "images": [],
+        "extracted_data": [],
+        "errors": [],
+        "model_name": "mock-model",
+        "force_vision": True,
+        "assign_loinc": False,
+        **overrides,
+    }
+
+
+@pytest.mark.parametrize(
+    "app, workflow",
+    [
+        (workflows.app_vision, "vision"),
+        (workflows.app_vision_chunked, "chunked"),
+        (workflows.app_vision_pipelined, "pipeline"),
+    ],
+)
+def test_cache_hit_skips_rendering(monkeypatch, extraction_cache, app, workflow):
+    def fail(**kwargs):
+        raise AssertionError("rendered on a cache hit")
+
+    monkeypatch.setattr(utils, "rasterize_pdf", fail)
+    monkeypatch.setattr(utils, "pdf_page_info", fail)
+    monkeypatch.setattr(utils, "iter_rasterized_pages", fail)
+    state = _vision_state()
+    cache_key = workflows._lookup_vision_cache(state, workflow)["cache_key"]
+    cached = [{"page": "All", "content": {"elements": [], "tests": []}}]
+    extraction_cache.set(cache_key, cached)
+
+    result = app.invoke(state)
+
+    assert result["cache_hit"] is True
+    assert result["extracted_data"] == cached
+    assert result["errors"] == []
+
+
+def _key(workflow="vision", **overrides):
+    return workflows._lookup_vision_cache(_vision_state(**overrides), workflow)[
+        "cache_key"
+    ]
+
+
+def test_page_settings_change_the_key(extraction_cache, monkeypatch):
+    key = _key()
+
+    assert key == _key()
+    assert key != _key(crop_pages=False)
+    assert key != _key(filter_pages=False)
+    assert key != _key("pipeline")
+    monkeypatch.setattr(workflows, "RASTER_DPI", workflows.RASTER_DPI + 50)
+    assert key != _key()
+
+
+def test_use_cache_false_skips_lookup(extraction_cache):
+    update = workflows._lookup_vision_cache(_vision_state(use_cache=False), "vision")
+
+    assert update == {"cache_hit": False, "cache_key": None}
@@ -0,0 +1,76 @@
+import pytest
+from PIL import Image, ImageDraw
+
+import utils
+import workflows
+
+
+def page_with_block(box=(300, 400, 700, 1000), border=0, size=(1000, 1400)):
+    """White page with a black block at pixel (left, top, right, bottom)."""
+    image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+    draw.rectangle(box, fill="black")
+    if border:
+        draw.rectangle((0, 0, border, size[1]), fill="black")  # Scanner edge
+    return image
+
+
+def assert_close(box, expected, tolerance=6):
+    assert all(abs(a - b) <= tolerance for a, b in zip(box, expected)), box
+
+
+def test_content_box_around_the_content():
+    box = utils.content_box(page_with_block(), padding=0)
+
+    # Pixels 400..1000 of 1400 rows, 300..700 of 1000 columns
+    assert_close(box, [286, 300, 714, 700])
+
+
+def test_content_box_padding_is_clamped_to_the_page():
+    image = page_with_block((5, 5, 200, 200))
+    ImageDraw.Draw(image).rectangle((800, 1200, 995, 1395), fill="black")
+
+    assert utils.content_box(image, padding=20) == [0, 0, 1000, 1000]
+
+
+def test_scanner_edge_is_not_content():
+    box = utils.content_box(page_with_block(border=30), padding=0)
+
+    assert_close(box, [286, 300, 714, 700])
+
+
+def test_blank_page_has_no_content_box():
+    assert utils.content_box(Image.new("RGB", (1000, 1400), "white")) is None
+
+
+def test_crop_page():
+    image = page_with_block()
+
+    assert utils.crop_page(image, None) is image
+    assert utils.crop_page(image, [250, 200, 750, 800]).size == (600, 700)
+
+
+@pytest.mark.parametrize("crop", [None, [0, 0, 1000, 1000], [250, 200, 750, 800]])
+def test_uncrop_box_maps_back_to_the_full_page(crop):
+    image = page_with_block()
+    full_box = utils.content_box(image, padding=0)
+    cropped_box = utils.content_box(utils.crop_page(image, crop), padding=0)
+
+    assert_close(utils.uncrop_box(cropped_box, crop), full_box)
+
+
+def test_uncrop_box_leaves_missing_boxes_alone():
+    assert utils.uncrop_box(None, [250, 200, 750, 800]) is None
+    assert utils.uncrop_box([1, 2, 3], [250, 200, 750, 800]) == [1, 2, 3]
+
+
+def test_model_boxes_are_mapped_to_the_original_page():
+    # Pages 2 and 4 were uploaded; page 4 was cropped
+    fix = workflows._page_number_fixer(
+        1, 2, page_map=[2, 4], page_crops=[None, None, None, [100, 0, 600, 500]]
+    )
+    item = {"page_number": 2, "bounding_box": [0, 0, 1000, 1000]}
+
+    fix(item)
+
+    assert item == {"page_number": 4, "bounding_box": [100, 0, 600, 500]}
@@ -0,0 +1,94 @@
+import io
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+import utils
+
+
+def text_page(color="black", size=(1000, 1400)):
+    """A white page with lines of text in one color (no antialiasing)."""
+    image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+    draw.fontmode = "1"
+    for row in range(40):
+        draw.text((60, 60 + row * 32), f"Glucosa {row} mg/dL 70 - 110", fill=color)
+    return image
+
+
+def photo_page(size=(800, 800)):
+    """A page of color noise: neither PNG nor a palette helps."""
+    pixels = np.random.default_rng(0).integers(0, 256, (*size, 3), dtype=np.uint8)
+    return Image.fromarray(pixels, "RGB")
+
+
+def decode(data):
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return image
+
+
+def test_auto_keeps_colored_text_as_lossless_png():
+    page = text_page(color=(200, 0, 0))
+
+    data, mime_type = utils.encode_image(page, image_format="auto")
+
+    assert mime_type == "image/png"
+    decoded = decode(data)
+    assert decoded.mode == "P"
+    assert np.array_equal(np.asarray(decoded.convert("RGB")), np.asarray(page))
+
+
+def test_auto_stores_gray_text_as_grayscale_png():
+    page = text_page()
+
+    data, mime_type = utils.encode_image(page, image_format="auto")
+
+    assert mime_type == "image/png"
+    assert decode(data).mode == "L"
+
+
+def test_auto_uses_jpeg_for_many_colors():
+    data, mime_type = utils.encode_image(photo_page(), image_format="auto")
+
+    assert mime_type == "image/jpeg"
+    assert decode(data).mode == "RGB"
+
+
+def test_grayscale_upload_stays_grayscale():
+    encoded = utils.encode_page_for_upload(
+        text_page(color=(200, 0, 0)), grayscale=True, image_format="auto"
+    )
+
+    assert encoded["mime_type"] == "image/png"
+    data = encoded["data_url"].split(",", 1)[1]
+    assert decode(utils.base64.b64decode(data)).mode == "L"
+
+
+def test_downscaled_png_keeps_color_mode():
+    page = text_page(color=(200, 0, 0))
+    full_size, _ = utils.encode_image(page, image_format="PNG")
+
+    data, mime_type = utils.encode_image(
+        page, image_format="PNG", max_bytes=len(full_size) * 3 // 4
+    )
+
+    decoded = decode(data)
+    assert mime_type == "image/png"
+    assert len(data) <= len(full_size) * 3 // 4
+    assert decoded.width < page.width
+    assert decoded.mode == "P"
+    assert any(red > green for _, (red, green, _) in decoded.convert("RGB").getcolors())
+
+
+def test_downscaled_grayscale_stays_grayscale():
+    page = text_page().convert("L")
+    full_size, _ = utils.encode_image(page, image_format="auto")
+
+    data, _ = utils.encode_image(
+        page, image_format="auto", max_bytes=len(full_size) * 3 // 4
+    )
+
+    decoded = decode(data)
+    assert decoded.mode == "L"
+    assert decoded.width < page.width
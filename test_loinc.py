@@ -0,0 +1,85 @@
+import pytest
+
+import loinc
+import workflows
+
+
+@pytest.fixture(scope="module")
+def index():
+    return loinc.LoincIndex.from_csv()
+
+
+@pytest.mark.parametrize(
+    "description, sample_type, code",
+    [
+        ("Colesterol HDL", "Suero", "2085-9"),
+        ("HDL-Colesterol", "Suero", "2085-9"),
+        ("Creatinina", "Suero", "2160-0"),
+        ("Creatinina", "Orina", "2161-8"),
+        ("Creatinina", "Orina 24h", "2162-6"),
+        ("Creatinina en orina de 24 h", None, "2162-6"),
+        ("T.S.H.", "Suero", "3016-3"),
+    ],
+)
+def test_exact_hits(index, description, sample_type, code):
+    match = index.lookup(description, sample_type)
+
+    assert match["code"] == code
+    assert match["exact"]
+
+
+@pytest.mark.parametrize(
+    "description",
+    ["Colesterol no HDL", "Colesterol VLDL", "Colesterol V LDL", "LDL directo"],
+)
+def test_modifiers_block_fuzzy_matches(index, description):
+    assert index.lookup(description, "Suero") is None
+
+
+def test_fuzzy_hit_is_not_exact(index):
+    match = index.lookup("Triglicerido", "Suero")
+
+    assert match["code"] == "2571-8"
+    assert not match["exact"]
+
+
+def test_system_mismatch_is_not_exact(index):
+    match = index.lookup("Hemoglobina", "Suero")
+
+    assert match["code"] == "718-7"
+    assert not match["exact"]
+
+
+def test_lookup_batch_keeps_sample_qualifiers(index):
+    matches = index.lookup_batch(
+        [("Creatinina", "Orina"), ("Creatinina", "Orina 24h"), ("Creatinina", "Orina")]
+    )
+
+    assert [match["code"] for match in matches] == ["2161-8", "2162-6", "2161-8"]
+
+
+def _state(*tests):
+    return {
+        "extracted_data": [{"page": 1, "content": {"tests": list(tests)}}],
+    }
+
+
+def test_assign_loinc_overwrites_only_exact_hits(monkeypatch, index):
+    monkeypatch.setattr(loinc, "_index", index)
+    state = _state(
+        {"description": "Creatinina", "sample_type": "Orina 24h", "loinc_code": "1"},
+        {"description": "Triglicerido", "sample_type": "Suero", "loinc_code": "2"},
+        {"description": "Colesterol no HDL", "sample_type": "Suero", "loinc_code": "3"},
+        {"description": "Triglicerido", "sample_type": "Suero"},
+    )
+
+    tests = workflows.node_assign_loinc(state)["extracted_data"][0]["content"]["tests"]
+
+    assert tests[0]["loinc_code"] == "2162-6"
+    assert "loinc_suggestion" not in tests[0]
+    assert tests[1]["loinc_code"] == "2"
+    assert tests[1]["loinc_suggestion"]["code"] == "2571-8"
+    assert tests[2]["loinc_code"] == "3"
+    assert "loinc_suggestion" not in tests[2]
+    assert tests[3]["loinc_code"] is None
+    assert tests[3]["loinc_suggestion"]["code"] == "2571-8"
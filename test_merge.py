@@ -0,0 +1,85 @@
+from workflows import merge_extraction_results
+
+
+def element(label, value, page):
+    return {"label": label, "value": value, "page_number": page, "bounding_box": None}
+
+
+def lab_test(description, page, sample_type="Suero"):
+    return {
+        "description": description,
+        "sample_type": sample_type,
+        "page_number": page,
+    }
+
+
+def test_repeated_header_elements_are_kept_once():
+    merged = merge_extraction_results(
+        [
+            {"elements": [element("Paciente", "Ana  García", 1)], "tests": []},
+            {"elements": [element("Paciente", "ana garcía", 2)], "tests": []},
+        ]
+    )
+
+    assert merged["elements"] == [element("Paciente", "Ana  García", 1)]
+
+
+def test_other_elements_are_kept_on_every_page():
+    merged = merge_extraction_results(
+        [
+            {"elements": [element("Observacion", "Ayunas", 1)], "tests": []},
+            {
+                "elements": [
+                    element("Observacion", "Ayunas", 2),
+                    element("Observacion", "Ayunas", 2),
+                ],
+                "tests": [],
+            },
+        ]
+    )
+
+    assert [item["page_number"] for item in merged["elements"]] == [1, 2]
+
+
+def test_distinct_header_values_are_all_kept():
+    merged = merge_extraction_results(
+        [
+            {"elements": [element("NumeroPeticion", "W12345678", 1)], "tests": []},
+            {"elements": [element("NumeroPeticion", "W87654321", 2)], "tests": []},
+        ]
+    )
+
+    assert [item["value"] for item in merged["elements"]] == ["W12345678", "W87654321"]
+
+
+def test_tests_collapse_on_the_same_page_only():
+    merged = merge_extraction_results(
+        [
+            {
+                "elements": [],
+                "tests": [lab_test("Glucosa", 1), lab_test("glucosa ", 1)],
+            },
+            {
+                "elements": [],
+                "tests": [lab_test("Glucosa", 2), lab_test("Glucosa", 2, "Orina")],
+            },
+        ]
+    )
+
+    assert [(item["page_number"], item["sample_type"]) for item in merged["tests"]] == [
+        (1, "Suero"),
+        (2, "Suero"),
+        (2, "Orina"),
+    ]
+
+
+def test_first_urine_details_are_kept():
+    merged = merge_extraction_results(
+        [
+            {"elements": [], "tests": [], "urine_details": None},
+            {"elements": [], "tests": [], "urine_details": {"volume": "1500"}},
+            {"elements": [], "tests": [], "urine_details": {"volume": "900"}},
+        ]
+    )
+
+    assert merged["urine_details"] == {"volume": "1500"}
@@ -0,0 +1,82 @@
+from PIL import Image, ImageDraw
+
+import utils
+
+
+def make_page(values, size=(1240, 1754)):
+    """A white lab report page with a fixed layout and the given result values."""
+    image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+    draw.rectangle([80, 80, size[0] - 80, 200], outline="black", width=3)
+    draw.text((100, 120), "LABORATORIO CLINICO - INFORME DE RESULTADOS", fill="black")
+    for row, value in enumerate(values):
+        top = 260 + row * 60
+        draw.text((100, top), f"Prueba {row + 1}", fill="black")
+        draw.text((700, top), value, fill="black")
+        draw.line([100, top + 40, size[0] - 100, top + 40], fill="gray")
+    return image
+
+
+def test_same_layout_different_values_are_kept():
+    first = make_page(["5.4", "140", "98"])
+    second = make_page(["5.4", "141", "98"])
+
+    result = utils.filter_pages([first, second])
+
+    assert result["page_map"] == [1, 2]
+    assert result["duplicate_pages"] == {}
+
+
+def test_exact_duplicate_is_dropped():
+    page = make_page(["5.4", "140", "98"])
+
+    result = utils.filter_pages([page, make_page(["7.1"]), page.copy()])
+
+    assert result["page_map"] == [1, 2]
+    assert result["duplicate_pages"] == {3: 1}
+
+
+def test_blank_pages_are_dropped():
+    blank = Image.new("RGB", (1240, 1754), "white")
+
+    result = utils.filter_pages([blank, make_page(["5.4"]), blank])
+
+    assert result["page_map"] == [2]
+    assert result["blank_pages"] == [1, 3]
+
+
+def test_all_blank_keeps_first_page():
+    blank = Image.new("RGB", (1240, 1754), "white")
+
+    result = utils.filter_pages([blank, blank])
+
+    assert result["page_map"] == [1]
+    assert result["blank_pages"] == [2]
+
+
+def test_near_duplicates_are_opt_in():
+    first = make_page(["5.4", "140", "98"])
+    second = first.copy()
+    second.putpixel((5, 5), (250, 250, 250))  # Not identical, but visually the same
+
+    default = utils.filter_pages([first, second])
+    near = utils.filter_pages([first, second], near_duplicates=True)
+
+    assert default["page_map"] == [1, 2]
+    assert near["page_map"] == [1]
+    assert near["duplicate_pages"] == {2: 1}
+
+
+def test_page_filter_with_precomputed_digest():
+    page = make_page(["5.4"])
+    page_filter = utils.PageFilter()
+
+    for page_number in (1, 2):
+        page_filter.add(
+            page_number,
+            thumbnail=utils.page_thumbnail(page),
+            digest=utils.page_digest(page),
+        )
+
+    assert page_filter.result()["page_map"] == [1]
+    assert page_filter.result()["duplicate_pages"] == {2: 1}
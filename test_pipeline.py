@@ -0,0 +1,173 @@
+import gc
+import threading
+import time
+import weakref
+
+import pytest
+from PIL import Image, ImageDraw
+
+import mock_server
+import pipeline
+import utils
+import workflows
+
+
+def make_page(text, size=(400, 560)):
+    image = Image.new("RGB", size, "white")
+    if text:
+        draw = ImageDraw.Draw(image)
+        for row in range(12):
+            draw.text((30, 30 + row * 40), f"{text} {row}", fill="black")
+    return image
+
+
+@pytest.fixture
+def rendered(monkeypatch):
+    """Replaces poppler with pages built on demand from a list of texts."""
+    state = {"texts": [], "rendered": 0, "alive": [], "delay": 0.0}
+
+    def iter_rasterized_pages(pdf_bytes=None, dpi=200, **kwargs):
+        for page_number, text in enumerate(state["texts"], start=1):
+            if isinstance(text, Exception):
+                raise text
+            time.sleep(state["delay"])
+            image = make_page(text)
+            state["rendered"] += 1
+            state["alive"].append(weakref.ref(image))
+            yield page_number, image, 0.01
+
+    monkeypatch.setattr(utils, "iter_rasterized_pages", iter_rasterized_pages)
+    return state
+
+
+def encode(image, page_number):
+    return {"page": page_number, "size": image.size, "bytes": 1}
+
+
+def make_pipeline(**options):
+    return pipeline.PagePipeline(
+        b"%PDF", queue_pages=2, prepare_workers=2, encode=encode, **options
+    )
+
+
+def test_pages_come_out_in_order_without_blanks_and_duplicates(rendered):
+    rendered["texts"] = ["a", "", "b", "a", "c"]
+    pages = make_pipeline(filter_settings={}, crop_settings={})
+
+    uploaded = list(pages)
+
+    assert [page["page"] for page in uploaded] == [1, 3, 5]
+    assert [page["position"] for page in uploaded] == [1, 2, 3]
+    assert pages.page_map == [1, 3, 5]
+    assert pages.page_filter["blank_pages"] == [2]
+    assert pages.page_filter["duplicate_pages"] == {4: 1}
+    assert len(pages.page_crops) == 5
+    assert pages.stats["pages"] == 5
+    assert pages.stats["uploaded_pages"] == 3
+
+
+def test_every_page_without_filter(rendered):
+    rendered["texts"] = ["a", "", "a"]
+    pages = make_pipeline()
+
+    assert [page["page"] for page in pages] == [1, 2, 3]
+    assert pages.page_filter is None
+    assert pages.page_crops is None
+
+
+def test_all_blank_document_uploads_first_page(rendered):
+    rendered["texts"] = ["", "", ""]
+    pages = make_pipeline(filter_settings={})
+
+    uploaded = list(pages)
+
+    assert [page["page"] for page in uploaded] == [1]
+    assert uploaded[0]["encoded"]["page"] == 1
+    assert pages.page_map == [1]
+
+
+def test_rendered_pages_are_not_kept(rendered):
+    rendered["texts"] = [f"page {index}" for index in range(30)]
+    pages = make_pipeline(filter_settings={}, crop_settings={})
+
+    for _ in pages:
+        pass
+    gc.collect()
+
+    assert rendered["rendered"] == 30
+    assert not [ref for ref in rendered["alive"] if ref() is not None]
+
+
+def test_render_error_reaches_the_consumer(rendered):
+    rendered["texts"] = ["a", RuntimeError("poppler died")]
+    pages = make_pipeline()
+
+    with pytest.raises(RuntimeError, match="poppler died"):
+        list(pages)
+
+
+def test_early_exit_stops_the_producer(rendered):
+    rendered["texts"] = [f"page {index}" for index in range(1000)]
+    rendered["delay"] = 0.002
+    pages = make_pipeline(filter_settings={})
+
+    start = time.perf_counter()
+    iterator = iter(pages)
+    first = next(iterator)
+    iterator.close()
+
+    assert first["page"] == 1
+    assert time.perf_counter() - start < 10
+    assert rendered["rendered"] < 1000
+    assert not [
+        thread for thread in threading.enumerate() if thread.name == "page-pipeline"
+    ]
+
+
+@pytest.mark.parametrize(
+    "chunk_size, intros",
+    [
+        (10, [None]),
+        (2, [None, "pages 3 to 3 of a longer document"]),
+    ],
+)
+def test_pipelined_prompt_counts_uploaded_pages(
+    rendered, monkeypatch, chunk_size, intros
+):
+    # Pages 2 (blank) and 4 (duplicate of 1) are not uploaded
+    rendered["texts"] = ["a", "", "b", "a", "c"]
+    monkeypatch.setattr(utils, "pdf_page_info", lambda **kwargs: (5, (400, 560)))
+    monkeypatch.setattr(workflows, "get_client", lambda: None)
+    prompts = []
+
+    def call_model(client, model, system_prompt, user_content, *args, **kwargs):
+        prompts.append(user_content[0]["text"])
+        pages = len(user_content) - 1
+        return mock_server.build_mock_result(pages), {
+            "time_to_first_token": 0.01,
+            "time_to_first_field": 0.02,
+            "generation_seconds": 0.1,
+        }
+
+    monkeypatch.setattr(workflows, "_call_model", call_model)
+
+    update = workflows.node_vision_pipeline(
+        {
+            "pdf_bytes": b"%PDF",
+            "errors": [],
+            "model_name": "mock-model",
+            "use_cache": False,
+            "chunk_size": chunk_size,
+            "crop_pages": False,
+        }
+    )
+
+    assert update["errors"] == []
+    assert update["page_map"] == [1, 3, 5]
+    assert len(prompts) == len(intros)
+    for prompt, intro in zip(sorted(prompts), intros):
+        assert "5-page" not in prompt
+        if intro is None:
+            assert "These images are pages" not in prompt
+        else:
+            assert intro in prompt
@@ -0,0 +1,85 @@
+import pytest
+
+import planner
+
+
+@pytest.mark.parametrize(
+    "size, model, tokens",
+    [
+        ((1024, 1024), "openai/gpt-4o", 85 + 170 * 4),
+        ((4096, 1024), "gpt-4o-mini", 85 + 170 * 4),  # 2048x512, not upscaled
+        ((1000, 1500), "anthropic/claude-sonnet-4", 2000),
+        ((3136, 3136), "claude-3-5-sonnet", 3279),  # Fitted to 1568x1568
+        ((300, 300), "vertex/gemini-2.5-pro", 258),
+        ((1000, 1400), "google/gemini-2.5-flash", 258 * 4),
+    ],
+)
+def test_image_token_estimates(size, model, tokens):
+    assert planner.estimate_image_tokens(*size, model) == tokens
+
+
+def test_upload_size_keeps_the_aspect_ratio():
+    assert planner.upload_size(1654, 2339, 1600) == (1131, 1600)
+    assert planner.upload_size(800, 600, 1600) == (800, 600)
+    assert planner.upload_size(800, 600) == (800, 600)
+
+
+def check_batches(plan, pages):
+    # Contiguous, in order, every page exactly once
+    assert [index for batch in plan["batches"] for index in batch] == list(range(pages))
+
+
+def test_small_document_is_one_request():
+    plan = planner.plan_batches([(1000, 1400)] * 5, "gemini", max_concurrency=4)
+
+    assert plan["batches"] == [[0, 1, 2, 3, 4]]
+    assert plan["batch_tokens"] == [5 * 1032]
+
+
+def test_batches_respect_the_token_and_page_limits():
+    plan = planner.plan_batches(
+        [(1000, 1400)] * 30,
+        "gemini",
+        max_concurrency=1,
+        overhead_tokens=500,
+        max_tokens=10_000,
+        max_pages=20,
+    )
+
+    check_batches(plan, 30)
+    assert all(tokens <= 10_000 for tokens in plan["batch_tokens"])
+    assert len(plan["batches"]) == 4  # 9 pages (8,788 tokens) per request at most
+
+
+def test_latency_budget_splits_long_documents():
+    plan = planner.plan_batches(
+        [(500, 700)] * 12,
+        "gemini",
+        seconds_per_page=10,
+        latency_budget=40,
+        max_tokens=10**6,
+    )
+
+    check_batches(plan, 12)
+    assert [len(batch) for batch in plan["batches"]] == [4, 4, 4]
+    assert plan["estimated_seconds"] == 3 * 4 * 10
+
+
+def test_split_documents_use_the_idle_concurrency():
+    plan = planner.plan_batches(
+        [(1000, 1400)] * 12,
+        "gemini",
+        max_concurrency=4,
+        max_tokens=10 * 1032,
+        min_pages_per_batch=2,
+    )
+
+    check_batches(plan, 12)
+    assert [len(batch) for batch in plan["batches"]] == [3, 3, 3, 3]
+    assert plan["estimated_seconds"] == 3 * planner.PLANNER_SECONDS_PER_PAGE
+
+
+def test_balanced_by_tokens():
+    page_tokens = [1000, 1000, 1000, 1000, 4000]
+
+    assert planner._balanced(page_tokens, 2) == [[0, 1, 2, 3], [4]]
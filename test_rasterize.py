@@ -0,0 +1,45 @@
+import time
+
+import pytest
+from PIL import Image
+
+import utils
+
+
+@pytest.fixture
+def poppler(monkeypatch):
+    """Replaces pdfinfo/pdftoppm; page N takes N * 20 ms to render."""
+    calls = []
+
+    def convert_from_path(pdf_path, dpi=200, first_page=1, last_page=None):
+        calls.append((first_page, last_page))
+        images = []
+        for page_number in range(first_page, last_page + 1):
+            time.sleep(page_number * 0.02)
+            images.append(Image.new("L", (10, 10), page_number))
+        return images
+
+    monkeypatch.setattr(utils, "pdfinfo_from_path", lambda path: {"Pages": 4})
+    monkeypatch.setattr(utils, "convert_from_path", convert_from_path)
+    return calls
+
+
+def test_pages_come_out_in_order(poppler):
+    images, page_timings = utils.rasterize_pdf(
+        pdf_bytes=b"%PDF", workers=2, pages_per_window=2
+    )
+
+    assert [image.getpixel((0, 0)) for image in images] == [1, 2, 3, 4]
+    assert [timing["page"] for timing in page_timings] == [1, 2, 3, 4]
+
+
+def test_each_page_is_timed_on_its_own(poppler):
+    _, page_timings = utils.rasterize_pdf(
+        pdf_bytes=b"%PDF", workers=1, pages_per_window=4
+    )
+
+    assert sorted(poppler) == [(1, 1), (2, 2), (3, 3), (4, 4)]
+    seconds = [timing["seconds"] for timing in page_timings]
+    # Not the window time split evenly: later pages took longer
+    assert seconds == sorted(seconds)
+    assert seconds[0] < 0.04 < seconds[3]
@@ -0,0 +1,179 @@
+from datetime import datetime, timezone
+
+import pytest
+
+import records
+
+EXTRACTED_AT = datetime(2024, 5, 1, 12, 30, tzinfo=timezone.utc)
+
+SUGGESTION = {
+    "code": "2085-9",
+    "name": "Colesterol HDL [Masa/volumen] en Suero o Plasma",
+    "score": 0.71,
+}
+
+RESULT = [
+    {
+        "page": "All",
+        "content": {
+            "elements": [
+                {
+                    "label": "Paciente",
+                    "value": "Ana García",
+                    "page_number": 1,
+                    "bounding_box": [10, 20, 30, 40],
+                },
+                {
+                    "label": "NumeroPeticion",
+                    "value": "W12345678",
+                    "page_number": 2,
+                    "bounding_box": None,
+                },
+            ],
+            "tests": [
+                {
+                    "description": "Glucosa",
+                    "sample_type": "Suero",
+                    "loinc_code": "2345-7",
+                    "loinc_suggestion": None,
+                    "page_number": 2,
+                    "bounding_box": [100, 100, 120, 400],
+                },
+                {
+                    "description": "Colesterol HDL",
+                    "sample_type": "Suero",
+                    "loinc_code": None,
+                    "loinc_suggestion": SUGGESTION,
+                    "page_number": 2,
+                    "bounding_box": [130, 100, 150, 400],
+                },
+            ],
+            "urine_details": {
+                "collection_type": "24h",
+                "volume": "1500",
+                "page_number": 2,
+                "bounding_box": [500, 100, 520, 400],
+            },
+        },
+    }
+]
+
+
+def make_records(doc_id="doc-1", extracted_at=EXTRACTED_AT):
+    return records.DocumentRecords.from_result(
+        RESULT, doc_id=doc_id, extracted_at=extracted_at, file="a.pdf", model="m"
+    )
+
+
+def test_rows_round_trip():
+    document = make_records()
+
+    assert len(document) == 5
+    assert document.sections["elements"].rows() == RESULT[0]["content"]["elements"]
+    assert document.sections["tests"].rows() == RESULT[0]["content"]["tests"]
+    assert document.sections["urine_details"].rows() == [
+        RESULT[0]["content"]["urine_details"]
+    ]
+    assert document.metadata == {"file": "a.pdf", "model": "m"}
+
+
+def test_page_rows():
+    document = make_records()
+
+    assert document.pages() == [1, 2]
+    page = document.page_rows(2)
+    assert [row["value"] for row in page["elements"]] == ["W12345678"]
+    assert [row["description"] for row in page["tests"]] == [
+        "Glucosa",
+        "Colesterol HDL",
+    ]
+    assert len(page["urine_details"]) == 1
+    assert document.page_rows(3) == {"elements": [], "tests": [], "urine_details": []}
+
+
+def test_strings_are_shared_across_documents():
+    first, second = make_records("doc-1"), make_records("doc-2")
+
+    assert (
+        first.sections["tests"].strings[1][0] is second.sections["tests"].strings[1][0]
+    )
+
+
+def test_malformed_boxes_are_stored_as_missing():
+    document = records.DocumentRecords.from_result(
+        [
+            {
+                "content": {
+                    "elements": [
+                        {"label": "Sexo", "value": "M", "bounding_box": [1, 2, 3]},
+                        {"label": "Sexo", "value": "M", "bounding_box": ["a"] * 4},
+                    ]
+                }
+            }
+        ],
+        doc_id="doc",
+    )
+
+    assert [row["bounding_box"] for row in document.sections["elements"].rows()] == [
+        None,
+        None,
+    ]
+
+
+def test_parquet_round_trip(tmp_path):
+    dataset = pytest.importorskip("pyarrow.dataset")
+    other_day = datetime(2024, 5, 2, 8, 0, tzinfo=timezone.utc)
+
+    with records.ParquetWriter(str(tmp_path)) as writer:
+        writer.write(make_records("doc-1"))
+        writer.write(make_records("doc-2", other_day))
+
+    assert len(writer.files_written) == 6  # 3 sections x 2 dates
+    assert (tmp_path / "tests" / "date=2024-05-01").is_dir()
+
+    table = dataset.dataset(str(tmp_path / "elements"), partitioning="hive").to_table()
+    rows = sorted(table.to_pylist(), key=lambda row: (row["doc_id"], row["label"]))
+    assert [row["doc_id"] for row in rows] == ["doc-1", "doc-1", "doc-2", "doc-2"]
+    first = rows[1]
+    assert first["label"] == "Paciente"
+    assert first["bounding_box"] == [10, 20, 30, 40]
+    assert first["file"] == "a.pdf"
+    assert first["extracted_at"] == EXTRACTED_AT
+    assert str(first["date"]) == "2024-05-01"
+    assert rows[0]["bounding_box"] is None
+
+    tests = dataset.dataset(str(tmp_path / "tests"), partitioning="hive").to_table()
+    tests = sorted(
+        tests.to_pylist(), key=lambda row: (row["doc_id"], row["description"])
+    )
+    assert [row["loinc_code"] for row in tests] == [None, "2345-7", None, "2345-7"]
+    assert tests[0]["loinc_suggestion"] == SUGGESTION
+    assert tests[1]["loinc_suggestion"] is None
+
+
+def test_loinc_suggestion_survives_in_the_rows():
+    rows = make_records().page_rows(2)["tests"]
+
+    assert rows[1]["loinc_suggestion"] == SUGGESTION
+    assert rows[1]["loinc_code"] is None
+    assert rows[0]["loinc_suggestion"] is None
+
+
+def test_parquet_writer_flushes_every_max_rows(tmp_path):
+    pytest.importorskip("pyarrow")
+    writer = records.ParquetWriter(str(tmp_path), max_rows=6)
+
+    writer.write(make_records("doc-1"))
+    assert writer.files_written == []
+    writer.write(make_records("doc-2"))
+    assert len(writer.files_written) == 3
+
+    writer.close()
+    assert len(writer.files_written) == 3  # Nothing left to write
+
+
+def test_parquet_writer_needs_pyarrow(tmp_path, monkeypatch):
+    monkeypatch.setattr(records, "pa", None)
+
+    with pytest.raises(RuntimeError, match="pyarrow"):
+        records.ParquetWriter(str(tmp_path))
@@ -0,0 +1,430 @@
+import asyncio
+import email.utils
+import threading
+import time
+
+import httpx
+import openai
+import pytest
+
+import mock_server
+import resilience
+import workflows
+
+
+def make_tracker(samples, pages=1):
+    tracker = resilience.LatencyTracker(min_samples=20)
+    for seconds in samples:
+        tracker.observe("model", seconds, pages)
+    return tracker
+
+
+def test_flat_ceiling_until_enough_samples():
+    tracker = make_tracker([2.0] * 19)
+
+    assert tracker.timeout_for("model", 1) == resilience.RESILIENCE_TIMEOUT_MAX
+    assert tracker.timeout_for("other", 50) == resilience.RESILIENCE_TIMEOUT_MAX
+
+
+def test_deadline_is_a_multiple_of_p95_per_page():
+    tracker = make_tracker([10.0] * 100, pages=2)  # 5 s per page
+
+    assert (
+        tracker.timeout_for("model", 4)
+        == 20.0 * resilience.RESILIENCE_TIMEOUT_MULTIPLIER
+    )
+
+
+def test_deadline_never_below_p99():
+    tracker = make_tracker([10.0] * 98 + [200.0] * 2)
+
+    assert tracker.timeout_for("model", 1) == 200.0
+
+
+def test_deadline_is_clamped():
+    assert make_tracker([0.1] * 50).timeout_for("model", 1) == (
+        resilience.RESILIENCE_TIMEOUT_MIN
+    )
+    assert make_tracker([500.0] * 50).timeout_for("model", 1) == (
+        resilience.RESILIENCE_TIMEOUT_MAX
+    )
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(resilience, "backoff_delay", lambda *args: 0)
+
+
+def streamed_attempts(items_per_attempt):
+    """Attempts that stream their items, failing until the last one."""
+    calls = {"count": 0}
+
+    def stream(on_item):
+        calls["count"] += 1
+        items = items_per_attempt[calls["count"] - 1]
+        for value in items:
+            on_item("elements", {"label": "Paciente", "value": value})
+        if calls["count"] < len(items_per_attempt):
+            raise resilience.DeadlineExceeded("timed out")
+        return {"elements": []}, {"generation_seconds": 0.1}
+
+    return stream
+
+
+def test_retry_does_not_publish_the_same_items_again(no_backoff, monkeypatch):
+    stream = streamed_attempts([["a", "b"], ["a"], ["a", "b", "c"]])
+    monkeypatch.setattr(
+        workflows,
+        "_stream_completion",
+        lambda client, model, messages, result_model, on_item, *args: stream(on_item),
+    )
+    published = []
+
+    workflows._call_model(
+        None,
+        "mock-model",
+        "prompt",
+        [],
+        None,
+        on_item=lambda section, item: published.append(item["value"]),
+    )
+
+    assert published == ["a", "b", "c"]
+
+
+def test_async_retry_does_not_publish_the_same_items_again(no_backoff, monkeypatch):
+    stream = streamed_attempts([["a", "b"], ["a", "b", "c"]])
+
+    async def astream_completion(client, model, messages, result_model, on_item, *a):
+        return stream(on_item)
+
+    monkeypatch.setattr(workflows, "_astream_completion", astream_completion)
+    published = []
+
+    asyncio.run(
+        workflows._acall_model(
+            None,
+            "mock-model",
+            "prompt",
+            [],
+            None,
+            on_item=lambda section, item: published.append(item["value"]),
+        )
+    )
+
+    assert published == ["a", "b", "c"]
+
+
+def slow_primary_fast_hedge(primary_seconds=2.0, hedge_seconds=0.1):
+    def attempt(model, timeout, cancel_event):
+        if model == "model":
+            if cancel_event.wait(primary_seconds):
+                raise resilience.Cancelled("lost the hedge")
+            return "primary"
+        time.sleep(hedge_seconds)
+        return "hedge"
+
+    return attempt
+
+
+def test_hedge_latency_is_measured_from_the_hedge_start():
+    tracker = make_tracker([0.2], pages=1)
+    tracker.min_samples = 1
+
+    result, info = resilience.call_with_resilience(
+        slow_primary_fast_hedge(),
+        "model",
+        1,
+        tracker=tracker,
+        hedge=True,
+        fallback_model="hedge-model",
+    )
+
+    assert (result, info["hedged"], info["model"]) == ("hedge", True, "hedge-model")
+    # 0.1 s of its own, not the 0.2 s the primary ran before the hedge started
+    assert tracker._samples["hedge-model"][0] < 0.19
+
+
+# --- Retries ---
+
+
+def status_error(status, headers=None):
+    request = httpx.Request("POST", "http://mock/v1/chat/completions")
+    response = httpx.Response(status, headers=headers or {}, request=request)
+    error_class = {429: openai.RateLimitError, 400: openai.BadRequestError}.get(
+        status, openai.InternalServerError
+    )
+    return error_class(f"HTTP {status}", response=response, body=None)
+
+
+class Attempts:
+    """Stub attempt that raises the given errors in order, then succeeds."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self, model, timeout, cancel_event=None):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "result"
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Records the retry delays instead of sleeping."""
+    delays = []
+    monkeypatch.setattr(resilience.time, "sleep", delays.append)
+    return delays
+
+
+def test_retries_rate_limits_and_server_errors(sleeps):
+    attempt = Attempts(status_error(429, {"Retry-After": "2"}), status_error(503))
+
+    result, info = resilience.call_with_resilience(
+        attempt, "model", 1, tracker=make_tracker([]), max_attempts=3, hedge=False
+    )
+
+    assert (result, attempt.calls, info["retries"]) == ("result", 3, 2)
+    assert sleeps[0] == 2.0  # Retry-After
+    assert 0 <= sleeps[1] <= resilience.RESILIENCE_BACKOFF_BASE * 2
+
+
+@pytest.mark.parametrize(
+    "error", [status_error(400), ValueError("JSON Parsing Error"), status_error(404)]
+)
+def test_non_retryable_errors_are_raised_at_once(sleeps, error):
+    attempt = Attempts(error)
+
+    with pytest.raises(type(error)):
+        resilience.call_with_resilience(
+            attempt, "model", 1, tracker=make_tracker([]), max_attempts=3, hedge=False
+        )
+
+    assert attempt.calls == 1
+    assert sleeps == []
+
+
+def test_last_retryable_error_is_raised(sleeps):
+    attempt = Attempts(*(resilience.DeadlineExceeded(f"try {n}") for n in range(3)))
+
+    with pytest.raises(resilience.DeadlineExceeded, match="try 2"):
+        resilience.call_with_resilience(
+            attempt, "model", 1, tracker=make_tracker([]), max_attempts=3, hedge=False
+        )
+
+    assert attempt.calls == 3
+    assert len(sleeps) == 2
+
+
+def test_retry_after_headers():
+    retry_after = resilience.retry_after_seconds
+
+    assert retry_after(status_error(429, {"retry-after-ms": "1500"})) == 1.5
+    assert retry_after(status_error(429, {"Retry-After": "7"})) == 7.0
+    in_ten_seconds = email.utils.formatdate(time.time() + 10, usegmt=True)
+    assert 8 <= retry_after(status_error(429, {"Retry-After": in_ten_seconds})) <= 10
+    assert retry_after(status_error(429)) is None
+    assert retry_after(ValueError("no response")) is None
+    # A long Retry-After is capped
+    assert resilience.backoff_delay(1, status_error(429, {"Retry-After": "3600"})) == (
+        resilience.RESILIENCE_BACKOFF_MAX
+    )
+
+
+def test_backoff_is_full_jitter_under_an_exponential_ceiling(monkeypatch):
+    monkeypatch.setattr(resilience, "RESILIENCE_BACKOFF_BASE", 1.0)
+    monkeypatch.setattr(resilience, "RESILIENCE_BACKOFF_MAX", 5.0)
+    resilience.random.seed(0)
+
+    for attempt_number, ceiling in [(1, 1.0), (2, 2.0), (3, 4.0), (6, 5.0)]:
+        delays = [
+            resilience._retry_delay("model", attempt_number, 9, status_error(500))
+            for _ in range(200)
+        ]
+        assert all(0 <= delay <= ceiling for delay in delays)
+        assert max(delays) > ceiling * 0.8  # Spread over the whole range
+        assert min(delays) < ceiling * 0.2
+
+
+def test_async_retries(monkeypatch):
+    delays = []
+
+    async def sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(resilience.asyncio, "sleep", sleep)
+    attempts = Attempts(status_error(500), status_error(429, {"Retry-After": "1"}))
+
+    async def attempt(model, timeout):
+        return attempts(model, timeout)
+
+    result, info = asyncio.run(
+        resilience.acall_with_resilience(
+            attempt, "model", 1, tracker=make_tracker([]), max_attempts=3, hedge=False
+        )
+    )
+
+    assert (result, info["retries"]) == ("result", 2)
+    assert delays[1] == 1.0
+
+
+# --- Hedging ---
+
+
+def test_hedged_returns_the_winner_and_cancels_the_loser():
+    cancelled = threading.Event()
+
+    def attempt(model, timeout, cancel_event):
+        if model == "primary":
+            if cancel_event.wait(5):
+                cancelled.set()
+                raise resilience.Cancelled("lost")
+            return "primary"
+        time.sleep(0.05)
+        return "hedge"
+
+    result, hedge_won, _ = resilience._hedged(attempt, "primary", 10, 0.05, "fallback")
+
+    assert (result, hedge_won) == ("hedge", True)
+    assert cancelled.wait(1)
+
+
+def test_hedged_falls_back_to_the_other_attempt_on_failure():
+    def attempt(model, timeout, cancel_event):
+        if model == "primary":
+            time.sleep(0.1)
+            return "primary"
+        raise status_error(500)
+
+    result, hedge_won, _ = resilience._hedged(attempt, "primary", 10, 0.02, "fallback")
+
+    assert (result, hedge_won) == ("primary", False)
+
+
+def test_hedged_without_hedge_after_runs_once():
+    attempt = Attempts()
+
+    assert resilience._hedged(attempt, "model", 10, None, "fallback")[:2] == (
+        "result",
+        False,
+    )
+    assert attempt.calls == 1
+
+
+def test_async_hedge_cancels_the_losing_task():
+    cancelled = []
+
+    async def attempt(model, timeout):
+        if model == "primary":
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(model)
+                raise
+            return "primary"
+        await asyncio.sleep(0.05)
+        return "hedge"
+
+    async def run():
+        result = await resilience._ahedged(attempt, "primary", 10, 0.05, "fallback")
+        await asyncio.sleep(0)  # Let the cancellation reach the loser
+        return result
+
+    result, hedge_won, _ = asyncio.run(run())
+
+    assert (result, hedge_won) == ("hedge", True)
+    assert cancelled == ["primary"]
+
+
+def test_async_deadline_is_enforced():
+    async def attempt(model, timeout):
+        await asyncio.sleep(5)
+
+    with pytest.raises(resilience.DeadlineExceeded):
+        asyncio.run(resilience._ahedged(attempt, "model", 0.05, None, "model"))
+
+
+# --- Against the fault-injecting mock server ---
+
+
+@pytest.fixture
+def fast_deadlines(monkeypatch):
+    monkeypatch.setattr(resilience, "RESILIENCE_BACKOFF_BASE", 0.01)
+    monkeypatch.setattr(resilience.latency_tracker, "timeout_for", lambda *a: 1.0)
+
+
+@pytest.mark.parametrize(
+    "faults, retries",
+    [
+        (["rate_limit"], 1),
+        (["error", "error"], 2),
+        (["stall"], 1),
+        (["rate_limit", "stall"], 2),
+    ],
+)
+def test_call_model_recovers_from_mock_server_faults(fast_deadlines, faults, retries):
+    server, base_url = mock_server.start_mock_server(
+        faults=faults, retry_after=0, stall_seconds=3
+    )
+    try:
+        client = workflows.get_client(base_url, "test-key")
+        extracted, stats = workflows._call_model(
+            client,
+            "mock-model",
+            "prompt",
+            [{"type": "text", "text": "Extract."}],
+            workflows.ExtractionResult,
+        )
+    finally:
+        server.shutdown()
+
+    assert stats["retries"] == retries
+    assert server.request_count == len(faults) + 1
+    assert extracted["elements"]
+
+
+def test_call_model_gives_up_after_max_attempts(fast_deadlines, monkeypatch):
+    monkeypatch.setattr(resilience, "RESILIENCE_MAX_ATTEMPTS", 2)
+    server, base_url = mock_server.start_mock_server(faults=["error"] * 3)
+    try:
+        with pytest.raises(openai.InternalServerError):
+            workflows._call_model(
+                workflows.get_client(base_url, "test-key"),
+                "mock-model",
+                "prompt",
+                [{"type": "text", "text": "Extract."}],
+                workflows.ExtractionResult,
+            )
+    finally:
+        server.shutdown()
+
+    assert server.request_count == 2
+
+
+def test_async_call_model_recovers_from_mock_server_faults(fast_deadlines, monkeypatch):
+    monkeypatch.setattr(resilience, "RESILIENCE_MAX_ATTEMPTS", 4)
+    server, base_url = mock_server.start_mock_server(
+        faults=["rate_limit", "stall", "error"], retry_after=0, stall_seconds=3
+    )
+
+    async def run():
+        try:
+            return await workflows._acall_model(
+                workflows.get_async_client(base_url, "test-key"),
+                "mock-model",
+                "prompt",
+                [{"type": "text", "text": "Extract."}],
+                workflows.ExtractionResult,
+            )
+        finally:
+            await workflows.aclose_clients()
+
+    try:
+        extracted, stats = asyncio.run(run())
+    finally:
+        server.shutdown()
+
+    assert stats["retries"] == 3
+    assert extracted["elements"]
@@ -0,0 +1,99 @@
+import rules
+
+
+def line(text, y, x=50):
+    """A text-layer line with one box per word (10 units per character)."""
+    words = []
+    position = x
+    for word in text.split():
+        words.append(
+            {"text": word, "bbox": [y, position, y + 12, position + 10 * len(word)]}
+        )
+        position += 10 * (len(word) + 1)
+    return {"text": text, "bbox": [y, x, y + 12, position - 10], "words": words}
+
+
+def pages(*lines, page=1):
+    return [{"page": page, "width": 595, "height": 842, "lines": list(lines)}]
+
+
+def values(result, field):
+    return [
+        element["value"] for element in result["elements"] if element["label"] == field
+    ]
+
+
+def test_labeled_values_on_the_same_line():
+    result = rules.apply_rules(
+        pages(line("DNI: 12345678Z Teléfono: +34 612 345 678", 80))
+    )
+
+    assert values(result, "DocumentoIdentidad") == ["12345678Z"]
+    assert values(result, "Telefono") == ["+34 612 345 678"]
+    assert "FechaNacimiento" in result["unresolved"]
+
+
+def test_conflicting_values_are_left_to_the_model():
+    result = rules.apply_rules(
+        pages(line("DNI: 12345678Z", 80), line("DNI: 00000000T", 120))
+    )
+
+    assert "DocumentoIdentidad" in result["unresolved"]
+    assert not values(result, "DocumentoIdentidad")
+
+
+def test_unlabeled_petition_number_only_in_the_header():
+    result = rules.apply_rules(
+        pages(line("W12345678", 60), line("Muestra A87654321 recibida", 600))
+    )
+
+    assert values(result, "NumeroPeticion") == ["W12345678"]
+
+
+def test_petition_codes_in_the_body_are_not_resolved():
+    result = rules.apply_rules(pages(line("Muestra A87654321 recibida", 600)))
+
+    assert "NumeroPeticion" in result["unresolved"]
+
+
+def test_labeled_petition_number_beats_unlabeled_codes():
+    result = rules.apply_rules(
+        pages(line("Nº Petición: W12345678", 60), line("Ref. B11111111", 90))
+    )
+
+    assert values(result, "NumeroPeticion") == ["W12345678"]
+
+
+def test_model_values_kept_for_unresolved_labels():
+    rule_result = rules.apply_rules(pages(line("Muestra A87654321", 600)))
+    extracted = {
+        "elements": [{"label": "NumeroPeticion", "value": "W12345678"}],
+        "tests": [],
+    }
+
+    merged = rules.merge_rule_elements(extracted, rule_result)
+
+    assert merged["elements"] == extracted["elements"]
+
+
+def test_canonical_value_strips_the_country_code_of_phones_only():
+    assert rules.canonical_value("Telefono", "+34 612-345-678") == "612345678"
+    assert rules.canonical_value("Telefono", "612 345 678") == "612345678"
+    assert rules.canonical_value("NumeroColegiado", "3412345") == "3412345"
+    assert rules.canonical_value("NumeroColegiado", "3412345") != rules.canonical_value(
+        "NumeroColegiado", "12345"
+    )
+
+
+def test_narrow_prompt_drops_resolved_sections():
+    prompt = (
+        "# Fields\n"
+        "## 1. DNI\n**Label**: `DocumentoIdentidad`\n\n"
+        "## 2. Phone\n**Label**: `Telefono`\n"
+    )
+
+    narrowed = rules.narrow_prompt(prompt, ("DocumentoIdentidad",))
+
+    assert "## 1. DNI" not in narrowed
+    assert "## 2. Phone" in narrowed
+    assert "`DocumentoIdentidad` have already been extracted" in narrowed
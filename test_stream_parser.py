@@ -0,0 +1,94 @@
+import json
+
+import pytest
+
+from stream_parser import StreamingExtractionParser
+
+RESULT = {
+    "elements": [
+        {
+            "label": "Paciente",
+            "value": 'Ana "La Grande" {García}',
+            "page_number": 1,
+            "bounding_box": [10, 20, 30, 40],
+        },
+        {"label": "Sexo", "value": "M\\F", "page_number": 1, "bounding_box": None},
+    ],
+    "tests": [
+        {
+            "description": "Glucosa [ayunas]",
+            "sample_type": "Suero",
+            "page_number": 2,
+            "extra": {"nested": {"deep": [1, 2]}},
+        }
+    ],
+    "urine_details": {"volume": "1500", "hours": "24"},
+}
+
+
+def feed_all(parser, text, size):
+    items = []
+    for start in range(0, len(text), size):
+        items.extend(parser.feed(text[start : start + size]))
+    return items
+
+
+@pytest.mark.parametrize("size", [1, 7, 10_000])
+def test_items_come_out_whole_whatever_the_chunking(size):
+    text = json.dumps(RESULT, ensure_ascii=False, indent=2)
+    parser = StreamingExtractionParser()
+
+    items = feed_all(parser, text, size)
+
+    assert items == [
+        ("elements", RESULT["elements"][0]),
+        ("elements", RESULT["elements"][1]),
+        ("tests", RESULT["tests"][0]),
+        ("urine_details", RESULT["urine_details"]),
+    ]
+    assert parser.text == text
+
+
+def test_item_is_emitted_as_soon_as_it_closes():
+    parser = StreamingExtractionParser()
+
+    assert parser.feed('{"elements": [{"label": "Sexo", "value": "H"') == []
+    assert parser.feed("}") == [("elements", {"label": "Sexo", "value": "H"})]
+    assert parser.feed(', {"label": "Paciente"') == []
+
+
+def test_other_sections_and_keys_in_strings_are_ignored():
+    parser = StreamingExtractionParser()
+    text = json.dumps(
+        {
+            "notes": [{"text": "not an element"}],
+            "summary": '"elements": [{"a": 1}]',
+            "tests": [],
+        }
+    )
+
+    assert feed_all(parser, text, 5) == []
+
+
+def test_malformed_item_is_skipped():
+    parser = StreamingExtractionParser()
+
+    items = parser.feed(
+        '{"tests": [{"description": Glucosa}, {"description": "Urea"}]}'
+    )
+
+    assert items == [("tests", {"description": "Urea"})]
+
+
+def test_nested_object_does_not_end_the_item():
+    parser = StreamingExtractionParser()
+    urine_details = {
+        "volume": "1500",
+        "collection": {"start": "08:00", "end": {"day": 2, "time": "08:00"}},
+        "hours": "24",
+    }
+    text = json.dumps({"urine_details": urine_details, "elements": []})
+
+    items = feed_all(parser, text, 3)
+
+    assert items == [("urine_details", urine_details)]
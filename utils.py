@@ -1,117 +1,762 @@
 import base64
+import hashlib
 import io
-from typing import List
+import itertools
+import math
+import os
+import subprocess
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from xml.etree import ElementTree
 
-from pdf2image import convert_from_bytes, convert_from_path
-from PIL import Image, ImageDraw
+import numpy as np
+from pdf2image import (
+    convert_from_bytes,
+    convert_from_path,
+    pdfinfo_from_bytes,
+    pdfinfo_from_path,
+)
+from PIL import Image, ImageColor, ImageDraw
 
-# --- Logging Colors ---
-YELLOW = "\033[93m"
-RESET = "\033[0m"
+XHTML_NS = "{http://www.w3.org/1999/xhtml}"
 
 
-def pdf_to_images(pdf_path: str = None, pdf_bytes: bytes = None):
+def pdf_to_images(
+    pdf_path: str = None, pdf_bytes: bytes = None, dpi: int = 200, workers: int = 1
+):
     """
     Convert a PDF to a list of PIL Images.
     Accepts either a file path or bytes.
+    With workers > 1 the pages are rasterized in parallel (see rasterize_pdf).
     """
+    if workers and workers > 1:
+        images, _ = rasterize_pdf(
+            pdf_path=pdf_path, pdf_bytes=pdf_bytes, dpi=dpi, workers=workers
+        )
+        return images
     if pdf_path:
-        return convert_from_path(pdf_path)
+        return convert_from_path(pdf_path, dpi=dpi)
     elif pdf_bytes:
-        return convert_from_bytes(pdf_bytes)
+        return convert_from_bytes(pdf_bytes, dpi=dpi)
     else:
         raise ValueError("Either pdf_path or pdf_bytes must be provided")
 
 
-def encode_image_to_base64(image: Image.Image) -> str:
+def pdf_page_info(
+    pdf_path: str = None, pdf_bytes: bytes = None, dpi: int = 200
+) -> Tuple[int, Tuple[int, int]]:
     """
-    Convert a PIL Image to a base64 string.
+    Page count and rendered size in pixels (at `dpi`) of the first page,
+    read with pdfinfo before any page is rasterized.
+    """
+    if pdf_path:
+        info = pdfinfo_from_path(pdf_path)
+    elif pdf_bytes:
+        info = pdfinfo_from_bytes(pdf_bytes)
+    else:
+        raise ValueError("Either pdf_path or pdf_bytes must be provided")
+    # "595.276 x 841.89 pts (A4)"
+    width_pts, _, height_pts = str(info.get("Page size", "612 x 792")).split()[:3]
+    return info["Pages"], (
+        round(float(width_pts) * dpi / 72),
+        round(float(height_pts) * dpi / 72),
+    )
+
+
+def iter_rasterized_pages(
+    pdf_path: str = None,
+    pdf_bytes: bytes = None,
+    dpi: int = 200,
+    workers: int = None,
+    pages_per_window: int = None,
+    max_pending_windows: int = None,
+) -> Iterator[Tuple[int, Image.Image, float]]:
+    """
+    Rasterize a PDF in parallel windows of pages and yield
+    (page_number, image, seconds) in document order as soon as each window is
+    rendered, so later stages can start on the first pages while poppler
+    renders the rest. Each window renders on its own thread with one poppler
+    process per page, so a thread pool is enough to use several cores and
+    `seconds` is the time that page itself took to render.
+
+    pages_per_window defaults to splitting the document evenly over the
+    workers. At most `max_pending_windows` windows (default: all) are
+    rendered ahead of the consumer.
+    """
+    if not pdf_path and not pdf_bytes:
+        raise ValueError("Either pdf_path or pdf_bytes must be provided")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # Write bytes once so every window reads the same file
+        if not pdf_path:
+            pdf_path = os.path.join(temp_dir, "document.pdf")
+            with open(pdf_path, "wb") as f:
+                f.write(pdf_bytes)
+
+        page_count = pdfinfo_from_path(pdf_path)["Pages"]
+        if page_count == 0:
+            return
+
+        workers = max(1, min(workers or os.cpu_count() or 1, page_count))
+        if not pages_per_window:
+            pages_per_window = math.ceil(page_count / workers)
+
+        windows = iter(
+            [
+                (first, min(first + pages_per_window - 1, page_count))
+                for first in range(1, page_count + 1, pages_per_window)
+            ]
+        )
+
+        def render_window(window):
+            first_page, last_page = window
+            rendered = []
+            for page_number in range(first_page, last_page + 1):
+                start = time.perf_counter()
+                page_images = convert_from_path(
+                    pdf_path, dpi=dpi, first_page=page_number, last_page=page_number
+                )
+                seconds = time.perf_counter() - start
+                rendered.extend((image, seconds) for image in page_images)
+            return rendered
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque(
+                (window, executor.submit(render_window, window))
+                for window in itertools.islice(windows, max_pending_windows)
+            )
+            # Windows are consumed in submission order, so pages stay in order
+            while pending:
+                (first_page, _), future = pending.popleft()
+                window = next(windows, None)
+                if window:
+                    pending.append((window, executor.submit(render_window, window)))
+                for offset, (image, seconds) in enumerate(future.result()):
+                    yield first_page + offset, image, seconds
+
+
+def rasterize_pdf(
+    pdf_path: str = None,
+    pdf_bytes: bytes = None,
+    dpi: int = 200,
+    workers: int = None,
+    pages_per_window: int = None,
+) -> Tuple[List[Image.Image], List[Dict[str, Any]]]:
+    """
+    Rasterize a PDF in parallel by splitting the page range into windows
+    (see iter_rasterized_pages). Pages are returned in document order.
+
+    Returns (images, page_timings), where page_timings holds one
+    {"page", "seconds"} entry per page with that page's own render time.
+    """
+    images = []
+    page_timings = []
+    for page_number, image, seconds in iter_rasterized_pages(
+        pdf_path=pdf_path,
+        pdf_bytes=pdf_bytes,
+        dpi=dpi,
+        workers=workers,
+        pages_per_window=pages_per_window,
+    ):
+        images.append(image)
+        page_timings.append({"page": page_number, "seconds": seconds})
+    return images, page_timings
+
+
+def _normalize_box(node, page_width: float, page_height: float) -> List[int]:
+    """Converts pdftotext xMin/yMin/xMax/yMax attributes to [ymin, xmin, ymax, xmax] on 0-1000."""
+    return [
+        int(float(node.get("yMin")) / page_height * 1000),
+        int(float(node.get("xMin")) / page_width * 1000),
+        int(float(node.get("yMax")) / page_height * 1000),
+        int(float(node.get("xMax")) / page_width * 1000),
+    ]
+
+
+def extract_text_layer(
+    pdf_path: str = None, pdf_bytes: bytes = None
+) -> List[Dict[str, Any]]:
+    """
+    Extract the embedded text layer of a PDF with word positions.
+    Uses poppler's `pdftotext -bbox-layout`, which is installed alongside pdftoppm.
+
+    Returns one dict per page:
+    {"page", "width", "height", "lines": [{"text", "bbox", "words": [{"text", "bbox"}]}]}
+    where every bbox is [ymin, xmin, ymax, xmax] normalized to 0-1000, the same
+    convention the model uses for bounding boxes.
+    """
+    if not pdf_path and not pdf_bytes:
+        raise ValueError("Either pdf_path or pdf_bytes must be provided")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if not pdf_path:
+            pdf_path = os.path.join(temp_dir, "document.pdf")
+            with open(pdf_path, "wb") as f:
+                f.write(pdf_bytes)
+        completed = subprocess.run(
+            ["pdftotext", "-bbox-layout", "-enc", "UTF-8", pdf_path, "-"],
+            capture_output=True,
+            check=True,
+        )
+
+    root = ElementTree.fromstring(completed.stdout)
+    pages = []
+    for page_number, page_node in enumerate(root.iter(f"{XHTML_NS}page"), start=1):
+        page_width = float(page_node.get("width"))
+        page_height = float(page_node.get("height"))
+        lines = []
+        for line_node in page_node.iter(f"{XHTML_NS}line"):
+            words = [
+                {
+                    "text": word_node.text or "",
+                    "bbox": _normalize_box(word_node, page_width, page_height),
+                }
+                for word_node in line_node.iter(f"{XHTML_NS}word")
+            ]
+            if not words:
+                continue
+            lines.append(
+                {
+                    "text": " ".join(word["text"] for word in words),
+                    "bbox": _normalize_box(line_node, page_width, page_height),
+                    "words": words,
+                }
+            )
+        pages.append(
+            {
+                "page": page_number,
+                "width": page_width,
+                "height": page_height,
+                "lines": lines,
+            }
+        )
+    return pages
+
+
+def has_usable_text_layer(
+    text_pages: List[Dict[str, Any]], min_chars_per_page: int = 40
+) -> bool:
+    """
+    True when every page carries enough real text to skip rasterization.
+    A single scanned page (no text) sends the whole document down the vision path.
+    """
+    if not text_pages:
+        return False
+    for page in text_pages:
+        text = "".join(line["text"] for line in page["lines"])
+        alphanumeric = sum(1 for char in text if char.isalnum())
+        # Broken font encodings produce lots of symbols/replacement characters
+        if alphanumeric < min_chars_per_page or alphanumeric < 0.5 * len(text):
+            return False
+    return True
+
+
+def format_text_layer(text_pages: List[Dict[str, Any]]) -> str:
+    """Render text pages as positioned lines for the text-extraction prompt."""
+    sections = []
+    for page in text_pages:
+        lines = [f"## Page {page['page']}"]
+        for line in page["lines"]:
+            ymin, xmin, ymax, xmax = line["bbox"]
+            lines.append(f"[{ymin}, {xmin}, {ymax}, {xmax}] {line['text']}")
+        sections.append("\n".join(lines))
+    return "\n\n".join(sections)
+
+
+def prepare_image_for_upload(
+    image: Image.Image, max_dimension: int = None, grayscale: bool = False
+) -> Image.Image:
+    """
+    Downscale (keeping the aspect ratio) and optionally convert a page to grayscale.
+    Bounding boxes are requested on a normalized 0-1000 scale, so coordinates
+    returned for the prepared image still map onto the original page.
+    """
+    if grayscale and image.mode != "L":
+        image = image.convert("L")
+    elif image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    if max_dimension and max(image.size) > max_dimension:
+        image = image.copy()
+        image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+    return image
+
+
+def _png_image(image: Image.Image) -> Image.Image:
+    """
+    The smallest lossless PNG mode for a page: L when every pixel is gray, a
+    palette when it has at most 256 colors, the image itself otherwise.
     """
+    if image.mode != "RGB":
+        return image
+    colors = image.getcolors(maxcolors=256)
+    if colors is None:
+        return image
+    if all(red == green == blue for _, (red, green, blue) in colors):
+        return image.convert("L")
+    palette = Image.new("P", (1, 1))
+    palette.putpalette([channel for _, color in colors for channel in color])
+    # Every pixel is in the palette, so the nearest color is the exact one
+    return image.quantize(palette=palette, dither=Image.Dither.NONE)
+
+
+def _save_image(image: Image.Image, image_format: str, quality: int) -> bytes:
     buffered = io.BytesIO()
-    image.save(buffered, format="JPEG")
-    return base64.b64encode(buffered.getvalue()).decode("utf-8")
+    if image_format == "PNG":
+        _png_image(image).save(buffered, format="PNG", optimize=True)
+    else:
+        image.save(buffered, format="JPEG", quality=quality, optimize=True)
+    return buffered.getvalue()
+
+
+def _palette_friendly(
+    image: Image.Image, max_levels: int = 64, coverage: float = 0.995
+) -> bool:
+    """
+    Whether PNG is worth trying: an RGB page with at most 256 colors (counted
+    on the full image), or a grayscale page whose `max_levels` most frequent
+    gray levels cover `coverage` of the pixels (text, not a photo or scan).
+    """
+    if image.mode == "RGB":
+        return image.getcolors(maxcolors=256) is not None
+    if image.mode == "L":
+        histogram = sorted(image.histogram(), reverse=True)
+        return sum(histogram[:max_levels]) >= coverage * image.width * image.height
+    return False
+
 
+def encode_image(
+    image: Image.Image,
+    image_format: str = "JPEG",
+    quality: int = 85,
+    max_bytes: int = None,
+    min_quality: int = 40,
+) -> Tuple[bytes, str]:
+    """
+    Encode a PIL Image and return (data, mime_type).
+
+    image_format: "JPEG", "PNG" or "auto" (PNG for palette-friendly pages when
+    it is smaller than the JPEG, JPEG otherwise). The color mode is kept:
+    PNGs are stored as grayscale or palette only when that is lossless.
+    max_bytes: optional byte budget. JPEG quality is lowered in steps down to
+    `min_quality`, then the image is downscaled until it fits.
+    """
+    image_format = image_format.upper()
+    if image_format == "AUTO":
+        data = _save_image(image, "JPEG", quality)
+        chosen = "JPEG"
+        if _palette_friendly(image):
+            png_data = _save_image(image, "PNG", quality)
+            if len(png_data) < len(data):
+                data, chosen = png_data, "PNG"
+        image_format = chosen
+    else:
+        data = _save_image(image, image_format, quality)
+
+    if max_bytes:
+        # Lower JPEG quality first; it is far cheaper than losing resolution
+        while (
+            image_format == "JPEG" and len(data) > max_bytes and quality > min_quality
+        ):
+            quality = max(min_quality, quality - 10)
+            data = _save_image(image, "JPEG", quality)
+
+        # A palette page keeps its palette size: resampling blends in new colors
+        palette = image_format == "PNG" and _png_image(image).mode == "P"
+        colors = len(image.getcolors(maxcolors=256)) if palette else 0
+        while len(data) > max_bytes and min(image.size) > 256:
+            image = image.resize(
+                (int(image.width * 0.8), int(image.height * 0.8)), Image.LANCZOS
+            )
+            scaled = (
+                image.quantize(colors=colors, dither=Image.Dither.NONE)
+                if palette
+                else image
+            )
+            data = _save_image(scaled, image_format, quality)
+
+    return data, f"image/{image_format.lower()}"
+
+
+def encode_image_to_base64(image: Image.Image, **options) -> str:
+    """
+    Convert a PIL Image to a base64 string.
+    Accepts the same options as encode_image (JPEG by default).
+    """
+    data, _ = encode_image(image, **options)
+    return base64.b64encode(data).decode("utf-8")
 
-def get_image_data_url(image: Image.Image) -> str:
+
+def get_image_data_url(image: Image.Image, **options) -> str:
     """
     Get the data URL for an image (e.g., for passing to an LLM).
+    Accepts the same options as encode_image (JPEG by default).
     """
-    base64_str = encode_image_to_base64(image)
-    base64_str = encode_image_to_base64(image)
-    return f"data:image/jpeg;base64,{base64_str}"
+    data, mime_type = encode_image(image, **options)
+    return f"data:{mime_type};base64,{base64.b64encode(data).decode('utf-8')}"
 
 
-def draw_bounding_box(
+def encode_page_for_upload(
     image: Image.Image,
-    bbox: List[int],
-    label: str = None,
-    color: str = "red",
+    max_dimension: int = None,
+    grayscale: bool = False,
+    image_format: str = "auto",
+    quality: int = 85,
+    max_bytes: int = None,
+) -> Dict[str, Any]:
+    """
+    Prepare and encode a page for the vision model in one pass.
+    Returns a dict with the data URL, its mime type and the payload size in
+    bytes, so callers can report bytes per page.
+    """
+    prepared = prepare_image_for_upload(
+        image, max_dimension=max_dimension, grayscale=grayscale
+    )
+    data, mime_type = encode_image(
+        prepared, image_format=image_format, quality=quality, max_bytes=max_bytes
+    )
+    return {
+        "data_url": f"data:{mime_type};base64,{base64.b64encode(data).decode('utf-8')}",
+        "bytes": len(data),
+        "mime_type": mime_type,
+    }
+
+
+def page_thumbnail(image: Image.Image, width: int = 256) -> np.ndarray:
+    """Grayscale thumbnail (uint8 array) used for page statistics and hashing."""
+    height = max(1, round(image.height * width / image.width))
+    return np.asarray(image.convert("L").resize((width, height), Image.BILINEAR))
+
+
+def ink_ratio(thumbnail: np.ndarray, level: int = 200) -> float:
+    """Fraction of pixels darker than `level`: close to 0 for a blank page."""
+    return float(np.count_nonzero(thumbnail < level)) / thumbnail.size
+
+
+def dhash(thumbnail: np.ndarray, hash_size: int = 16) -> int:
+    """
+    Difference hash: compares horizontally adjacent pixels of a
+    (hash_size + 1) x hash_size reduction. Similar pages differ in few bits.
+    """
+    small = np.asarray(
+        Image.fromarray(thumbnail).resize((hash_size + 1, hash_size), Image.BILINEAR),
+        dtype=np.int16,
+    )
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+
+def page_digest(image: Image.Image) -> str:
+    """SHA-256 of the full-resolution pixels: equal only for identical pages."""
+    digest = hashlib.sha256(f"{image.mode}:{image.width}x{image.height}:".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+class PageFilter:
+    """
+    Finds blank pages and duplicates of earlier pages, one page at a time in
+    document order (see filter_pages for the criteria), so pages can be
+    checked as they are rasterized.
+    """
+
+    def __init__(
+        self,
+        blank_ink_ratio: float = 0.001,
+        near_duplicates: bool = False,
+        duplicate_max_distance: int = 8,
+        duplicate_max_diff: float = 0.0005,
+    ):
+        self.blank_ink_ratio = blank_ink_ratio
+        self.near_duplicates = near_duplicates
+        self.duplicate_max_distance = duplicate_max_distance
+        self.duplicate_max_diff = duplicate_max_diff
+        self.page_map: List[int] = []
+        self.blank_pages: List[int] = []
+        self.duplicate_pages: Dict[int, int] = {}
+        self._digests: Dict[str, int] = {}
+        self._kept = []  # (page_number, hash, thumbnail), for near-duplicates
+
+    def is_blank(self, thumbnail: np.ndarray) -> bool:
+        return self.blank_ink_ratio >= 0 and ink_ratio(thumbnail) < self.blank_ink_ratio
+
+    def _near_duplicate(self, page_hash: int, thumbnail: np.ndarray) -> Optional[int]:
+        """The kept page this thumbnail nearly matches, if any."""
+        for kept_page, kept_hash, kept_thumbnail in self._kept:
+            if bin(page_hash ^ kept_hash).count("1") > self.duplicate_max_distance:
+                continue
+            if kept_thumbnail.shape != thumbnail.shape:
+                continue
+            changed = np.count_nonzero(
+                np.abs(kept_thumbnail.astype(np.int16) - thumbnail) > 48
+            )
+            if changed / thumbnail.size <= self.duplicate_max_diff:
+                return kept_page
+        return None
+
+    def add(
+        self,
+        page_number: int,
+        image: Image.Image = None,
+        thumbnail: np.ndarray = None,
+        digest: str = None,
+    ) -> bool:
+        """
+        Checks the next page; True if it is kept. Takes the image, or its
+        page_thumbnail and page_digest when they were computed elsewhere.
+        """
+        if thumbnail is None:
+            thumbnail = page_thumbnail(image)
+        if self.is_blank(thumbnail):
+            self.blank_pages.append(page_number)
+            return False
+        if digest is None and image is not None:
+            digest = page_digest(image)
+        if digest in self._digests:
+            self.duplicate_pages[page_number] = self._digests[digest]
+            return False
+        if self.near_duplicates and self.duplicate_max_distance >= 0:
+            page_hash = dhash(thumbnail)
+            kept_page = self._near_duplicate(page_hash, thumbnail)
+            if kept_page is not None:
+                self.duplicate_pages[page_number] = kept_page
+                return False
+            self._kept.append((page_number, page_hash, thumbnail))
+        if digest is not None:
+            self._digests[digest] = page_number
+        self.page_map.append(page_number)
+        return True
+
+    def result(self) -> Dict[str, Any]:
+        """The filter_pages result for the pages added so far."""
+        page_map = self.page_map
+        blank_pages = self.blank_pages
+        if not page_map and blank_pages:
+            # Nothing but blank pages: still send one so the result is well formed
+            page_map = [blank_pages[0]]
+            blank_pages = blank_pages[1:]
+        return {
+            "page_map": page_map,
+            "blank_pages": blank_pages,
+            "duplicate_pages": self.duplicate_pages,
+        }
+
+
+def filter_pages(
+    images: List[Image.Image],
+    blank_ink_ratio: float = 0.001,
+    near_duplicates: bool = False,
+    duplicate_max_distance: int = 8,
+    duplicate_max_diff: float = 0.0005,
+) -> Dict[str, Any]:
+    """
+    Finds blank pages and duplicates of earlier pages.
+    A page is blank when its ink ratio is below `blank_ink_ratio` (negative:
+    no blank check). A page is a duplicate when its full-resolution pixels are
+    identical to a kept page (page_digest), so pages that share a layout but
+    not their values are always kept.
+    With `near_duplicates`, a page is also dropped when its dHash is within
+    `duplicate_max_distance` bits of a kept page and at most
+    `duplicate_max_diff` of their thumbnail pixels differ noticeably. This
+    can drop pages that differ only in a few digits, so it is opt-in.
+    Returns {"page_map": kept 1-based page numbers, "blank_pages": [...],
+    "duplicate_pages": {page: page it duplicates}}.
+    """
+    page_filter = PageFilter(
+        blank_ink_ratio=blank_ink_ratio,
+        near_duplicates=near_duplicates,
+        duplicate_max_distance=duplicate_max_distance,
+        duplicate_max_diff=duplicate_max_diff,
+    )
+    for page_number, image in enumerate(images, start=1):
+        page_filter.add(page_number, image)
+    return page_filter.result()
+
+
+def content_box(
+    image: Image.Image,
+    padding: int = 20,
+    min_ink: float = 0.01,
+    level: int = 200,
+) -> Optional[List[int]]:
+    """
+    Bounding box of the page content as [ymin, xmin, ymax, xmax] on the
+    0-1000 scale used for bounding boxes, widened by `padding`.
+    Rows and columns count as content when at least `min_ink` of their pixels
+    are ink; nearly solid ones (scanner edges, borders) are ignored.
+    Returns None for a page without content.
+    """
+    ink = page_thumbnail(image) < level
+    height, width = ink.shape
+    # Blank out solid rows/columns first, so an edge does not count as content
+    ink[ink.mean(axis=1) > 0.9, :] = False
+    ink[:, ink.mean(axis=0) > 0.9] = False
+    content_rows = np.flatnonzero(ink.mean(axis=1) >= min_ink)
+    content_columns = np.flatnonzero(ink.mean(axis=0) >= min_ink)
+    if not len(content_rows) or not len(content_columns):
+        return None
+    return [
+        max(0, math.floor(content_rows[0] * 1000 / height) - padding),
+        max(0, math.floor(content_columns[0] * 1000 / width) - padding),
+        min(1000, math.ceil((content_rows[-1] + 1) * 1000 / height) + padding),
+        min(1000, math.ceil((content_columns[-1] + 1) * 1000 / width) + padding),
+    ]
+
+
+def crop_page(image: Image.Image, crop: Optional[List[int]]) -> Image.Image:
+    """Crops a page to a [ymin, xmin, ymax, xmax] 0-1000 box (None: unchanged)."""
+    if not crop:
+        return image
+    ymin, xmin, ymax, xmax = crop
+    return image.crop(
+        (
+            round(xmin * image.width / 1000),
+            round(ymin * image.height / 1000),
+            round(xmax * image.width / 1000),
+            round(ymax * image.height / 1000),
+        )
+    )
+
+
+def uncrop_box(box: List[int], crop: Optional[List[int]]) -> List[int]:
+    """Maps a 0-1000 box on a cropped page back to 0-1000 full-page coordinates."""
+    if not crop or not box or len(box) != 4:
+        return box
+    ymin, xmin, ymax, xmax = crop
+    scale_y = (ymax - ymin) / 1000
+    scale_x = (xmax - xmin) / 1000
+    return [
+        round(ymin + box[0] * scale_y),
+        round(xmin + box[1] * scale_x),
+        round(ymin + box[2] * scale_y),
+        round(xmin + box[3] * scale_x),
+    ]
+
+
+# Color mapping for common names to RGB
+BOX_COLORS = {
+    "red": (255, 0, 0),
+    "green": (0, 128, 0),
+    "blue": (0, 0, 255),
+    "yellow": (255, 255, 0),
+    "purple": (128, 0, 128),
+    "orange": (255, 165, 0),
+    "gold": (255, 215, 0),
+}
+
+
+def _box_rgb(color: str) -> Tuple[int, int, int]:
+    rgb = BOX_COLORS.get((color or "").lower())
+    if rgb:
+        return rgb
+    try:
+        return ImageColor.getrgb(color)[:3]  # Hex codes like "#FFD700"
+    except (ValueError, AttributeError):
+        return BOX_COLORS["red"]  # Default to red
+
+
+def draw_bounding_boxes(
+    image: Image.Image,
+    boxes: List[Dict[str, Any]],
     width: int = 3,
     alpha: int = 60,  # Transparency level (0-255)
+    preview_width: int = None,
 ) -> Image.Image:
     """
-    Draws a bounding box on the image with a transparent fill.
-    Assumes bbox is [ymin, xmin, ymax, xmax].
-    If values are <= 1000, assumes they are normalized 0-1000 and scales them.
+    Draws many bounding boxes with a single overlay and a single composite.
+    Each box is a dict with "bbox" ([ymin, xmin, ymax, xmax]) and optional
+    "label" and "color". Boxes whose values are all <= 1000 are treated as
+    normalized 0-1000 coordinates, others as pixels of the original page.
+    With preview_width, the page is downscaled first (boxes are scaled to
+    match), which makes drawing and displaying large pages much cheaper.
+    The input image is never modified.
     """
-    if not bbox or len(bbox) != 4:
-        return image
+    if preview_width and image.width > preview_width:
+        scale = preview_width / image.width
+        image = image.resize(
+            (preview_width, max(1, int(image.height * scale))), Image.BILINEAR
+        )
+    else:
+        scale = 1.0
 
     # Ensure image is RGBA for transparency
-    if image.mode != "RGBA":
-        image = image.convert("RGBA")
+    image = image.convert("RGBA")
 
-    # Create a transparent overlay
-    overlay = Image.new("RGBA", image.size, (0, 0, 0, 0))
-    draw = ImageDraw.Draw(overlay)
+    boxes = [box for box in boxes if box.get("bbox") and len(box["bbox"]) == 4]
+    if not boxes:
+        return image
 
     width_px, height_px = image.size
-    ymin, xmin, ymax, xmax = bbox
-    print(
-        f"{YELLOW}[DEBUG] Drawing bbox: {bbox} (Image size: {width_px}x{height_px}){RESET}"
-    )
 
-    # Check for normalization (0-1000)
-    if all(val <= 1000 for val in bbox):
-        ymin = int(ymin / 1000 * height_px)
-        xmin = int(xmin / 1000 * width_px)
-        ymax = int(ymax / 1000 * height_px)
-        xmax = int(xmax / 1000 * width_px)
+    # Normalize every box in one vectorized pass
+    coords = np.array([box["bbox"] for box in boxes], dtype=np.float64)
+    normalized = (coords <= 1000).all(axis=1, keepdims=True)
+    page_scale = np.array([height_px, width_px, height_px, width_px]) / 1000
+    coords = np.where(normalized, coords * page_scale, coords * scale).astype(int)
+    ymin, xmin, ymax, xmax = coords.T
 
     # Ensure coordinates are ordered correctly to avoid "x1 must be greater than or equal to x0"
-    left = min(xmin, xmax) - 2
-    right = max(xmin, xmax) + 2
-    top = min(ymin, ymax) - 2
-    bottom = max(ymin, ymax) + 2
-
-    # Color mapping for common names to RGB
-    COLORS = {
-        "red": (255, 0, 0),
-        "green": (0, 128, 0),
-        "blue": (0, 0, 255),
-        "yellow": (255, 255, 0),
-        "purple": (128, 0, 128),
-        "orange": (255, 165, 0),
-        "gold": (255, 215, 0),
-    }
-
-    rgb = COLORS.get(color.lower(), (255, 0, 0))  # Default to red
-    fill_color = rgb + (alpha,)
-    outline_color = rgb + (80,)  # More transparent outline
+    lefts = np.minimum(xmin, xmax) - 2
+    rights = np.maximum(xmin, xmax) + 2
+    tops = np.minimum(ymin, ymax) - 2
+    bottoms = np.maximum(ymin, ymax) + 2
 
-    # Draw filled rectangle on overlay
-    draw.rectangle(
-        [left, top, right, bottom], fill=fill_color, outline=outline_color, width=width
-    )
+    # Draw every filled rectangle on one transparent overlay
+    overlay = Image.new("RGBA", image.size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+    outline_colors = []
+    for box, left, top, right, bottom in zip(
+        boxes, lefts.tolist(), tops.tolist(), rights.tolist(), bottoms.tolist()
+    ):
+        rgb = _box_rgb(box.get("color", "red"))
+        outline_color = rgb + (80,)  # More transparent outline
+        outline_colors.append(outline_color)
+        draw.rectangle(
+            [left, top, right, bottom],
+            fill=rgb + (alpha,),
+            outline=outline_color,
+            width=width,
+        )
 
-    # Composite overlay with original image
+    # Composite overlay with original image, once
     image = Image.alpha_composite(image, overlay)
 
-    # Draw label on top (solid)
-    if label:
-        draw_label = ImageDraw.Draw(image)
-        text_bbox = draw_label.textbbox((left, top), label)
-        draw_label.rectangle(text_bbox, fill=outline_color)
-        draw_label.text((left, top), label, fill="white")
+    # Draw labels on top (solid)
+    draw_label = ImageDraw.Draw(image)
+    for box, left, top, outline_color in zip(
+        boxes, lefts.tolist(), tops.tolist(), outline_colors
+    ):
+        label = box.get("label")
+        if label:
+            text_bbox = draw_label.textbbox((left, top), label)
+            draw_label.rectangle(text_bbox, fill=outline_color)
+            draw_label.text((left, top), label, fill="white")
 
     return image
+
+
+def draw_bounding_box(
+    image: Image.Image,
+    bbox: List[int],
+    label: str = None,
+    color: str = "red",
+    width: int = 3,
+    alpha: int = 60,  # Transparency level (0-255)
+) -> Image.Image:
+    """
+    Draws a bounding box on the image with a transparent fill.
+    Assumes bbox is [ymin, xmin, ymax, xmax].
+    If values are <= 1000, assumes they are normalized 0-1000 and scales them.
+    Prefer draw_bounding_boxes for several boxes on the same page.
+    """
+    if not bbox or len(bbox) != 4:
+        return image
+    return draw_bounding_boxes(
+        image,
+        [{"bbox": bbox, "label": label, "color": color}],
+        width=width,
+        alpha=alpha,
+    )
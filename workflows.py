@@ -1,249 +1,2439 @@
+import asyncio
+import contextvars
+import copy
+import functools
 import json
+import math
 import os
-from typing import Any, Dict, List, Optional, TypedDict
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypedDict
 import base64
 
+import httpx
 import openai
 from dotenv import load_dotenv
 from pydantic import BaseModel, Field
+from langgraph.config import get_stream_writer
 from langgraph.graph import END, StateGraph
 from langgraph.graph import END, StateGraph
 
+import loinc
+import pipeline
+import planner
+import resilience
+import rules
+import telemetry
 import utils
-
+from cache import CACHE_ENABLED, extraction_cache, make_cache_key
+from singleflight import extraction_flights
+from stream_parser import StreamingExtractionParser
+from telemetry import get_logger, instrument_node
 
 load_dotenv()
 
-# --- Logging Colors ---
-BLUE = "\033[94m"
-CYAN = "\033[96m"
-GREEN = "\033[92m"
-YELLOW = "\033[93m"
-RED = "\033[91m"
-RESET = "\033[0m"
+# --- Logging & Metrics ---
+telemetry.configure_logging()
+telemetry.start_metrics_server()
+log = get_logger("workflows")
 
 # --- Configuration ---
 # --- Configuration ---
 REQUESTY_API_KEY = os.getenv("REQUESTY_API_KEY")
 REQUESTY_BASE_URL = os.getenv("REQUESTY_BASE_URL", "https://router.requesty.ai/v1")
+RASTER_DPI = int(os.getenv("RASTER_DPI", "200"))
+RASTER_WORKERS = int(os.getenv("RASTER_WORKERS", "0")) or None  # None = CPU count
+
+# --- Upload Encoding ---
+UPLOAD_ENCODING = {
+    "max_dimension": int(os.getenv("VISION_MAX_DIMENSION", "2048")) or None,
+    "grayscale": os.getenv("VISION_GRAYSCALE", "false").lower() in ("1", "true", "yes"),
+    "image_format": os.getenv("VISION_IMAGE_FORMAT", "auto"),
+    "quality": int(os.getenv("VISION_JPEG_QUALITY", "85")),
+    "max_bytes": int(os.getenv("VISION_MAX_PAGE_BYTES", "0")) or None,
+}
+
+# --- Text Layer Fast Path ---
+TEXT_FAST_PATH_ENABLED = os.getenv("TEXT_FAST_PATH_ENABLED", "true").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+TEXT_MIN_CHARS_PER_PAGE = int(os.getenv("TEXT_MIN_CHARS_PER_PAGE", "40"))
+
+# --- Chunked Extraction ---
+VISION_CHUNK_SIZE = int(os.getenv("VISION_CHUNK_SIZE", "0"))  # 0 = token budget plan
+VISION_MAX_CONCURRENCY = int(os.getenv("VISION_MAX_CONCURRENCY", "4"))
+
+# --- Page Filtering ---
+PAGE_FILTER_ENABLED = os.getenv("PAGE_FILTER_ENABLED", "true").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+PAGE_FILTER = {
+    "blank_ink_ratio": float(os.getenv("PAGE_BLANK_INK_RATIO", "0.001")),
+    # Off by default: near-duplicates can differ in a few result values
+    "near_duplicates": os.getenv("PAGE_NEAR_DUPLICATES", "false").lower()
+    in ("1", "true", "yes"),
+    "duplicate_max_distance": int(os.getenv("PAGE_DUPLICATE_MAX_DISTANCE", "8")),
+    "duplicate_max_diff": float(os.getenv("PAGE_DUPLICATE_MAX_DIFF", "0.0005")),
+}
+FILTERED_PAGES = telemetry.registry.counter(
+    "extractor_filtered_pages_total", "Pages not uploaded, by reason."
+)
+
+# --- Margin Cropping ---
+PAGE_CROP_ENABLED = os.getenv("PAGE_CROP_ENABLED", "true").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+PAGE_CROP = {
+    "padding": int(os.getenv("PAGE_CROP_PADDING", "20")),
+    "min_ink": float(os.getenv("PAGE_CROP_MIN_INK", "0.01")),
+}
+
+# --- Rule-Based Header Fields ---
+RULES_ENABLED = os.getenv("RULES_ENABLED", "true").lower() in ("1", "true", "yes")
+RULE_FIELDS = telemetry.registry.counter(
+    "extractor_rule_fields_total",
+    "Header fields looked up by the text layer rules, by label and result.",
+)
+
+# --- LOINC Lookup ---
+LOINC_ENABLED = os.getenv("LOINC_ENABLED", "true").lower() in ("1", "true", "yes")
+# false: the model no longer generates loinc_code (shorter outputs), the
+# local table is the only source of codes
+LOINC_IN_SCHEMA = os.getenv("LOINC_IN_SCHEMA", "true").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+LOINC_LOOKUPS = telemetry.registry.counter(
+    "extractor_loinc_lookups_total", "Tests looked up in the LOINC table, by result."
+)
+
+
+# --- Client Registry ---
+# One pooled HTTP client per (base URL, API key) is shared by every extraction,
+# so requests reuse warm keep-alive connections instead of paying a new
+# TCP+TLS handshake each time.
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "10"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "600"))
+
+_client_lock = threading.Lock()
+_clients: Dict[tuple, Any] = {}
+# Async clients per event loop: dropped with the loop, closed by aclose_clients
+_async_clients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+_connection_stats: Dict[str, Dict[str, int]] = {}
+
+
+def _pool_settings():
+    limits = httpx.Limits(
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+    return limits, timeout
+
+
+def _stats_for(base_url: str) -> Dict[str, int]:
+    with _client_lock:
+        return _connection_stats.setdefault(
+            base_url, {"requests": 0, "connections_opened": 0}
+        )
+
+
+def _count(stats: Dict[str, int], key: str):
+    with _client_lock:
+        stats[key] += 1
+
+
+def get_client(base_url: Optional[str] = None, api_key: Optional[str] = None):
+    """
+    Returns the shared sync OpenAI-compatible client for `base_url`/`api_key`
+    (defaults: REQUESTY_BASE_URL/REQUESTY_API_KEY), creating it on first use.
+    """
+    base_url = base_url or REQUESTY_BASE_URL
+    api_key = api_key or REQUESTY_API_KEY
+    key = (base_url, api_key)
+    with _client_lock:
+        client = _clients.get(key)
+    if client is not None:
+        return client
+
+    stats = _stats_for(base_url)
+
+    # httpcore reports new TCP connections through the "trace" extension
+    def trace(event_name, info):
+        if event_name == "connection.connect_tcp.complete":
+            _count(stats, "connections_opened")
+
+    def on_request(request):
+        _count(stats, "requests")
+        request.extensions["trace"] = trace
+
+    limits, timeout = _pool_settings()
+    http_client = httpx.Client(
+        limits=limits, timeout=timeout, event_hooks={"request": [on_request]}
+    )
+    client = openai.OpenAI(
+        api_key=api_key,
+        base_url=base_url,
+        http_client=http_client,
+        timeout=timeout,
+        max_retries=0,
+    )
+    with _client_lock:
+        # Another thread may have won the race; keep a single client per key
+        existing = _clients.setdefault(key, client)
+    if existing is not client:
+        http_client.close()
+    return existing
+
+
+def get_async_client(base_url: Optional[str] = None, api_key: Optional[str] = None):
+    """
+    Returns the shared async OpenAI-compatible client for `base_url`/`api_key`.
+    Async connection pools are bound to an event loop, so there is one client
+    per running loop; close them with aclose_clients() before the loop ends.
+    Must be called from a coroutine.
+    """
+    base_url = base_url or REQUESTY_BASE_URL
+    api_key = api_key or REQUESTY_API_KEY
+    loop = asyncio.get_running_loop()
+    key = (base_url, api_key)
+    with _client_lock:
+        client = _async_clients.get(loop, {}).get(key)
+    if client is not None and not client.is_closed():
+        return client
+
+    stats = _stats_for(base_url)
+
+    async def trace(event_name, info):
+        if event_name == "connection.connect_tcp.complete":
+            _count(stats, "connections_opened")
+
+    async def on_request(request):
+        _count(stats, "requests")
+        request.extensions["trace"] = trace
+
+    limits, timeout = _pool_settings()
+    client = openai.AsyncOpenAI(
+        api_key=api_key,
+        base_url=base_url,
+        http_client=httpx.AsyncClient(
+            limits=limits, timeout=timeout, event_hooks={"request": [on_request]}
+        ),
+        timeout=timeout,
+        max_retries=0,
+    )
+    with _client_lock:
+        # Pooled connections keep their loop alive: drop the clients of closed loops
+        for closed_loop in [other for other in _async_clients if other.is_closed()]:
+            del _async_clients[closed_loop]
+        _async_clients.setdefault(loop, {})[key] = client
+    return client
+
+
+async def aclose_clients():
+    """Closes the async clients of the running event loop (e.g. at app shutdown)."""
+    with _client_lock:
+        clients = list(_async_clients.pop(asyncio.get_running_loop(), {}).values())
+    for client in clients:
+        await client.close()
+
+
+def _close_async_client(loop: asyncio.AbstractEventLoop, client):
+    """Closes an async client on its own event loop, if that loop can still run."""
+    if loop.is_closed():
+        return  # Its connections were closed with the loop
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        loop.create_task(client.close())
+    elif loop.is_running():
+        asyncio.run_coroutine_threadsafe(client.close(), loop)
+    else:
+        loop.run_until_complete(client.close())
+
+
+def client_stats() -> Dict[str, Dict[str, int]]:
+    """
+    Per base URL: requests sent, TCP connections opened and requests that
+    reused an already open connection.
+    """
+    with _client_lock:
+        return {
+            base_url: {
+                **stats,
+                "connections_reused": max(
+                    0, stats["requests"] - stats["connections_opened"]
+                ),
+            }
+            for base_url, stats in _connection_stats.items()
+        }
+
+
+def reset_clients():
+    """Closes every pooled client, e.g. after pointing REQUESTY_BASE_URL at a mock server."""
+    with _client_lock:
+        clients = list(_clients.values())
+        async_clients = [
+            (loop, client)
+            for loop, loop_clients in _async_clients.items()
+            for client in loop_clients.values()
+        ]
+        _clients.clear()
+        _async_clients.clear()
+        _connection_stats.clear()
+    for client in clients:
+        client.close()
+    for loop, client in async_clients:
+        _close_async_client(loop, client)
+
+
+# --- Extraction Schema ---
+# Defined once at import time: Pydantic builds each model's validator when the
+# class is created, so nodes must not redefine them per request.
+class Element(BaseModel):
+    label: str = Field(
+        description="The label of the extracted element, e.g., 'NombreApellidos'"
+    )
+    value: str = Field(description="The extracted value")
+    page_number: int = Field(
+        description="The page number where this element was found (1-indexed)."
+    )
+    bounding_box: Optional[List[int]] = Field(
+        description="The bounding box [ymin, xmin, ymax, xmax] or null"
+    )
+
+
+class Test(BaseModel):
+    description: str = Field(description="Name or description of the test")
+    sample_type: Optional[str] = Field(
+        description="Type of sample (e.g., Suero, Orina, Sangre total)"
+    )
+    loinc_code: Optional[str] = Field(
+        description="Proposed LOINC code based on context"
+    )
+    page_number: int = Field(
+        description="The page number where this element was found (1-indexed)."
+    )
+    bounding_box: Optional[List[int]] = Field(
+        description="The bounding box [ymin, xmin, ymax, xmax] or null"
+    )
+
+
+class TestWithoutLoinc(BaseModel):
+    """Test without the model-proposed code (LOINC_IN_SCHEMA=false)."""
+
+    description: str = Field(description="Name or description of the test")
+    sample_type: Optional[str] = Field(
+        description="Type of sample (e.g., Suero, Orina, Sangre total)"
+    )
+    page_number: int = Field(
+        description="The page number where this element was found (1-indexed)."
+    )
+    bounding_box: Optional[List[int]] = Field(
+        description="The bounding box [ymin, xmin, ymax, xmax] or null"
+    )
+
+
+class UrineDetails(BaseModel):
+    collection_type: str = Field(
+        description="Type of urine collection", enum=["24h", "Spot", "Random"]
+    )
+    volume: Optional[str] = Field(
+        description="Total volume if specified (e.g., 1500 ml)"
+    )
+    page_number: int = Field(
+        description="The page number where this element was found (1-indexed)."
+    )
+    bounding_box: Optional[List[int]] = Field(
+        description="The bounding box [ymin, xmin, ymax, xmax] or null"
+    )
+
+
+class ExtractionResult(BaseModel):
+    elements: List[Element] = Field(description="List of general extracted elements")
+    tests: List[Test] = Field(description="List of clinical tests")
+    urine_details: Optional[UrineDetails] = Field(
+        description="Details about urine sample if present"
+    )
+
+
+class ExtractionResultWithoutLoinc(ExtractionResult):
+    tests: List[TestWithoutLoinc] = Field(description="List of clinical tests")
+
+
+EXTRACTION_SCHEMA_JSON = json.dumps(ExtractionResult.model_json_schema(), indent=2)
+EXTRACTION_SCHEMA_JSON_WITHOUT_LOINC = json.dumps(
+    ExtractionResultWithoutLoinc.model_json_schema(), indent=2
+)
+
+# (path -> (mtime_ns, content)), see load_prompt
+_prompt_cache: Dict[str, tuple] = {}
 
 
 # --- State Definition ---
 class AgentState(TypedDict):
     pdf_bytes: bytes
     images: List[Any]  # PIL Images
+    page_timings: List[Dict[str, Any]]  # Per-page rasterization time
+    page_payload_bytes: List[int]  # Encoded upload size per page
     extracted_data: List[Dict[str, Any]]
     errors: List[str]
     model_name: str  # Added model name to state
     system_prompt: Optional[str]  # Added system prompt to state
+    use_cache: Optional[bool]  # Set to False to bypass the extraction cache
+    cache_hit: Optional[bool]
+    cache_key: Optional[str]  # Vision cache key, set by node_lookup_cache
+    stream_stats: Dict[str, Any]  # Time to first token/field and generation time
+    route: Optional[str]  # "text" or "vision", set by node_route_document
+    text_pages: List[Dict[str, Any]]  # Embedded text layer with positions
+    force_vision: Optional[bool]  # Set to True to skip the text fast path
+    chunk_size: Optional[int]  # Pages per request in the chunked workflow
+    max_concurrency: Optional[int]  # Concurrent requests in the chunked workflow
+    trace_id: Optional[str]  # Correlates the log records of one run (telemetry)
+    collapsed: Optional[bool]  # True when attached to an identical in-flight run
+    filter_pages: Optional[bool]  # Set to False to upload blank/duplicate pages
+    page_map: Optional[List[int]]  # Original page number of each uploaded page
+    page_filter: Dict[str, Any]  # Dropped pages and estimated bytes saved
+    crop_pages: Optional[bool]  # Set to False to upload full pages
+    page_crops: Optional[List[Optional[List[int]]]]  # Per page crop, 0-1000 scale
+    batch_plan: Dict[str, Any]  # Pages and estimated tokens per request (planner)
+    assign_loinc: Optional[bool]  # Set to False to keep the model's LOINC codes
+    loinc_in_schema: Optional[bool]  # Set to False to not ask the model for codes
+    apply_rules: Optional[bool]  # Set to False to send every field to the model
+    rule_fields: Optional[Dict[str, Any]]  # Header fields resolved by rules.py
+    pipeline_stats: Dict[str, Any]  # Stage times of the pipelined vision path
 
 
 # --- Node Definitions ---
 
 
 def load_prompt(filename: str) -> str:
-    """Loads a prompt from the prompts directory."""
+    """
+    Loads a prompt from the prompts directory.
+    The content is cached and only re-read when the file's mtime changes, so
+    edits on disk are picked up without reading the file on every request.
+    """
     try:
         current_dir = os.path.dirname(os.path.abspath(__file__))
         prompt_path = os.path.join(current_dir, "prompts", filename)
+        mtime = os.stat(prompt_path).st_mtime_ns
+        cached = _prompt_cache.get(prompt_path)
+        if cached and cached[0] == mtime:
+            return cached[1]
         with open(prompt_path, "r", encoding="utf-8") as f:
-            return f.read().strip()
+            content = f.read().strip()
+        _prompt_cache[prompt_path] = (mtime, content)
+        return content
     except Exception as e:
-        print(f"{RED}[ERROR] Failed to load prompt {filename}: {str(e)}{RESET}")
+        log.error("Failed to load prompt %s: %s", filename, e)
         return ""
 
 
+@functools.lru_cache(maxsize=32)
+def build_system_prompt(
+    base_prompt: str, input_instructions: str, schema_json: str
+) -> str:
+    """
+    Assembles the effective system prompt. Cached per (prompt, schema) pair,
+    so repeated requests with the same prompt reuse the same string.
+    """
+    system_prompt_content = base_prompt
+    if input_instructions:
+        system_prompt_content += f"\n\n{input_instructions}"
+
+    # Append schema instructions
+    # We manually create a schema description since we are not using JsonOutputParser anymore
+    system_prompt_content += f"\n\n# JSON Schema\nRespond strictly with a JSON object satisfying this schema:\n{schema_json}"
+    return system_prompt_content
+
+
+def node_route_document(state: AgentState):
+    """
+    Detects a usable embedded text layer. Digital PDFs take the text path
+    (no rasterization, text instead of images); scanned ones take the vision path.
+    """
+    if not TEXT_FAST_PATH_ENABLED or state.get("force_vision"):
+        return {"route": "vision", "text_pages": []}
+    try:
+        text_pages = utils.extract_text_layer(pdf_bytes=state["pdf_bytes"])
+    except Exception as e:
+        log.warning("Could not read text layer: %s", e)
+        return {"route": "vision", "text_pages": []}
+
+    if utils.has_usable_text_layer(text_pages, TEXT_MIN_CHARS_PER_PAGE):
+        log.info(
+            "Text layer found on all %d pages, using the text path.",
+            len(text_pages),
+            extra={"event": "route", "route": "text", "pages": len(text_pages)},
+        )
+        return {"route": "text", "text_pages": text_pages}
+
+    log.info(
+        "No usable text layer, using the vision path.",
+        extra={"event": "route", "route": "vision"},
+    )
+    return {"route": "vision", "text_pages": []}
+
+
+def select_route(state: AgentState) -> str:
+    """Conditional edge after node_route_document."""
+    return state.get("route") or "vision"
+
+
 def node_convert_pdf_to_images(state: AgentState):
     """Converts PDF bytes to images."""
     try:
-        print(f"{BLUE}[INFO] Converting PDF to images...{RESET}")
-        images = utils.pdf_to_images(pdf_bytes=state["pdf_bytes"])
-        print(f"{GREEN}[SUCCESS] Converted PDF to {len(images)} images.{RESET}")
+        log.info("Converting PDF to images...")
+        images, page_timings = utils.rasterize_pdf(
+            pdf_bytes=state["pdf_bytes"], dpi=RASTER_DPI, workers=RASTER_WORKERS
+        )
+        total_seconds = sum(timing["seconds"] for timing in page_timings)
+        log.info(
+            "Converted PDF to %d images (%.2fs of page rendering at %d DPI).",
+            len(images),
+            total_seconds,
+            RASTER_DPI,
+            extra={
+                "event": "pdf.converted",
+                "pages": len(images),
+                "render_seconds": round(total_seconds, 4),
+                "dpi": RASTER_DPI,
+            },
+        )
+        for timing in page_timings:
+            log.debug(
+                "Page %d rendered in %.2fs",
+                timing["page"],
+                timing["seconds"],
+                extra={"event": "pdf.page", **timing},
+            )
         return {
             "images": images,
+            "page_timings": page_timings,
             "current_page_index": 0,
             "extracted_data": [],
             "errors": [],
         }
     except Exception as e:
-        print(f"{RED}[ERROR] PDF Conversion Error: {str(e)}{RESET}")
+        log.error("PDF Conversion Error: %s", e)
         return {"errors": [f"PDF Conversion Error: {str(e)}"]}
 
 
-def node_requesty_vision_extraction(state: AgentState):
+def node_filter_pages(state: AgentState):
     """
-    Uses Requesty (OpenAI compatible) with a Vision model to extract data directly from images (all at once).
+    Drops blank pages and duplicates of earlier pages from the upload.
+    state["images"] keeps every page; `page_map` lists the original page
+    number of each page that is sent, so results can be mapped back.
     """
+    images = state.get("images") or []
+    if not images or not state.get("filter_pages", PAGE_FILTER_ENABLED):
+        return {"page_map": None}
     try:
-        if not state["images"]:
-            print(f"{YELLOW}[WARN] No images found in state.{RESET}")
-            return {}
+        filtered = utils.filter_pages(images, **PAGE_FILTER)
+    except Exception as e:
+        log.warning("Page filtering failed, uploading every page: %s", e)
+        return {"page_map": None}
+
+    page_filter = _record_page_filter(filtered, len(images))
+    return {
+        "page_map": filtered["page_map"] if page_filter["pages_dropped"] else None,
+        "page_filter": page_filter,
+    }
+
+
+def _record_page_filter(filtered: Dict[str, Any], pages: int) -> Dict[str, Any]:
+    """Counts and logs a utils.filter_pages result; returns the page_filter update."""
+    FILTERED_PAGES.inc(len(filtered["blank_pages"]), reason="blank")
+    FILTERED_PAGES.inc(len(filtered["duplicate_pages"]), reason="duplicate")
+    log.info(
+        "Page filter kept %d of %d pages (%d blank, %d duplicate).",
+        len(filtered["page_map"]),
+        pages,
+        len(filtered["blank_pages"]),
+        len(filtered["duplicate_pages"]),
+        extra={
+            "event": "page_filter",
+            "pages": pages,
+            "kept": len(filtered["page_map"]),
+            "blank_pages": filtered["blank_pages"],
+            "duplicate_pages": filtered["duplicate_pages"],
+        },
+    )
+    return {
+        "pages_total": pages,
+        "pages_dropped": pages - len(filtered["page_map"]),
+        "blank_pages": filtered["blank_pages"],
+        "duplicate_pages": filtered["duplicate_pages"],
+    }
+
+
+def node_crop_pages(state: AgentState):
+    """
+    Finds the content box of every page so only it is uploaded. The crops are
+    recorded in `page_crops` (0-1000 page coordinates, None for an uncropped
+    page) and result boxes are mapped back to the full page.
+    """
+    images = state.get("images") or []
+    if not images or not state.get("crop_pages", PAGE_CROP_ENABLED):
+        return {"page_crops": None}
+    page_map = state.get("page_map") or range(1, len(images) + 1)
+    page_crops = [None] * len(images)
+    try:
+        for page in page_map:
+            page_crops[page - 1] = utils.content_box(images[page - 1], **PAGE_CROP)
+    except Exception as e:
+        log.warning("Margin cropping failed, uploading full pages: %s", e)
+        return {"page_crops": None}
+
+    kept_area = [
+        (crop[2] - crop[0]) * (crop[3] - crop[1]) / 1e6 if crop else 1.0
+        for crop in (page_crops[page - 1] for page in page_map)
+    ]
+    log.info(
+        "Cropped margins: uploading %.0f%% of the page area.",
+        100 * sum(kept_area) / len(kept_area),
+        extra={
+            "event": "page_crop",
+            "pages": len(kept_area),
+            "area_ratio": round(sum(kept_area) / len(kept_area), 3),
+        },
+    )
+    return {"page_crops": page_crops}
+
+
+def _upload_pages(state: AgentState):
+    """
+    Returns (images to upload, page_map): the pages kept by node_filter_pages,
+    cropped by node_crop_pages. page_map is None when nothing was dropped.
+    """
+    page_map = state.get("page_map")
+    pages = page_map or range(1, len(state["images"]) + 1)
+    page_crops = state.get("page_crops") or [None] * len(state["images"])
+    images = [
+        utils.crop_page(state["images"][page - 1], page_crops[page - 1])
+        for page in pages
+    ]
+    return images, page_map
+
+
+def _page_variant(state: AgentState, variant: str = "") -> str:
+    """Cache/single-flight variant, extended with the uploaded pages when filtered."""
+    page_map = state.get("page_map")
+    if not page_map:
+        return variant
+    return f"{variant}|pages:{','.join(map(str, page_map))}"
+
+
+def _filter_savings(state: AgentState, page_payload_bytes: List[int]) -> Dict[str, Any]:
+    """page_filter update with the upload bytes saved, estimated from the sent pages."""
+    page_filter = state.get("page_filter")
+    if not page_filter or not page_filter["pages_dropped"] or not page_payload_bytes:
+        return {}
+    bytes_saved = round(
+        sum(page_payload_bytes) / len(page_payload_bytes) * page_filter["pages_dropped"]
+    )
+    log.info(
+        "Page filter saved %d pages, about %.1f KB of upload.",
+        page_filter["pages_dropped"],
+        bytes_saved / 1024,
+        extra={
+            "event": "page_filter.saved",
+            "pages_dropped": page_filter["pages_dropped"],
+            "bytes_saved": bytes_saved,
+        },
+    )
+    return {"page_filter": {**page_filter, "bytes_saved": bytes_saved}}
+
+
+def _plan_batches(
+    state: AgentState,
+    images: List[Any],
+    model: str,
+    system_prompt: str,
+    max_concurrency: int,
+    log_plan: bool = True,
+) -> Dict[str, Any]:
+    """
+    Plans request batches for the upload (see planner.py): image tokens from
+    the upload size of every page, the prompt as overhead (~4 characters per
+    token) and the observed p95 seconds per page of the model.
+    """
+    sizes = [
+        planner.upload_size(*image.size, UPLOAD_ENCODING["max_dimension"])
+        for image in images
+    ]
+    plan = planner.plan_batches(
+        sizes,
+        model,
+        max_concurrency=max_concurrency,
+        overhead_tokens=len(system_prompt) // 4,
+        seconds_per_page=resilience.latency_tracker.percentile(model, 1, 95),
+    )
+    if log_plan:
+        planner.log_plan(plan, model, state.get("page_map"))
+    return plan
+
+
+def _get_extraction_spec(
+    state: AgentState,
+    input_instructions: str = "",
+    resolved_labels: Tuple[str, ...] = (),
+):
+    """
+    Returns (ExtractionResult, system_prompt) for a node: the module-level
+    result model (without loinc_code if LOINC_IN_SCHEMA is off) and the
+    effective system prompt (instructions + input format notes + JSON schema),
+    assembled once per distinct prompt. The instructions for
+    `resolved_labels` (fields already found by rules.py) are left out.
+    """
+    # Use system prompt from state or load default
+    base_prompt = state.get("system_prompt") or load_prompt("vision_extraction.md")
+    base_prompt = rules.narrow_prompt(base_prompt, resolved_labels)
+    if state.get("loinc_in_schema", LOINC_IN_SCHEMA):
+        return ExtractionResult, build_system_prompt(
+            base_prompt, input_instructions, EXTRACTION_SCHEMA_JSON
+        )
+    # The codes come from the local table (node_assign_loinc): drop the
+    # field and the prompt lines asking for it
+    base_prompt = "\n".join(
+        line for line in base_prompt.splitlines() if "loinc_code" not in line
+    )
+    return ExtractionResultWithoutLoinc, build_system_prompt(
+        base_prompt, input_instructions, EXTRACTION_SCHEMA_JSON_WITHOUT_LOINC
+    )
+
 
-        print(
-            f"{CYAN}[STEP] Extracting data from {len(state['images'])} images using Vision...{RESET}"
+def _lookup_cache(
+    state: AgentState,
+    model: str,
+    system_prompt: str,
+    variant="",
+    settings: Optional[Dict[str, Any]] = None,
+):
+    """Returns (cache_key, cached_data). Both are None when caching is off."""
+    if not (CACHE_ENABLED and state.get("use_cache", True)):
+        return None, None
+    cache_key = make_cache_key(
+        state["pdf_bytes"], model, system_prompt, variant, settings
+    )
+    cached_data = extraction_cache.get(cache_key)
+    if cached_data is not None:
+        log.info(
+            "Cache hit for %s, skipping model call.",
+            cache_key[:12],
+            extra={"event": "cache.hit", "cache_key": cache_key[:12]},
         )
+    else:
+        log.info(
+            "Cache miss for %s.",
+            cache_key[:12],
+            extra={"event": "cache.miss", "cache_key": cache_key[:12]},
+        )
+    return cache_key, cached_data
 
-        # Use model from state or default
-        model = state.get("model_name", "gpt-4o")
 
-        # Initialize OpenAI client directly
-        client = openai.OpenAI(
-            api_key=REQUESTY_API_KEY,
-            base_url=REQUESTY_BASE_URL,
-            timeout=600.0,
-            max_retries=0,
+def _vision_cache_variant(state: AgentState, workflow: str) -> str:
+    """Cache variant of a vision workflow: "vision", "chunked" or "pipeline"."""
+    if workflow == "vision":
+        return workflow
+    return f"{workflow}:{state.get('chunk_size') or VISION_CHUNK_SIZE or 'plan'}"
+
+
+def _vision_cache_settings(state: AgentState) -> Dict[str, Any]:
+    """Page settings that change what a vision extraction is sent."""
+    filter_enabled = state.get("filter_pages", PAGE_FILTER_ENABLED)
+    crop_enabled = state.get("crop_pages", PAGE_CROP_ENABLED)
+    return {
+        "dpi": RASTER_DPI,
+        "encoding": UPLOAD_ENCODING,
+        "filter": PAGE_FILTER if filter_enabled else None,
+        "crop": PAGE_CROP if crop_enabled else None,
+    }
+
+
+def _lookup_vision_cache(state: AgentState, workflow: str) -> Dict[str, Any]:
+    """
+    Cache lookup of a vision workflow, from the PDF hash and settings alone,
+    so a hit needs no page to be rendered. Returns the node update: the cached
+    result, or the key to store the new result under.
+    """
+    model = state.get("model_name", "gpt-4o")
+    _, system_prompt_content = _get_extraction_spec(state)
+    cache_key, cached_data = _lookup_cache(
+        state,
+        model,
+        system_prompt_content,
+        _vision_cache_variant(state, workflow),
+        _vision_cache_settings(state),
+    )
+    if cached_data is not None:
+        return {
+            "extracted_data": cached_data,
+            "cache_hit": True,
+            "cache_key": cache_key,
+        }
+    return {"cache_hit": False, "cache_key": cache_key}
+
+
+def node_lookup_cache(state: AgentState):
+    """Checks the extraction cache of the single-request vision workflow."""
+    return _lookup_vision_cache(state, "vision")
+
+
+def node_lookup_cache_chunked(state: AgentState):
+    """Checks the extraction cache of the chunked vision workflow."""
+    return _lookup_vision_cache(state, "chunked")
+
+
+def node_lookup_cache_pipelined(state: AgentState):
+    """Checks the extraction cache of the pipelined vision workflow."""
+    return _lookup_vision_cache(state, "pipeline")
+
+
+def select_cache_route(state: AgentState) -> str:
+    """Conditional edge after the cache lookup: "hit" skips rendering and the model."""
+    return "hit" if state.get("cache_hit") else "miss"
+
+
+def _store_cache(cache_key: Optional[str], extracted_data: List[Dict[str, Any]]):
+    if not cache_key:
+        return
+    try:
+        extraction_cache.set(cache_key, extracted_data)
+    except OSError as cache_error:
+        log.warning("Could not write extraction cache: %s", cache_error)
+
+
+def _single_flight(
+    state: AgentState,
+    model: str,
+    system_prompt: str,
+    variant: str,
+    extract: Callable[[], Dict[str, Any]],
+) -> Dict[str, Any]:
+    """
+    Runs `extract()` once for concurrent identical requests (same PDF, model,
+    effective prompt and workflow variant); the other requests attach to it
+    and get a copy of its update. `extract` returns the node update with only
+    the errors it adds; the state's errors are prepended here.
+    """
+    flight_key = make_cache_key(state["pdf_bytes"], model, system_prompt, variant)
+    update, shared = extraction_flights.do(flight_key, extract)
+    return _flight_update(state, flight_key, update, shared)
+
+
+async def _asingle_flight(
+    state: AgentState,
+    model: str,
+    system_prompt: str,
+    variant: str,
+    extract: Callable[[], Any],
+) -> Dict[str, Any]:
+    """Async version of _single_flight for a coroutine function `extract`."""
+    flight_key = make_cache_key(state["pdf_bytes"], model, system_prompt, variant)
+    update, shared = await extraction_flights.ado(flight_key, extract)
+    return _flight_update(state, flight_key, update, shared)
+
+
+def _flight_update(
+    state: AgentState, flight_key: str, update: Dict[str, Any], shared: bool
+) -> Dict[str, Any]:
+    if shared:
+        log.info(
+            "Attached to the in-flight extraction %s.",
+            flight_key[:12],
+            extra={"event": "single_flight.attach", "flight_key": flight_key[:12]},
         )
+        # Nothing was uploaded for this request; copy so runs stay independent
+        update = {
+            key: copy.deepcopy(value)
+            for key, value in update.items()
+            if key not in ("page_payload_bytes", "stream_stats")
+        }
+        update["collapsed"] = True
+    if "errors" in update:
+        update = {**update, "errors": state["errors"] + update["errors"]}
+    return update
 
-        # Define Pydantic models for extraction
-        class Element(BaseModel):
-            label: str = Field(
-                description="The label of the extracted element, e.g., 'NombreApellidos'"
-            )
-            value: str = Field(description="The extracted value")
-            page_number: int = Field(
-                description="The page number where this element was found (1-indexed)."
-            )
-            bounding_box: Optional[List[int]] = Field(
-                description="The bounding box [ymin, xmin, ymax, xmax] or null"
-            )
 
-        class Test(BaseModel):
-            description: str = Field(description="Name or description of the test")
-            sample_type: Optional[str] = Field(
-                description="Type of sample (e.g., Suero, Orina, Sangre total)"
-            )
-            loinc_code: Optional[str] = Field(
-                description="Proposed LOINC code based on context"
-            )
-            page_number: int = Field(
-                description="The page number where this element was found (1-indexed)."
+def _get_stream_callback() -> Callable[[str, Dict[str, Any]], None]:
+    """
+    Returns a callback that publishes completed items on the LangGraph custom
+    stream (`stream_mode="custom"`), or a no-op outside a graph run.
+    The writer needs the run context, so worker threads must run with a copy
+    of the node's context (see contextvars.copy_context).
+    """
+    try:
+        writer = get_stream_writer()
+    except Exception:
+        return lambda section, item: None
+
+    def publish(section: str, item: Dict[str, Any]):
+        try:
+            writer({"type": "item", "section": section, "item": item})
+        except RuntimeError:
+            pass  # Live updates are best-effort; the final result still arrives
+
+    return publish
+
+
+class _CompletionStream:
+    """
+    Consumes one streamed JSON-mode completion attempt, chunk by chunk
+    (shared by the sync and async call paths): enforces the deadline and
+    cancellation, emits completed items and records the stream timings.
+    """
+
+    def __init__(self, model: str, on_item, timeout: float):
+        self.model = model
+        self.on_item = on_item
+        self.timeout = timeout
+        self.start = time.perf_counter()
+        self.parser = StreamingExtractionParser()
+        self.stats = {
+            "time_to_first_token": None,
+            "time_to_first_field": None,
+            "generation_seconds": None,
+            "prompt_tokens": None,
+            "completion_tokens": None,
+        }
+
+    def feed(self, chunk, cancel_event: Optional[threading.Event] = None):
+        if cancel_event is not None and cancel_event.is_set():
+            raise resilience.Cancelled(f"{self.model} request cancelled")
+        if time.perf_counter() - self.start > self.timeout:
+            raise resilience.DeadlineExceeded(
+                f"{self.model} did not finish within {self.timeout:.0f}s"
             )
-            bounding_box: Optional[List[int]] = Field(
-                description="The bounding box [ymin, xmin, ymax, xmax] or null"
+        # With include_usage, the last chunk has the usage and no choices
+        usage = getattr(chunk, "usage", None)
+        if usage:
+            self.stats["prompt_tokens"] = usage.prompt_tokens
+            self.stats["completion_tokens"] = usage.completion_tokens
+        if not chunk.choices:
+            return
+        content = chunk.choices[0].delta.content
+        if not content:
+            return
+        if self.stats["time_to_first_token"] is None:
+            self.stats["time_to_first_token"] = time.perf_counter() - self.start
+        for section, item in self.parser.feed(content):
+            if self.stats["time_to_first_field"] is None:
+                self.stats["time_to_first_field"] = time.perf_counter() - self.start
+            if self.on_item:
+                self.on_item(section, item)
+
+    def finish(self, result_model):
+        """Returns (extracted_dict, stream_stats); raises ValueError on a schema mismatch."""
+        full_response = self.parser.text
+        self.stats["generation_seconds"] = time.perf_counter() - self.start
+        log.debug("Model response: %s", full_response)
+
+        # Parse and Validate
+        try:
+            extracted_dict = result_model.model_validate_json(
+                full_response
+            ).model_dump()
+        except Exception as parse_error:
+            log.error("JSON Parsing failed: %s", parse_error)
+            raise ValueError(f"JSON Parsing Error: {str(parse_error)}") from parse_error
+        return extracted_dict, self.stats
+
+
+def _completion_request(model: str, messages: List[Dict[str, Any]], timeout: float):
+    """Keyword arguments of the streamed chat completion request."""
+    log.info(
+        "Sending request to Requesty (timeout=%.0fs)...",
+        timeout,
+        extra={"event": "llm.request", "model": model, "timeout": round(timeout, 1)},
+    )
+    return {
+        "model": model,
+        "messages": messages,
+        "stream": True,
+        "stream_options": {"include_usage": True},
+        "response_format": {"type": "json_object"},
+        "temperature": 0,
+        # The read timeout bounds a stalled stream, the deadline a slow one
+        "timeout": httpx.Timeout(timeout, connect=LLM_CONNECT_TIMEOUT),
+    }
+
+
+def _stream_completion(
+    client,
+    model: str,
+    messages: List[Dict[str, Any]],
+    result_model,
+    on_item: Optional[Callable[[str, Dict[str, Any]], None]],
+    timeout: float,
+    cancel_event: threading.Event,
+):
+    """
+    One streamed JSON-mode completion attempt (see _call_model).
+    Stops with DeadlineExceeded once `timeout` seconds have passed and with
+    Cancelled when `cancel_event` is set (a hedged request won).
+    """
+    completion = _CompletionStream(model, on_item, timeout)
+    stream = client.chat.completions.create(
+        **_completion_request(model, messages, timeout)
+    )
+    # Closing the stream hands its connection back to the keep-alive pool
+    with stream:
+        for chunk in stream:
+            completion.feed(chunk, cancel_event)
+    return completion.finish(result_model)
+
+
+async def _astream_completion(
+    client,
+    model: str,
+    messages: List[Dict[str, Any]],
+    result_model,
+    on_item: Optional[Callable[[str, Dict[str, Any]], None]],
+    timeout: float,
+):
+    """Async version of _stream_completion; a lost hedge cancels the task."""
+    completion = _CompletionStream(model, on_item, timeout)
+    stream = await client.chat.completions.create(
+        **_completion_request(model, messages, timeout)
+    )
+    async with stream:
+        async for chunk in stream:
+            completion.feed(chunk)
+    return completion.finish(result_model)
+
+
+def _single_publisher(on_item):
+    """
+    Wraps `on_item` so only one attempt at a time publishes live items, so a
+    hedged duplicate does not show every field twice. Returns
+    (publisher_for_attempt, release), where release(attempt_id) hands the
+    role to the next attempt after a failure. The items of each section
+    already published are counted, so a retry, which streams the document
+    again from the start, only forwards the items past them.
+    """
+    owner = {"id": None}
+    published: Dict[str, int] = {}  # Section -> items already published
+    lock = threading.Lock()
+
+    def publisher_for(attempt_id):
+        if not on_item:
+            return None
+        streamed: Dict[str, int] = {}  # Section -> items of this attempt
+
+        def publish(section: str, item: Dict[str, Any]):
+            with lock:
+                position = streamed.get(section, 0)
+                streamed[section] = position + 1
+                if owner["id"] is None:
+                    owner["id"] = attempt_id
+                if owner["id"] is not attempt_id:
+                    return
+                if position < published.get(section, 0):
+                    return  # Already shown by an attempt that failed
+                published[section] = position + 1
+            on_item(section, item)
+
+        return publish
+
+    def release(attempt_id):
+        with lock:
+            if owner["id"] is attempt_id:
+                owner["id"] = None
+
+    return publisher_for, release
+
+
+def _log_response(stream_stats: Dict[str, Any], info: Dict[str, Any]):
+    stream_stats["retries"] = info["retries"]
+    stream_stats["hedged"] = info["hedged"]
+    log.info(
+        "Response received in %.2fs",
+        stream_stats["generation_seconds"],
+        extra={
+            "event": "llm.response",
+            "model": info["model"],
+            **{key: value for key, value in stream_stats.items() if value is not None},
+        },
+    )
+
+
+def _call_model(
+    client,
+    model: str,
+    system_prompt: str,
+    user_content,
+    result_model,
+    on_item: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+    pages: int = 1,
+):
+    """
+    Streams a JSON-mode chat completion and validates it against `result_model`.
+    Each element/test/urine_details object is passed to `on_item(section, item)`
+    as soon as it is complete in the stream.
+    The call goes through the resilience layer: an adaptive deadline for
+    `pages` pages, retries with backoff and optional hedging (see resilience.py).
+    Returns (extracted_dict, stream_stats) with time to first token, time to
+    first field and total generation time in seconds of the attempt that
+    succeeded, the token usage reported by the provider, the number of retries
+    and whether a hedged request won.
+    Raises ValueError if the response does not match the schema.
+    """
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_content},
+    ]
+    publisher_for, release = _single_publisher(on_item)
+
+    def attempt(attempt_model: str, timeout: float, cancel_event: threading.Event):
+        attempt_id = object()
+        try:
+            return _stream_completion(
+                client,
+                attempt_model,
+                messages,
+                result_model,
+                publisher_for(attempt_id),
+                timeout,
+                cancel_event,
             )
+        except Exception:
+            release(attempt_id)
+            raise
+
+    (extracted_dict, stream_stats), info = resilience.call_with_resilience(
+        attempt, model, pages
+    )
+    _log_response(stream_stats, info)
+    return extracted_dict, stream_stats
+
+
+async def _acall_model(
+    client,
+    model: str,
+    system_prompt: str,
+    user_content,
+    result_model,
+    on_item: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+    pages: int = 1,
+):
+    """Async version of _call_model, for the async workflow nodes."""
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_content},
+    ]
+    publisher_for, release = _single_publisher(on_item)
 
-        class UrineDetails(BaseModel):
-            collection_type: str = Field(
-                description="Type of urine collection", enum=["24h", "Spot", "Random"]
+    async def attempt(attempt_model: str, timeout: float):
+        attempt_id = object()
+        try:
+            return await _astream_completion(
+                client,
+                attempt_model,
+                messages,
+                result_model,
+                publisher_for(attempt_id),
+                timeout,
             )
-            volume: Optional[str] = Field(
-                description="Total volume if specified (e.g., 1500 ml)"
+        except BaseException:  # Includes the cancellation of a lost hedge
+            release(attempt_id)
+            raise
+
+    (extracted_dict, stream_stats), info = await resilience.acall_with_resilience(
+        attempt, model, pages
+    )
+    _log_response(stream_stats, info)
+    return extracted_dict, stream_stats
+
+
+def _page_number_fixer(
+    first_page: int,
+    page_count: int,
+    page_map: Optional[List[int]] = None,
+    page_crops: Optional[List[Optional[List[int]]]] = None,
+):
+    """
+    Returns fix(item), which maps chunk-relative page numbers (models
+    sometimes number pages from 1 within a chunk) back to document pages.
+    With a `page_map` (filtered upload), the position of the image in the
+    upload is then mapped to its original page number, and with `page_crops`
+    the bounding box is mapped from the cropped to the full page.
+    """
+    last_page = first_page + page_count - 1
+
+    def fix_page_number(item: Optional[Dict[str, Any]]):
+        if not item or not isinstance(item.get("page_number"), int):
+            return
+        page_number = item["page_number"]
+        if first_page <= page_number <= last_page:
+            pass
+        elif 1 <= page_number <= page_count:
+            page_number = first_page + page_number - 1
+        else:
+            page_number = first_page
+        item["page_number"] = page_map[page_number - 1] if page_map else page_number
+        if page_crops and item.get("bounding_box"):
+            item["bounding_box"] = utils.uncrop_box(
+                item["bounding_box"], page_crops[item["page_number"] - 1]
             )
-            page_number: int = Field(
-                description="The page number where this element was found (1-indexed)."
+
+    return fix_page_number
+
+
+def _encode_page(image: Any, page_number: int) -> Dict[str, Any]:
+    """Encodes one page with UPLOAD_ENCODING (see utils.encode_page_for_upload)."""
+    encoded = utils.encode_page_for_upload(image, **UPLOAD_ENCODING)
+    log.debug(
+        "Page %d: %.1f KB (%s)",
+        page_number,
+        encoded["bytes"] / 1024,
+        encoded["mime_type"],
+        extra={
+            "event": "upload.page",
+            "page": page_number,
+            "bytes": encoded["bytes"],
+        },
+    )
+    return encoded
+
+
+def _image_content(
+    encoded_pages: List[Dict[str, Any]],
+    first_page: int = 1,
+    total_pages: Optional[int] = None,
+):
+    """
+    Builds the user message content for a vision call from encoded pages.
+    Without `total_pages` (not known yet), a chunk that does not start at
+    page 1 is described as part of a longer document.
+    Returns (messages_content, page_payload_bytes).
+    """
+    last_page = first_page + len(encoded_pages) - 1
+    intro = "Extract the clinical data from this document. The document is provided as a series of images."
+    if total_pages and len(encoded_pages) < total_pages:
+        intro += (
+            f" These images are pages {first_page} to {last_page} of a {total_pages}-page document;"
+            f" use those page numbers for page_number."
+        )
+    elif not total_pages and first_page > 1:
+        intro += (
+            f" These images are pages {first_page} to {last_page} of a longer document;"
+            f" use those page numbers for page_number."
+        )
+
+    # Prepare messages
+    messages_content = [{"type": "text", "text": intro}]
+    page_payload_bytes = []
+    for encoded in encoded_pages:
+        page_payload_bytes.append(encoded["bytes"])
+        messages_content.append(
+            {"type": "image_url", "image_url": {"url": encoded["data_url"]}}
+        )
+    log.info(
+        "Upload payload: %.1f KB for pages %d-%d.",
+        sum(page_payload_bytes) / 1024,
+        first_page,
+        last_page,
+        extra={
+            "event": "upload",
+            "first_page": first_page,
+            "last_page": last_page,
+            "bytes": sum(page_payload_bytes),
+        },
+    )
+    return messages_content, page_payload_bytes
+
+
+def _build_image_content(
+    images: List[Any], first_page: int = 1, total_pages: Optional[int] = None
+):
+    """
+    Encodes the pages and builds the user message content for a vision call.
+    CPU-bound: the async path runs it in a worker thread.
+    Returns (messages_content, page_payload_bytes).
+    """
+    encoded_pages = [
+        _encode_page(image, page_number)
+        for page_number, image in enumerate(images, start=first_page)
+    ]
+    return _image_content(encoded_pages, first_page, total_pages)
+
+
+def _fix_result_pages(extracted_dict: Dict[str, Any], fix_page_number):
+    for item in (
+        extracted_dict["elements"]
+        + extracted_dict["tests"]
+        + [extracted_dict["urine_details"]]
+    ):
+        fix_page_number(item)
+
+
+def _extract_from_images(
+    client,
+    model: str,
+    system_prompt: str,
+    result_model,
+    images: List[Any],
+    first_page: int = 1,
+    total_pages: Optional[int] = None,
+    on_item: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+    page_map: Optional[List[int]] = None,
+    page_crops: Optional[List[Optional[List[int]]]] = None,
+):
+    """
+    Sends a list of page images in a single streamed chat completion and
+    validates the response. `first_page` is the position of images[0] in the
+    upload, so chunks of a longer document get correct page numbers, and
+    `page_map` maps upload positions back to original pages (see
+    node_filter_pages); without it positions are the document page numbers.
+    `page_crops` (see node_crop_pages) maps boxes back to full pages.
+    Returns (extracted_dict, page_payload_bytes, stream_stats).
+    Raises ValueError if the response does not match the schema.
+    """
+    messages_content, page_payload_bytes = _build_image_content(
+        images, first_page, total_pages
+    )
+    extracted_dict, stream_stats = _extract_from_content(
+        client,
+        model,
+        system_prompt,
+        result_model,
+        messages_content,
+        len(images),
+        first_page=first_page,
+        on_item=on_item,
+        page_map=page_map,
+        page_crops=page_crops,
+    )
+    return extracted_dict, page_payload_bytes, stream_stats
+
+
+def _extract_from_content(
+    client,
+    model: str,
+    system_prompt: str,
+    result_model,
+    messages_content: List[Dict[str, Any]],
+    page_count: int,
+    first_page: int = 1,
+    on_item: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+    page_map: Optional[List[int]] = None,
+    page_crops: Optional[List[Optional[List[int]]]] = None,
+):
+    """
+    Sends prepared vision message content (`page_count` pages from upload
+    position `first_page`) and maps the result back to document pages.
+    Returns (extracted_dict, stream_stats).
+    """
+    fix_page_number = _page_number_fixer(first_page, page_count, page_map, page_crops)
+
+    def publish(section: str, item: Dict[str, Any]):
+        fix_page_number(item)
+        on_item(section, item)
+
+    extracted_dict, stream_stats = _call_model(
+        client,
+        model,
+        system_prompt,
+        messages_content,
+        result_model,
+        on_item=publish if on_item else None,
+        pages=page_count,
+    )
+    _fix_result_pages(extracted_dict, fix_page_number)
+    return extracted_dict, stream_stats
+
+
+async def _aextract_from_images(
+    client,
+    model: str,
+    system_prompt: str,
+    result_model,
+    images: List[Any],
+    first_page: int = 1,
+    total_pages: Optional[int] = None,
+    on_item: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+    page_map: Optional[List[int]] = None,
+    page_crops: Optional[List[Optional[List[int]]]] = None,
+):
+    """Async version of _extract_from_images; pages are encoded in a worker thread."""
+    fix_page_number = _page_number_fixer(first_page, len(images), page_map, page_crops)
+
+    def publish(section: str, item: Dict[str, Any]):
+        fix_page_number(item)
+        on_item(section, item)
+
+    messages_content, page_payload_bytes = await asyncio.to_thread(
+        _build_image_content, images, first_page, total_pages
+    )
+    extracted_dict, stream_stats = await _acall_model(
+        client,
+        model,
+        system_prompt,
+        messages_content,
+        result_model,
+        on_item=publish if on_item else None,
+        pages=len(images),
+    )
+    _fix_result_pages(extracted_dict, fix_page_number)
+    return extracted_dict, page_payload_bytes, stream_stats
+
+
+# Patient, doctor and petition fields printed in the header of every page
+HEADER_LABELS = frozenset(
+    {
+        "Paciente",
+        "FechaNacimiento",
+        "Sexo",
+        "DocumentoIdentidad",
+        "Telefono",
+        "NombreMedico",
+        "NumeroColegiado",
+        "NumeroPeticion",
+    }
+)
+
+
+def _normalize_value(value: Optional[str]) -> str:
+    return " ".join((value or "").split()).casefold()
+
+
+def merge_extraction_results(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Merges per-chunk ExtractionResult dicts (in page order) into one result.
+    Header elements (HEADER_LABELS) repeated on several pages with the same
+    value are kept only once, at their first occurrence; other elements and
+    tests are only collapsed when repeated on the same page. The first urine
+    details found are kept.
+    """
+    merged = {"elements": [], "tests": [], "urine_details": None}
+    seen_elements = set()
+    seen_tests = set()
+    for result in results:
+        for element in result.get("elements", []):
+            key = (element["label"], _normalize_value(element["value"]))
+            if element["label"] not in HEADER_LABELS:
+                key += (element.get("page_number"),)
+            if key not in seen_elements:
+                seen_elements.add(key)
+                merged["elements"].append(element)
+        for test in result.get("tests", []):
+            key = (
+                _normalize_value(test["description"]),
+                _normalize_value(test.get("sample_type")),
+                test["page_number"],
             )
-            bounding_box: Optional[List[int]] = Field(
-                description="The bounding box [ymin, xmin, ymax, xmax] or null"
+            if key not in seen_tests:
+                seen_tests.add(key)
+                merged["tests"].append(test)
+        if merged["urine_details"] is None and result.get("urine_details"):
+            merged["urine_details"] = result["urine_details"]
+    return merged
+
+
+def _vision_update(
+    cache_key: Optional[str],
+    extracted_dict: Dict[str, Any],
+    page_payload_bytes: List[int],
+    stream_stats: Dict[str, Any],
+) -> Dict[str, Any]:
+    """Node update (and cache entry) for a whole-document vision extraction."""
+    # We now have a single extraction result for the whole document
+    new_data = [
+        {
+            "page": "All",
+            "content": extracted_dict,
+            "source": "Requesty Vision (All Images)",
+        }
+    ]
+    _store_cache(cache_key, new_data)
+
+    log.info("Vision extraction completed for all images.")
+    return {
+        "extracted_data": new_data,
+        "cache_hit": False,
+        "page_payload_bytes": page_payload_bytes,
+        "stream_stats": stream_stats,
+    }
+
+
+def _build_text_content(text_pages: List[Dict[str, Any]]) -> str:
+    """User message for the text path: the text layer with line positions."""
+    document_text = utils.format_text_layer(text_pages)
+    text_bytes = len(document_text.encode("utf-8"))
+    log.info(
+        "Upload payload: %.1f KB of text for %d pages.",
+        text_bytes / 1024,
+        len(text_pages),
+        extra={
+            "event": "upload",
+            "bytes": text_bytes,
+            "pages": len(text_pages),
+        },
+    )
+    return (
+        "Extract the clinical data from this document. The document is provided "
+        "as its text layer, with the position of every line.\n\n" + document_text
+    )
+
+
+def _text_update(
+    cache_key: Optional[str],
+    extracted_dict: Dict[str, Any],
+    stream_stats: Dict[str, Any],
+) -> Dict[str, Any]:
+    """Node update (and cache entry) for a text layer extraction."""
+    new_data = [
+        {
+            "page": "All",
+            "content": extracted_dict,
+            "source": "Requesty Text Layer",
+        }
+    ]
+    _store_cache(cache_key, new_data)
+
+    log.info("Text extraction completed.")
+    return {
+        "extracted_data": new_data,
+        "cache_hit": False,
+        "stream_stats": stream_stats,
+    }
+
+
+def node_requesty_vision_extraction(state: AgentState):
+    """
+    Uses Requesty (OpenAI compatible) with a Vision model to extract data directly from images (all at once).
+    """
+    try:
+        if not state["images"]:
+            log.warning("No images found in state.")
+            return {}
+
+        images, page_map = _upload_pages(state)
+        log.info("Extracting data from %d images using Vision...", len(images))
+
+        # Use model from state or default
+        model = state.get("model_name", "gpt-4o")
+        result_model, system_prompt_content = _get_extraction_spec(state)
+        variant = _page_variant(state)
+
+        plan = _plan_batches(
+            state, images, model, system_prompt_content, 1, log_plan=False
+        )
+        if len(plan["batches"]) > 1:
+            log.info(
+                "%d pages exceed the single-request budget, extracting in batches.",
+                len(images),
             )
+            return node_requesty_vision_extraction_chunked(state)
+        planner.log_plan(plan, model, page_map)
+        # Looked up by node_lookup_cache before rendering
+        cache_key = state.get("cache_key")
+
+        def extract():
+            try:
+                extracted_dict, page_payload_bytes, stream_stats = _extract_from_images(
+                    get_client(),
+                    model,
+                    system_prompt_content,
+                    result_model,
+                    images,
+                    on_item=_get_stream_callback(),
+                    page_map=page_map,
+                    page_crops=state.get("page_crops"),
+                )
+            except ValueError as parse_error:
+                return {"errors": [str(parse_error)]}
+            return {
+                **_vision_update(
+                    cache_key, extracted_dict, page_payload_bytes, stream_stats
+                ),
+                **_filter_savings(state, page_payload_bytes),
+            }
+
+        return _single_flight(state, model, system_prompt_content, variant, extract)
+
+    except Exception as e:
+        log.exception("Vision Extraction Error: %s: %s", type(e).__name__, e)
+        return {
+            "errors": state["errors"] + [f"Vision Extraction Error: {str(e)}"],
+        }
+
+
+def node_apply_rules(state: AgentState):
+    """
+    Resolves the rigid-format header fields (identity document, phone, date of
+    birth, collegiate and petition numbers) from the text layer with rules.py.
+    The text extraction node asks the model only for the other fields and
+    merges these in.
+    """
+    text_pages = state.get("text_pages") or []
+    if not text_pages or not state.get("apply_rules", RULES_ENABLED):
+        return {"rule_fields": None}
+    try:
+        rule_fields = rules.apply_rules(text_pages)
+    except Exception as e:
+        log.warning("Header rules failed, leaving every field to the model: %s", e)
+        return {"rule_fields": None}
 
-        class ExtractionResult(BaseModel):
-            elements: List[Element] = Field(
-                description="List of general extracted elements"
+    for label in rule_fields["resolved"]:
+        RULE_FIELDS.inc(label=label, result="resolved")
+    for label in rule_fields["unresolved"]:
+        RULE_FIELDS.inc(label=label, result="unresolved")
+    publish = _get_stream_callback()
+    for element in rule_fields["elements"]:
+        publish("elements", element)
+    log.info(
+        "Rules resolved %d of %d header fields.",
+        len(rule_fields["resolved"]),
+        len(rules.RULE_LABELS),
+        extra={
+            "event": "rules",
+            "resolved": rule_fields["resolved"],
+            "unresolved": rule_fields["unresolved"],
+        },
+    )
+    return {"rule_fields": rule_fields}
+
+
+def node_requesty_text_extraction(state: AgentState):
+    """
+    Extracts data from the embedded text layer (lines with normalized positions)
+    instead of page images, using the same schema as the vision path.
+    """
+    try:
+        text_pages = state.get("text_pages") or []
+        if not text_pages:
+            log.warning("No text layer found in state.")
+            return {}
+
+        log.info("Extracting data from the text layer of %d pages...", len(text_pages))
+
+        model = state.get("model_name", "gpt-4o")
+        rule_fields = state.get("rule_fields")
+        result_model, system_prompt_content = _get_extraction_spec(
+            state,
+            input_instructions=load_prompt("text_extraction.md"),
+            resolved_labels=tuple(rule_fields["resolved"]) if rule_fields else (),
+        )
+
+        cache_key, cached_data = _lookup_cache(
+            state, model, system_prompt_content, variant="text"
+        )
+        if cached_data is not None:
+            return {"extracted_data": cached_data, "cache_hit": True}
+
+        def extract():
+            try:
+                extracted_dict, stream_stats = _call_model(
+                    get_client(),
+                    model,
+                    system_prompt_content,
+                    _build_text_content(text_pages),
+                    result_model,
+                    on_item=_get_stream_callback(),
+                    pages=len(text_pages),
+                )
+            except ValueError as parse_error:
+                return {"errors": [str(parse_error)]}
+            if rule_fields:
+                extracted_dict = rules.merge_rule_elements(extracted_dict, rule_fields)
+            return _text_update(cache_key, extracted_dict, stream_stats)
+
+        return _single_flight(state, model, system_prompt_content, "text", extract)
+
+    except Exception as e:
+        log.exception("Text Extraction Error: %s: %s", type(e).__name__, e)
+        return {
+            "errors": state["errors"] + [f"Text Extraction Error: {str(e)}"],
+        }
+
+
+def _collect_chunks(chunk_futures):
+    """
+    Waits for chunk extractions given as (first_page, last_page, future), in
+    page order so the merge sees pages in order. Finished asyncio tasks work
+    as futures too. A failed chunk is reported
+    in the errors without losing the other chunks.
+    Returns (results, errors, page_payload_bytes, chunk_stream_stats).
+    """
+    results = []
+    errors = []
+    page_payload_bytes = []
+    chunk_stream_stats = []
+    for first_page, last_page, future in chunk_futures:
+        try:
+            extracted_dict, chunk_bytes, chunk_stats = future.result()
+            results.append(extracted_dict)
+            page_payload_bytes.extend(chunk_bytes)
+            chunk_stream_stats.append(chunk_stats)
+            log.info("Pages %d-%d done.", first_page, last_page)
+        except Exception as chunk_error:
+            log.error(
+                "Pages %d-%d failed: %s: %s",
+                first_page,
+                last_page,
+                type(chunk_error).__name__,
+                chunk_error,
             )
-            tests: List[Test] = Field(description="List of clinical tests")
-            urine_details: Optional[UrineDetails] = Field(
-                description="Details about urine sample if present"
+            errors.append(
+                f"Vision Extraction Error (pages {first_page}-{last_page}): {str(chunk_error)}"
             )
+    return results, errors, page_payload_bytes, chunk_stream_stats
 
-        # Prepare messages
-        messages_content = [
-            {
-                "type": "text",
-                "text": "Extract the clinical data from this document. The document is provided as a series of images.",
-            }
+
+def _merge_stream_stats(chunk_stream_stats: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Document stream_stats of chunks extracted concurrently."""
+    # Chunks run concurrently: the document sees the earliest first field
+    # and finishes with the slowest chunk
+    first_fields = [
+        stats["time_to_first_field"]
+        for stats in chunk_stream_stats
+        if stats["time_to_first_field"] is not None
+    ]
+    first_tokens = [
+        stats["time_to_first_token"]
+        for stats in chunk_stream_stats
+        if stats["time_to_first_token"] is not None
+    ]
+    stream_stats = {
+        "time_to_first_token": min(first_tokens) if first_tokens else None,
+        "time_to_first_field": min(first_fields) if first_fields else None,
+        "generation_seconds": max(
+            stats["generation_seconds"] for stats in chunk_stream_stats
+        ),
+        "retries": sum(stats.get("retries") or 0 for stats in chunk_stream_stats),
+        "hedged": any(stats.get("hedged") for stats in chunk_stream_stats),
+    }
+    for kind in ("prompt_tokens", "completion_tokens"):
+        counts = [stats[kind] for stats in chunk_stream_stats if stats.get(kind)]
+        stream_stats[kind] = sum(counts) if counts else None
+    return stream_stats
+
+
+def _split_chunks(
+    state: AgentState,
+    images: List[Any],
+    model: str,
+    system_prompt: str,
+    max_concurrency: int,
+):
+    """
+    Requests of the chunked path: `chunk_size` pages each, or batches planned
+    from the token and latency budgets when it is 0 (see planner.py).
+    Returns (chunks, variant, source, batch_plan), with chunks as
+    (first upload position, images).
+    """
+    chunk_size = state.get("chunk_size") or VISION_CHUNK_SIZE
+    if chunk_size:
+        chunks = [
+            (first_index + 1, images[first_index : first_index + chunk_size])
+            for first_index in range(0, len(images), chunk_size)
         ]
+        variant = _page_variant(state, f"chunked:{chunk_size}")
+        source = f"Requesty Vision ({len(chunks)} chunks of {chunk_size} pages)"
+        return chunks, variant, source, None
 
-        for image in state["images"]:
-            image_url = utils.get_image_data_url(image)
-            messages_content.append(
-                {"type": "image_url", "image_url": {"url": image_url}}
+    plan = _plan_batches(state, images, model, system_prompt, max_concurrency)
+    chunks = [
+        (batch[0] + 1, images[batch[0] : batch[-1] + 1]) for batch in plan["batches"]
+    ]
+    batch_plan = {
+        "batch_pages": [len(batch) for batch in plan["batches"]],
+        "batch_tokens": plan["batch_tokens"],
+        "estimated_seconds": plan["estimated_seconds"],
+    }
+    variant = _page_variant(
+        state, "chunked:plan:" + ",".join(map(str, batch_plan["batch_pages"]))
+    )
+    source = f"Requesty Vision ({len(chunks)} planned batches)"
+    return chunks, variant, source, batch_plan
+
+
+def _chunked_update(
+    state: AgentState,
+    cache_key: Optional[str],
+    source: str,
+    batch_plan: Optional[Dict[str, Any]],
+    chunk_outcomes,
+) -> Dict[str, Any]:
+    """
+    Node update (and cache entry) of the chunked path from the finished
+    chunks, given as (first_page, last_page, future or task) in page order.
+    """
+    results, errors, page_payload_bytes, chunk_stream_stats = _collect_chunks(
+        chunk_outcomes
+    )
+    if not results:
+        return {"errors": errors}
+
+    new_data = [
+        {
+            "page": "All",
+            "content": merge_extraction_results(results),
+            "source": source,
+        }
+    ]
+    if not errors:
+        _store_cache(cache_key, new_data)
+
+    log.info("Chunked vision extraction completed.")
+    return {
+        "extracted_data": new_data,
+        "cache_hit": False,
+        "page_payload_bytes": page_payload_bytes,
+        "stream_stats": _merge_stream_stats(chunk_stream_stats),
+        "errors": errors,
+        "batch_plan": batch_plan,
+        **_filter_savings(state, page_payload_bytes),
+    }
+
+
+def node_requesty_vision_extraction_chunked(state: AgentState):
+    """
+    Splits the pages into chunks (`chunk_size` pages each, or batches planned
+    from the token and latency budgets when it is 0, see planner.py) and
+    extracts them concurrently (bounded by max_concurrency), then merges the
+    chunk results into a single result.
+    A failed chunk is reported in `errors` without losing the other chunks.
+    """
+    try:
+        if not state["images"]:
+            log.warning("No images found in state.")
+            return {}
+        images, page_map = _upload_pages(state)
+
+        model = state.get("model_name", "gpt-4o")
+        max_concurrency = max(1, state.get("max_concurrency") or VISION_MAX_CONCURRENCY)
+        result_model, system_prompt_content = _get_extraction_spec(state)
+
+        chunks, variant, source, batch_plan = _split_chunks(
+            state, images, model, system_prompt_content, max_concurrency
+        )
+        cache_key = state.get("cache_key")
+
+        def extract():
+            log.info(
+                "Extracting %d pages in %d chunks (max %d concurrent)...",
+                len(images),
+                len(chunks),
+                max_concurrency,
             )
 
-        # Use system prompt from state or load default
-        system_prompt_content = state.get("system_prompt")
-        if not system_prompt_content:
-            system_prompt_content = load_prompt("vision_extraction.md")
+            client = get_client()
+            on_item = _get_stream_callback()
 
-        # Append schema instructions
-        # We manually create a schema description since we are not using JsonOutputParser anymore
-        schema_json = ExtractionResult.model_json_schema()
-        system_prompt_content += f"\n\n# JSON Schema\nRespond strictly with a JSON object satisfying this schema:\n{json.dumps(schema_json, indent=2)}"
+            def extract_chunk(chunk):
+                first_page, chunk_images = chunk
+                return _extract_from_images(
+                    client,
+                    model,
+                    system_prompt_content,
+                    result_model,
+                    chunk_images,
+                    first_page=first_page,
+                    total_pages=len(images),
+                    on_item=on_item,
+                    page_map=page_map,
+                    page_crops=state.get("page_crops"),
+                )
 
-        messages = [
-            {"role": "system", "content": system_prompt_content},
-            {"role": "user", "content": messages_content},
-        ]
+            with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+                # Copy the context per chunk so each thread can publish live items
+                chunk_futures = [
+                    (
+                        first_page,
+                        first_page + len(chunk_images) - 1,
+                        executor.submit(
+                            contextvars.copy_context().run,
+                            extract_chunk,
+                            (first_page, chunk_images),
+                        ),
+                    )
+                    for first_page, chunk_images in chunks
+                ]
+                return _chunked_update(
+                    state, cache_key, source, batch_plan, chunk_futures
+                )
+
+        return _single_flight(state, model, system_prompt_content, variant, extract)
+
+    except Exception as e:
+        log.exception("Vision Extraction Error: %s: %s", type(e).__name__, e)
+        return {
+            "errors": state["errors"] + [f"Vision Extraction Error: {str(e)}"],
+        }
+
+
+def node_vision_pipeline(state: AgentState):
+    """
+    Vision path of app_vision_pipelined: rasterizes, filters, crops, encodes
+    and uploads in one node with the stages overlapped (see pipeline.py),
+    instead of running convert_pdf, filter_pages, crop_pages and
+    vision_extract one after another. Pages are grouped into requests
+    (`chunk_size` pages, or batches planned from the token and latency
+    budgets) and each request starts as soon as its pages are encoded, while
+    later pages are still being rendered.
+    """
+    try:
+        model = state.get("model_name", "gpt-4o")
+        chunk_size = state.get("chunk_size") or VISION_CHUNK_SIZE
+        max_concurrency = max(1, state.get("max_concurrency") or VISION_MAX_CONCURRENCY)
+        filter_enabled = bool(state.get("filter_pages", PAGE_FILTER_ENABLED))
+        crop_enabled = bool(state.get("crop_pages", PAGE_CROP_ENABLED))
+        result_model, system_prompt_content = _get_extraction_spec(state)
 
-        # Call API with streaming
-        print(f"{CYAN}[INFO] Sending request to Requesty (timeout=600s)...{RESET}")
-        stream = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            stream=True,
-            response_format={"type": "json_object"},
-            temperature=0,
+        page_count, page_size = utils.pdf_page_info(
+            pdf_bytes=state["pdf_bytes"], dpi=RASTER_DPI
         )
+        if not page_count:
+            log.warning("No pages found in the PDF.")
+            return {}
 
-        # Consume stream
-        full_response = ""
-        print(f"{GREEN}[STREAM] Receiving response:{RESET}")
-        for chunk in stream:
-            content = chunk.choices[0].delta.content
-            if content:
-                print(content, end="", flush=True)
-                full_response += content
-        print()  # Newline after stream
+        batch_plan = None
+        if chunk_size:
+            batch_pages = [chunk_size] * math.ceil(page_count / chunk_size)
+        else:
+            # Planned before rendering, with every page at the first page's
+            # size: filtering and cropping only make the requests smaller
+            size = planner.upload_size(*page_size, UPLOAD_ENCODING["max_dimension"])
+            plan = planner.plan_batches(
+                [size] * page_count,
+                model,
+                max_concurrency=max_concurrency,
+                overhead_tokens=len(system_prompt_content) // 4,
+                seconds_per_page=resilience.latency_tracker.percentile(model, 1, 95),
+            )
+            planner.log_plan(plan, model)
+            batch_pages = [len(batch) for batch in plan["batches"]]
+            batch_plan = {
+                "batch_pages": batch_pages,
+                "batch_tokens": plan["batch_tokens"],
+                "estimated_seconds": plan["estimated_seconds"],
+            }
+        variant = (
+            f"pipeline:{','.join(map(str, batch_pages))}"
+            f"|filter:{int(filter_enabled)}|crop:{int(crop_enabled)}"
+        )
 
-        # Parse and Validate
-        try:
-            extracted_data = ExtractionResult.model_validate_json(full_response)
-            extracted_dict = extracted_data.model_dump()
-        except Exception as parse_error:
-            print(f"{RED}[ERROR] JSON Parsing failed: {parse_error}{RESET}")
-            # Attempt to recover partial JSON or return raw error
-            return {
-                "errors": state["errors"] + [f"JSON Parsing Error: {str(parse_error)}"]
+        cache_key = state.get("cache_key")
+
+        def extract():
+            pages = pipeline.PagePipeline(
+                state["pdf_bytes"],
+                dpi=RASTER_DPI,
+                raster_workers=RASTER_WORKERS,
+                filter_settings=PAGE_FILTER if filter_enabled else None,
+                crop_settings=PAGE_CROP if crop_enabled else None,
+                encode=_encode_page,
+            )
+            client = get_client()
+            on_item = _get_stream_callback()
+
+            def extract_chunk(first_page, encoded_pages):
+                # Positions count uploaded pages only, and how many pages the
+                # filter keeps is not known until the pipeline has finished
+                messages_content, chunk_bytes = _image_content(
+                    encoded_pages, first_page
+                )
+                # page_map and page_crops grow as pages arrive; they already
+                # cover every page of this chunk
+                extracted_dict, stream_stats = _extract_from_content(
+                    client,
+                    model,
+                    system_prompt_content,
+                    result_model,
+                    messages_content,
+                    len(encoded_pages),
+                    first_page=first_page,
+                    on_item=on_item,
+                    page_map=pages.page_map,
+                    page_crops=pages.page_crops,
+                )
+                return extracted_dict, chunk_bytes, stream_stats
+
+            chunk_futures = []
+            with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+
+                def submit(chunk):
+                    first_page = chunk[0]["position"]
+                    future = executor.submit(
+                        contextvars.copy_context().run,
+                        extract_chunk,
+                        first_page,
+                        [page["encoded"] for page in chunk],
+                    )
+                    chunk_futures.append(
+                        (first_page, first_page + len(chunk) - 1, future)
+                    )
+
+                batch_sizes = iter(batch_pages)
+                batch_size = next(batch_sizes)
+                chunk = []
+                for page in pages:
+                    chunk.append(page)
+                    if len(chunk) == batch_size:
+                        submit(chunk)
+                        chunk = []
+                        batch_size = next(batch_sizes, batch_size)
+                if chunk:
+                    # Dropped pages leave the last request short
+                    submit(chunk)
+                log.info(
+                    "Uploading %d pages in %d requests (max %d concurrent)...",
+                    len(pages.page_map),
+                    len(chunk_futures),
+                    max_concurrency,
+                )
+                results, errors, page_payload_bytes, chunk_stream_stats = (
+                    _collect_chunks(chunk_futures)
+                )
+
+            update = {
+                # Pages are not kept once encoded: the UI renders its own previews
+                "images": [],
+                "page_timings": pages.page_timings,
+                "page_map": None,
+                "page_crops": pages.page_crops,
+                "pipeline_stats": pages.stats,
+                "batch_plan": batch_plan,
             }
+            if pages.page_filter is not None:
+                page_filter = _record_page_filter(pages.page_filter, pages.page_count)
+                if page_filter["pages_dropped"]:
+                    update["page_map"] = pages.page_map
+                update["page_filter"] = page_filter
+            if not results:
+                return {**update, "errors": errors}
+
+            new_data = [
+                {
+                    "page": "All",
+                    "content": merge_extraction_results(results),
+                    "source": f"Requesty Vision ({len(chunk_futures)} pipelined requests)",
+                }
+            ]
+            if not errors:
+                _store_cache(cache_key, new_data)
 
-        # We now have a single extraction result for the whole document
-        new_data = [
-            {
-                "page": "All",
-                "content": extracted_dict,
-                "source": "Requesty Vision (All Images)",
+            log.info("Pipelined vision extraction completed.")
+            return {
+                **update,
+                "extracted_data": new_data,
+                "cache_hit": False,
+                "page_payload_bytes": page_payload_bytes,
+                "stream_stats": _merge_stream_stats(chunk_stream_stats),
+                "errors": errors,
+                **_filter_savings(update, page_payload_bytes),
             }
-        ]
 
-        print(f"{GREEN}[SUCCESS] Vision extraction completed for all images.{RESET}")
-        return {"extracted_data": new_data}
+        return _single_flight(state, model, system_prompt_content, variant, extract)
 
     except Exception as e:
-        import traceback
+        log.exception("Vision Extraction Error: %s: %s", type(e).__name__, e)
+        return {
+            "errors": state["errors"] + [f"Vision Extraction Error: {str(e)}"],
+        }
+
+
+def node_assign_loinc(state: AgentState):
+    """
+    Sets the loinc_code of every extracted test from the local LOINC table
+    (see loinc.py), matched on description and sample type. Only exact name or
+    synonym hits replace the code. A fuzzy hit is added as `loinc_suggestion`
+    ({"code", "name", "score"}) and the model's code is kept, or None when it
+    was not in the schema; so are tests without a match.
+    """
+    extracted_data = state.get("extracted_data") or []
+    if not extracted_data or not state.get("assign_loinc", LOINC_ENABLED):
+        return {}
+    try:
+        index = loinc.get_index()
+    except (OSError, ValueError) as e:
+        log.warning("LOINC table unavailable, keeping the model's codes: %s", e)
+        return {}
+
+    updated = []
+    counts = {"matched": 0, "suggested": 0, "unmatched": 0}
+    for entry in extracted_data:
+        content = entry.get("content") or {}
+        tests = content.get("tests") or []
+        matches = index.lookup_batch(
+            (test.get("description") or "", test.get("sample_type")) for test in tests
+        )
+        assigned = []
+        for test, match in zip(tests, matches):
+            if match and match["exact"]:
+                counts["matched"] += 1
+                assigned.append({**test, "loinc_code": match["code"]})
+            elif match:
+                counts["suggested"] += 1
+                suggestion = {key: match[key] for key in ("code", "name", "score")}
+                assigned.append(
+                    {"loinc_code": None, **test, "loinc_suggestion": suggestion}
+                )
+            else:
+                counts["unmatched"] += 1
+                assigned.append({"loinc_code": None, **test})
+        # New dicts: the cached and single-flight results stay as the model returned them
+        updated.append({**entry, "content": {**content, "tests": assigned}})
+
+    for result, count in counts.items():
+        LOINC_LOOKUPS.inc(count, result=result)
+    log.info(
+        "Assigned LOINC codes to %d of %d tests (%d suggested).",
+        counts["matched"],
+        sum(counts.values()),
+        counts["suggested"],
+        extra={"event": "loinc", **counts},
+    )
+    return {"extracted_data": updated}
+
+
+# --- Async Nodes ---
+# Same behaviour as the nodes above for `ainvoke`/`astream`: model calls use the
+# shared AsyncOpenAI client, and blocking work (text layer parsing,
+# rasterization, page encoding, cache I/O) runs in worker threads, so one event
+# loop can keep many documents in flight.
+
+
+async def anode_route_document(state: AgentState):
+    """Async version of node_route_document."""
+    return await asyncio.to_thread(node_route_document, state)
+
+
+async def anode_apply_rules(state: AgentState):
+    """Async version of node_apply_rules."""
+    return await asyncio.to_thread(node_apply_rules, state)
+
+
+async def anode_convert_pdf_to_images(state: AgentState):
+    """Async version of node_convert_pdf_to_images."""
+    return await asyncio.to_thread(node_convert_pdf_to_images, state)
+
+
+async def anode_filter_pages(state: AgentState):
+    """Async version of node_filter_pages."""
+    return await asyncio.to_thread(node_filter_pages, state)
+
+
+async def anode_crop_pages(state: AgentState):
+    """Async version of node_crop_pages."""
+    return await asyncio.to_thread(node_crop_pages, state)
+
+
+async def anode_lookup_cache(state: AgentState):
+    """Async version of node_lookup_cache."""
+    return await asyncio.to_thread(node_lookup_cache, state)
+
+
+async def anode_assign_loinc(state: AgentState):
+    """Async version of node_assign_loinc (the first call loads the table)."""
+    return await asyncio.to_thread(node_assign_loinc, state)
+
+
+async def anode_requesty_vision_extraction(state: AgentState):
+    """Async version of node_requesty_vision_extraction."""
+    try:
+        if not state["images"]:
+            log.warning("No images found in state.")
+            return {}
+
+        # Cropping copies pixels: keep it off the event loop
+        images, page_map = await asyncio.to_thread(_upload_pages, state)
+        log.info("Extracting data from %d images using Vision...", len(images))
+
+        model = state.get("model_name", "gpt-4o")
+        result_model, system_prompt_content = _get_extraction_spec(state)
+        variant = _page_variant(state)
 
-        traceback.print_exc()
-        print(
-            f"{RED}[ERROR] Vision Extraction Error: {type(e).__name__}: {str(e)}{RESET}"
+        plan = _plan_batches(
+            state, images, model, system_prompt_content, 1, log_plan=False
         )
+        if len(plan["batches"]) > 1:
+            log.info(
+                "%d pages exceed the single-request budget, extracting in batches.",
+                len(images),
+            )
+            return await anode_requesty_vision_extraction_chunked(state)
+        planner.log_plan(plan, model, page_map)
+        cache_key = state.get("cache_key")
+
+        async def extract():
+            try:
+                extracted_dict, page_payload_bytes, stream_stats = (
+                    await _aextract_from_images(
+                        get_async_client(),
+                        model,
+                        system_prompt_content,
+                        result_model,
+                        images,
+                        on_item=_get_stream_callback(),
+                        page_map=page_map,
+                        page_crops=state.get("page_crops"),
+                    )
+                )
+            except ValueError as parse_error:
+                return {"errors": [str(parse_error)]}
+            update = await asyncio.to_thread(
+                _vision_update,
+                cache_key,
+                extracted_dict,
+                page_payload_bytes,
+                stream_stats,
+            )
+            return {**update, **_filter_savings(state, page_payload_bytes)}
+
+        return await _asingle_flight(
+            state, model, system_prompt_content, variant, extract
+        )
+
+    except Exception as e:
+        log.exception("Vision Extraction Error: %s: %s", type(e).__name__, e)
         return {
             "errors": state["errors"] + [f"Vision Extraction Error: {str(e)}"],
         }
 
 
+async def anode_requesty_vision_extraction_chunked(state: AgentState):
+    """
+    Async version of node_requesty_vision_extraction_chunked: the chunks are
+    extracted as tasks on the event loop, at most max_concurrency at a time.
+    """
+    try:
+        if not state["images"]:
+            log.warning("No images found in state.")
+            return {}
+        images, page_map = await asyncio.to_thread(_upload_pages, state)
+
+        model = state.get("model_name", "gpt-4o")
+        max_concurrency = max(1, state.get("max_concurrency") or VISION_MAX_CONCURRENCY)
+        result_model, system_prompt_content = _get_extraction_spec(state)
+        chunks, variant, source, batch_plan = _split_chunks(
+            state, images, model, system_prompt_content, max_concurrency
+        )
+        cache_key = state.get("cache_key")
+
+        async def extract():
+            log.info(
+                "Extracting %d pages in %d chunks (max %d concurrent)...",
+                len(images),
+                len(chunks),
+                max_concurrency,
+            )
+            client = get_async_client()
+            on_item = _get_stream_callback()
+            slots = asyncio.Semaphore(max_concurrency)
+
+            async def extract_chunk(first_page, chunk_images):
+                async with slots:
+                    return await _aextract_from_images(
+                        client,
+                        model,
+                        system_prompt_content,
+                        result_model,
+                        chunk_images,
+                        first_page=first_page,
+                        total_pages=len(images),
+                        on_item=on_item,
+                        page_map=page_map,
+                        page_crops=state.get("page_crops"),
+                    )
+
+            # Tasks copy the context, so each chunk can publish live items
+            chunk_tasks = [
+                (
+                    first_page,
+                    first_page + len(chunk_images) - 1,
+                    asyncio.ensure_future(extract_chunk(first_page, chunk_images)),
+                )
+                for first_page, chunk_images in chunks
+            ]
+            await asyncio.gather(
+                *(task for _, _, task in chunk_tasks), return_exceptions=True
+            )
+            return await asyncio.to_thread(
+                _chunked_update, state, cache_key, source, batch_plan, chunk_tasks
+            )
+
+        return await _asingle_flight(
+            state, model, system_prompt_content, variant, extract
+        )
+
+    except Exception as e:
+        log.exception("Vision Extraction Error: %s: %s", type(e).__name__, e)
+        return {
+            "errors": state["errors"] + [f"Vision Extraction Error: {str(e)}"],
+        }
+
+
+async def anode_requesty_text_extraction(state: AgentState):
+    """Async version of node_requesty_text_extraction."""
+    try:
+        text_pages = state.get("text_pages") or []
+        if not text_pages:
+            log.warning("No text layer found in state.")
+            return {}
+
+        log.info("Extracting data from the text layer of %d pages...", len(text_pages))
+
+        model = state.get("model_name", "gpt-4o")
+        rule_fields = state.get("rule_fields")
+        result_model, system_prompt_content = _get_extraction_spec(
+            state,
+            input_instructions=load_prompt("text_extraction.md"),
+            resolved_labels=tuple(rule_fields["resolved"]) if rule_fields else (),
+        )
+
+        cache_key, cached_data = await asyncio.to_thread(
+            _lookup_cache, state, model, system_prompt_content, "text"
+        )
+        if cached_data is not None:
+            return {"extracted_data": cached_data, "cache_hit": True}
+
+        async def extract():
+            try:
+                extracted_dict, stream_stats = await _acall_model(
+                    get_async_client(),
+                    model,
+                    system_prompt_content,
+                    _build_text_content(text_pages),
+                    result_model,
+                    on_item=_get_stream_callback(),
+                    pages=len(text_pages),
+                )
+            except ValueError as parse_error:
+                return {"errors": [str(parse_error)]}
+            if rule_fields:
+                extracted_dict = rules.merge_rule_elements(extracted_dict, rule_fields)
+            return await asyncio.to_thread(
+                _text_update, cache_key, extracted_dict, stream_stats
+            )
+
+        return await _asingle_flight(
+            state, model, system_prompt_content, "text", extract
+        )
+
+    except Exception as e:
+        log.exception("Text Extraction Error: %s: %s", type(e).__name__, e)
+        return {
+            "errors": state["errors"] + [f"Text Extraction Error: {str(e)}"],
+        }
+
+
 # --- Workflow Construction ---
 
-# Workflow 1: OCR -> Extraction
 
+def _build_vision_graph(
+    route: Callable,
+    lookup_cache: Callable,
+    vision_extract: Callable,
+    render: Optional[Tuple[Callable, Callable, Callable]],
+    apply_rules: Callable = node_apply_rules,
+    text_extract: Callable = node_requesty_text_extraction,
+    assign_loinc: Callable = node_assign_loinc,
+) -> StateGraph:
+    """
+    The vision workflow graph, shared by every variant:
+
+        route -> text:   apply_rules -> text_extract
+              -> vision: lookup_cache -> miss: [render] -> vision_extract
+                                      -> hit (skips rendering and extraction)
+        -> assign_loinc -> END
+
+    `render` is the (convert_pdf, filter_pages, crop_pages) nodes, or None
+    when vision_extract renders the pages itself (pipelined).
+    """
+    nodes = {
+        "route": route,
+        "apply_rules": apply_rules,
+        "text_extract": text_extract,
+        "lookup_cache": lookup_cache,
+        "vision_extract": vision_extract,
+        "assign_loinc": assign_loinc,
+    }
+    render_steps = ["convert_pdf", "filter_pages", "crop_pages"] if render else []
+    nodes.update(zip(render_steps, render or ()))
+
+    graph = StateGraph(AgentState)
+    for name, node in nodes.items():
+        graph.add_node(name, instrument_node(name)(node))
+
+    graph.set_entry_point("route")
+    graph.add_conditional_edges(
+        "route", select_route, {"text": "apply_rules", "vision": "lookup_cache"}
+    )
+    graph.add_edge("apply_rules", "text_extract")
+    # A hit skips rendering and extraction; the LOINC codes are still assigned
+    vision_steps = render_steps + ["vision_extract"]
+    graph.add_conditional_edges(
+        "lookup_cache",
+        select_cache_route,
+        {"hit": "assign_loinc", "miss": vision_steps[0]},
+    )
+    for step, next_step in zip(vision_steps, vision_steps[1:]):
+        graph.add_edge(step, next_step)
+    graph.add_edge("text_extract", "assign_loinc")
+    graph.add_edge("vision_extract", "assign_loinc")
+    graph.add_edge("assign_loinc", END)
+    return graph
+
+
+_RENDER_NODES = (node_convert_pdf_to_images, node_filter_pages, node_crop_pages)
+
+# Workflow 2: Direct Vision (text layer fast path for digital PDFs)
+workflow_vision = _build_vision_graph(
+    node_route_document,
+    node_lookup_cache,
+    node_requesty_vision_extraction,
+    _RENDER_NODES,
+)
 
-# Workflow 2: Direct Vision
-workflow_vision = StateGraph(AgentState)
-workflow_vision.add_node("convert_pdf", node_convert_pdf_to_images)
-workflow_vision.add_node("vision_extract", node_requesty_vision_extraction)
+# Workflow 3: Concurrent Vision (page chunks)
+workflow_vision_chunked = _build_vision_graph(
+    node_route_document,
+    node_lookup_cache_chunked,
+    node_requesty_vision_extraction_chunked,
+    _RENDER_NODES,
+)
 
-workflow_vision.set_entry_point("convert_pdf")
-workflow_vision.add_edge("convert_pdf", "vision_extract")
+# Workflow 4: Direct Vision, async nodes (use with ainvoke/astream)
+workflow_vision_async = _build_vision_graph(
+    anode_route_document,
+    anode_lookup_cache,
+    anode_requesty_vision_extraction,
+    (anode_convert_pdf_to_images, anode_filter_pages, anode_crop_pages),
+    apply_rules=anode_apply_rules,
+    text_extract=anode_requesty_text_extraction,
+    assign_loinc=anode_assign_loinc,
+)
 
-workflow_vision.add_edge("vision_extract", END)
+# Workflow 5: Pipelined Vision (rasterize, encode and upload overlapped)
+workflow_vision_pipelined = _build_vision_graph(
+    node_route_document,
+    node_lookup_cache_pipelined,
+    node_vision_pipeline,
+    None,
+)
 
 # Compile
 
 app_vision = workflow_vision.compile()
+app_vision_chunked = workflow_vision_chunked.compile()
+app_vision_async = workflow_vision_async.compile()
+app_vision_pipelined = workflow_vision_pipelined.compile()